@@ -3,3 +3,4 @@ from .login import router as login_router
 from .session import router as session_router
 from .chats import router as chats_router
 from .user import router as user_router
+from .metrics import router as metrics_router
@@ -1,31 +1,55 @@
 """ Handles the chat page - both chats preview and the chat itself """
 from datetime import datetime
-from typing import List
+from typing import Dict, List, Optional, Set
 
-from fastapi import (APIRouter, Depends,
+import mysql.connector
+from fastapi import (APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query,
                      Response, WebSocket, WebSocketDisconnect, status)
+from mysql.connector import errorcode
 
 from app.api.session import auth_session
+from app.services.membership_cache import membership_cache
+from app.services.message_archive import message_archive
 from app.services.myredis import SessionData, redis_service
 from app.services.mysqldb import db_service
+from app.services.participant_cache import participant_cache
+from app.services.user_directory import user_directory
 from app.services.websocket_manager import WebSocketConnectionManager, authenticate_websocket
-from app.templates.chats.requests import NewChatData
+from app.templates.chats.requests import AddParticipantsData, NewChatData
 from app.templates.chats.responses import (
-    ChatDetails, ChatMessage, ChatPreview, UserRole)
+    ChatDetails, ChatMessage, ChatPreview, UserInfo, UserRole)
+from app.utils.cursors import (
+    decode_chat_cursor, decode_cursor, encode_chat_cursor, encode_cursor)
+from app.utils.frame_codecs import MSGPACK_SUBPROTOCOL, get_frame_codec
+from app.utils.stream_ids import parse_stream_id, previous_stream_id
 
 router = APIRouter()
 
+DEFAULT_HISTORY_PAGE_SIZE = 15
+MAX_HISTORY_PAGE_SIZE = 100
+PARTICIPANTS_MAX_AGE_SECONDS = 60
+
 
 @router.get("/chats/my-chats", response_model=List[ChatPreview])
 async def get_chat_previews(
+    res: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    before: Optional[str] = None,
     session_data: SessionData = Depends(auth_session)
 ) -> List[ChatPreview]:
-    """ Gets all chats that the authenticated user is participating in.
+    """ Gets chats that the authenticated user is participating in, most recently active first.
 
-    Retrieves the user's chat list from the database and enriches each chat
-    with the last message content and activity timestamp from Redis.
+    Ordering and last messages come from the per-user activity index and the
+    chat:last hash in Redis, which are maintained whenever a message is sent.
+    The index is checked against the user's cached chat ids on the first page,
+    and only rebuilt from the database when they differ, with chats that aren't
+    indexed yet backfilled from their streams. Otherwise the database is only
+    asked for the chats of the page.
 
     Args:
+        res (Response): FastAPI response object used to set the X-Next-Cursor header.
+        limit (Optional[int]): Maximum amount of chats to return. Defaults to all.
+        before (Optional[str]): Cursor from a previous page's X-Next-Cursor header.
         session_data (SessionData): Authenticated user session data containing username.
 
     Returns:
@@ -33,23 +57,93 @@ async def get_chat_previews(
 
     Raises:
         HTTPException: 401 UNAUTHORIZED if session authentication fails via auth_session dependency.
+        HTTPException: 400 BAD REQUEST if before is not a valid cursor.
     """
-    user_chats = await db_service.get_all_user_chats(session_data.username)
+    after = None
+    if before is not None:
+        after = decode_chat_cursor(before)
+        if after is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="INVALID_CURSOR")
+
+    user_id = session_data.user_id
+    member_chat_ids = await membership_cache.get_chat_ids(user_id)
+
+    user_chats = None
+    if after is None:
+        indexed_chat_ids = set(await redis_service.get_indexed_chat_ids(user_id))
+        if indexed_chat_ids != member_chat_ids:
+            user_chats = {
+                chat.chat_id: chat
+                for chat in await db_service.get_all_user_chats(bytes.fromhex(user_id))
+            }
+            await _sync_chat_index(user_id, user_chats, indexed_chat_ids)
+
+    recent_chats = await redis_service.get_recent_chats(user_id, limit, after)
+    if limit is not None and len(recent_chats) == limit:
+        last_chat_id, last_score = recent_chats[-1]
+        res.headers["X-Next-Cursor"] = encode_chat_cursor(last_score, last_chat_id)
+
+    chat_ids = [chat_id for chat_id, _ in recent_chats if chat_id in member_chat_ids]
+    if user_chats is None:
+        user_chats = {
+            chat.chat_id: chat
+            for chat in await db_service.get_user_chats(bytes.fromhex(user_id), chat_ids)
+        }
+    chat_ids = [chat_id for chat_id in chat_ids if chat_id in user_chats]
+    last_messages = await redis_service.get_indexed_last_messages(chat_ids)
+
+    previews = []
+    for chat_id, last_message_data in zip(chat_ids, last_messages):
+        chat = user_chats[chat_id]
+        chat.last_message = last_message_data
+        previews.append(chat)
+
+    return previews
+
+
+async def _sync_chat_index(user_id: str, user_chats: Dict[str, ChatPreview],
+                           indexed_chat_ids: Set[str]) -> None:
+    """ Brings the user's activity index in line with their chats in the database.
+
+    Chats the user has left are removed. Missing chats are added, scored by their
+    last message (backfilling chat:last from the stream tail if needed) or their
+    creation time if they have no messages.
 
-    for chat in user_chats:
-        last_message_data = await redis_service.get_last_message(chat.chat_id)
-        if last_message_data is None:
-            chat.last_message = None
-        else:
-            if last_message_data.sender_id == "SERVER":
-                last_sender_username = "SERVER"
-            else:
-                last_sender_username = await db_service.get_username(
-                    bytes.fromhex(last_message_data.sender_id))
-            last_message_data.sender_username = last_sender_username
-            chat.last_message = last_message_data
+    Args:
+        user_id (str): Hex id of the user.
+        user_chats (Dict[str, ChatPreview]): The user's chats from the database, by id.
+        indexed_chat_ids (Set[str]): Ids of the chats currently in the activity index.
+    """
+    await redis_service.remove_indexed_chats(
+        user_id, [chat_id for chat_id in indexed_chat_ids if chat_id not in user_chats])
 
-    return user_chats
+    missing_chat_ids = [chat_id for chat_id in user_chats if chat_id not in indexed_chat_ids]
+    if not missing_chat_ids:
+        return
+
+    last_messages = dict(zip(
+        missing_chat_ids, await redis_service.get_indexed_last_messages(missing_chat_ids)))
+
+    unindexed_chat_ids = [chat_id for chat_id, msg in last_messages.items() if msg is None]
+    stream_tails = dict(zip(
+        unindexed_chat_ids, await redis_service.get_last_messages(unindexed_chat_ids)))
+
+    backfilled = {
+        chat_id: message for chat_id, message in stream_tails.items() if message is not None
+    }
+    await user_directory.fill_sender_usernames(list(backfilled.values()))
+    await redis_service.store_last_messages(backfilled)
+    last_messages.update(backfilled)
+
+    activities = {}
+    for chat_id in missing_chat_ids:
+        message = last_messages[chat_id]
+        if message is not None:
+            activities[chat_id] = float(message.message_id.split("-")[0])
+        else:
+            created_at = datetime.fromisoformat(user_chats[chat_id].created_at)
+            activities[chat_id] = created_at.timestamp() * 1000
+    await redis_service.add_indexed_chats(user_id, activities)
 
 
 @router.get("/chats/available-chats", response_model=List[ChatPreview])
@@ -70,7 +164,7 @@ async def get_available_chat_previews(
     Raises:
         HTTPException: 401 UNAUTHORIZED if session authentication fails via auth_session dependency.
     """
-    user_chats = await db_service.get_all_user_chats(session_data.username)
+    user_chats = await db_service.get_all_user_chats(bytes.fromhex(session_data.user_id))
 
     return user_chats
 
@@ -78,56 +172,222 @@ async def get_available_chat_previews(
 @router.get("/chats/{chat_id}", response_model=ChatDetails)
 async def get_chat_details(
         chat_id: str,
-        _: SessionData = Depends(auth_session)
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = Query(DEFAULT_HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+        session_data: SessionData = Depends(auth_session)
 ):
-    """ Retrieves the chat history for a specific chat.
+    """ Retrieves a page of the chat history for a specific chat.
+
+    Without a cursor the newest messages are returned together with the chat's
+    participants. Scrolling back passes the previous page's next_cursor as before;
+    catching up on newer messages passes it as after. Paged responses leave out
+    participants, which clients get from /chats/{chat_id}/participants.
 
-    Fetches messages from Redis within the specified range and pagination.
+    Messages come from Redis, falling back to the MySQL archive for messages
+    already trimmed from the stream.
 
     Args:
         chat_id (str): Hex string identifier of the chat.
+        before (Optional[str]): Cursor, only return messages older than it.
+        after (Optional[str]): Cursor, only return the messages right after it.
+        limit (int): Maximum amount of messages to return.
+        session_data (SessionData): Authenticated user session data containing user id.
 
     Returns:
-        List[ChatMessage]: Array of chat messages in the specified chat.
+        ChatDetails: The page of messages, newest first, and the cursor for the next page.
 
     Raises:
         HTTPException: 401 UNAUTHORIZED if session authentication fails via auth_session dependency.
+        HTTPException: 400 BAD REQUEST if a cursor is malformed or both are given.
+        HTTPException: 404 NOT FOUND if the user isn't in the chat.
     """
-    participants = await db_service.get_all_chat_participants(bytes.fromhex(chat_id))
-    messages = await redis_service.get_chat_history(chat_id)
+    if before is not None and after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="BEFORE_AND_AFTER_EXCLUSIVE")
+    await _require_membership(session_data.user_id, chat_id)
+
+    participants = None
+    next_cursor = None
+
+    if after is not None:
+        after_id = _decode_cursor(after)
+        messages = await message_archive.get_chat_history_after(chat_id, after_id, limit)
+        if len(messages) == limit:
+            next_cursor = encode_cursor(messages[-1].message_id)
+        messages.reverse()
+    elif before is not None:
+        before_id = _decode_cursor(before)
+        if parse_stream_id(before_id) == (0, 0):
+            messages = []  # nothing is older than the smallest stream id
+        else:
+            messages = await message_archive.get_chat_history(
+                chat_id, end_id=previous_stream_id(before_id), count=limit)
+    else:
+        participants = (await participant_cache.get_roster(chat_id)).participants
+        messages = await message_archive.get_chat_history(chat_id, count=limit)
 
-    user_id_to_username = {
-        user.user_id: user.username for user in participants
-    }
+    if after is None and len(messages) == limit:
+        next_cursor = encode_cursor(messages[-1].message_id)
 
-    for msg in messages:
-        if msg.sender_id == "SERVER":
-            msg.sender_username = "SERVER"
-        else:
-            msg.sender_username = (user_id_to_username.get(msg.sender_id)) or (
-                await db_service.get_username(msg.sender_id.encode()))
+    await user_directory.fill_sender_usernames(messages)
 
     return ChatDetails(
         chat_id=chat_id,
         participants=participants,
-        messages=messages
+        messages=messages,
+        next_cursor=next_cursor
     )
 
 
+@router.get("/chats/{chat_id}/participants", response_model=List[UserInfo])
+async def get_chat_participants(
+        chat_id: str,
+        if_none_match: Optional[str] = Header(None),
+        session_data: SessionData = Depends(auth_session)
+) -> Response:
+    """ Retrieves all participants of a chat.
+
+    Kept separate from the paged history so clients can cache it while scrolling.
+    Responses carry an ETag, and revalidating with it in If-None-Match returns
+    304 NOT MODIFIED until the chat's membership changes.
+
+    Args:
+        chat_id (str): Hex string identifier of the chat.
+        if_none_match (Optional[str]): ETags of rosters the client already has.
+        session_data (SessionData): Authenticated user session data containing user id.
+
+    Returns:
+        Response: Every user in the chat with their role, or an empty 304.
+
+    Raises:
+        HTTPException: 401 UNAUTHORIZED if session authentication fails via auth_session dependency.
+        HTTPException: 404 NOT FOUND if the user isn't in the chat.
+    """
+    await _require_membership(session_data.user_id, chat_id)
+    roster = await participant_cache.get_roster(chat_id)
+    headers = {
+        "Cache-Control": f"private, max-age={PARTICIPANTS_MAX_AGE_SECONDS}",
+        "ETag": roster.etag,
+    }
+
+    if if_none_match is not None and _etag_matches(if_none_match, roster.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=roster.body, media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """ Checks an If-None-Match header against an ETag, comparing weakly. """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@router.post("/chats/{chat_id}/participants", status_code=status.HTTP_201_CREATED)
+async def add_chat_participants(
+        chat_id: str,
+        req: AddParticipantsData,
+        background_tasks: BackgroundTasks,
+        session_data: SessionData = Depends(auth_session)
+):
+    """ Adds users to an existing group chat.
+
+    All users are inserted in one transaction and announced with one membership
+    event, however many there are. They are notified after the response is sent.
+
+    Args:
+        chat_id (str): Hex string identifier of the chat.
+        req (AddParticipantsData): The users to add, with their roles.
+        background_tasks (BackgroundTasks): Runs the notifications after the response.
+        session_data (SessionData): Authenticated user session data.
+
+    Raises:
+        HTTPException: 401 UNAUTHORIZED if session authentication fails via auth_session dependency.
+        HTTPException: 403 FORBIDDEN if the user isn't an owner or admin of the chat.
+        HTTPException: 409 CONFLICT if one of the users is already in the chat.
+    """
+    chat = await db_service.get_chat_membership(
+        bytes.fromhex(session_data.user_id), bytes.fromhex(chat_id))
+    if chat is None or chat.my_role not in (UserRole.OWNER, UserRole.ADMIN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="NOT_CHAT_ADMIN")
+
+    try:
+        await db_service.add_users_to_chat(bytes.fromhex(chat_id), [
+            (bytes.fromhex(user.user_id), user.role) for user in req.users
+        ])
+    except mysql.connector.Error as e:
+        if e.errno == errorcode.ER_DUP_ENTRY:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="ALREADY_IN_CHAT") from e
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Database operation failed") from e
+
+    await redis_service.add_chat_members(
+        chat_id, [user.user_id for user in req.users], datetime.now().timestamp() * 1000)
+
+    background_tasks.add_task(_notify_added_users, chat, req.users, session_data.user_id)
+
+    return {"status": "success", "chat_id": chat_id}
+
+
+async def _notify_added_users(chat_preview: ChatPreview, users: List[UserInfo],
+                              added_by_id: str) -> None:
+    """ Notifies users added to a chat, each with a preview showing their own role.
+
+    Users are grouped by role, so the preview is serialized and published once per
+    role rather than once per user.
+
+    Args:
+        chat_preview (ChatPreview): The chat users were added to.
+        users (List[UserInfo]): The added users with their roles.
+        added_by_id (str): Hex id of the user that added them.
+    """
+    user_ids_by_role: Dict[UserRole, List[str]] = {}
+    for user in users:
+        user_ids_by_role.setdefault(user.role, []).append(user.user_id)
+
+    for role, user_ids in user_ids_by_role.items():
+        await redis_service.send_added_to_chat_notifications(
+            user_ids, chat_preview.model_copy(update={"my_role": role}), added_by_id)
+
+
+async def _require_membership(user_id: str, chat_id: str) -> None:
+    """ Raises 404 NOT FOUND unless the user is in the chat, hiding whether it exists. """
+    if await membership_cache.is_member(user_id, chat_id):
+        return
+    # the event of a chat the user just joined may not have reached this worker yet
+    membership_cache.forget(user_id)
+    if not await membership_cache.is_member(user_id, chat_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="CHAT_NOT_FOUND")
+
+
+def _decode_cursor(cursor: str) -> str:
+    """ Decodes a history cursor, raising 400 BAD REQUEST if it is malformed. """
+    message_id = decode_cursor(cursor)
+    if message_id is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="INVALID_CURSOR")
+    return message_id
+
+
 @router.post("/chats")
 async def create_new_chat(
         req: NewChatData,
         res: Response,
+        background_tasks: BackgroundTasks,
         session_data: SessionData = Depends(auth_session)
 ):
     """ Creates a new chat and adds the user and other participants.
 
      Creates a new chat in the database, sends a system message to Redis,
      and returns the chat preview to avoid additional database queries.
+     Participants are notified after the response is sent.
 
      Args:
          req (NewChatData): Request data containing chat creation details.
          res (Response): FastAPI response object for setting status code.
+         background_tasks (BackgroundTasks): Runs the notifications after the response.
          session_data (SessionData): Authenticated user session data.
 
      Returns:
@@ -143,6 +403,13 @@ async def create_new_chat(
 
     created_at = await db_service.create_chat(user_id, req)
 
+    # index the chat for every member before the first message bumps it
+    await redis_service.add_chat_members(
+        req.chat_id.hex(),
+        [user_id_hex] + [other_user.user_id for other_user in req.other_users],
+        created_at.timestamp() * 1000
+    )
+
     message_text = f"NEW CHAT CREATED BY @{user_id_hex}"
     message_id = await redis_service.send_system_message(req.chat_id.hex(), message_text)
     res.status_code = status.HTTP_201_CREATED
@@ -164,17 +431,10 @@ async def create_new_chat(
         my_role=UserRole.OWNER
     )
 
-    chat_preview_users = chat_preview
-    chat_preview_users.my_role = UserRole.MEMBER
-
-    # notify user that they have been subscribed to new chat
-    await redis_service.send_added_to_chat_notification(
-        user_id_hex, chat_preview, user_id_hex)
-
-    # notify other users about the new chat
-    for other_user in req.other_users:
-        await redis_service.send_added_to_chat_notification(
-            other_user.user_id, chat_preview_users, user_id_hex)
+    # notify user that they have been subscribed to new chat, and other users about it
+    creator = UserInfo(user_id=user_id_hex, username=session_data.username, role=UserRole.OWNER)
+    background_tasks.add_task(
+        _notify_added_users, chat_preview, [creator] + req.other_users, user_id_hex)
 
     return {"status": "success", "chat_id": chat_preview.chat_id}
 
@@ -189,12 +449,16 @@ async def chat_websocket(websocket: WebSocket):
     if not session_data:
         return
 
-    await websocket.accept()
+    # binary msgpack frames if the client offers that subprotocol, JSON otherwise
+    subprotocol = MSGPACK_SUBPROTOCOL \
+        if MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", []) else None
+    await websocket.accept(subprotocol=subprotocol)
 
     # Initialize connection state
     connection_manager = WebSocketConnectionManager(
         websocket=websocket,
-        session_data=session_data
+        session_data=session_data,
+        codec=get_frame_codec(subprotocol)
     )
 
     try:
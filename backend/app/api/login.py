@@ -2,16 +2,19 @@
 import uuid
 
 from fastapi import APIRouter, Cookie, Response, HTTPException, status
-import bcrypt
 import mysql.connector
 from mysql.connector import errorcode
 from pydantic import BaseModel
 
 from app.services.mysqldb import db_service
-from app.services.myredis import redis_service
+from app.services.password_hasher import PasswordPoolSaturatedError, password_hasher
+from app.services.session_store import session_store
+from app.services.user_directory import user_directory
 
 router = APIRouter()
 
+PASSWORD_POOL_RETRY_AFTER_SECONDS = "1"
+
 
 class SignupLoginData(BaseModel):
     """ Data structure for user authentication requests.
@@ -38,17 +41,23 @@ async def signup(req: SignupLoginData, res: Response) -> None:
         HTTPException: Exception thrown if the username is already taken. (409 CONFLICT)
         HTTPException: Exception thrown if any other error happens with the mysql connector
          (500 INTERNAL SERVER ERROR)
+        HTTPException: Exception thrown if the password pool is saturated.
+         (503 SERVICE UNAVAILABLE)
     """
     # generate unique id
     user_id = uuid.uuid4().bytes
+    db_service.bind_session(user_id.hex())
     # hash the password
-    pass_bytes = req.password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    pass_hash = bcrypt.hashpw(pass_bytes, salt).decode()
+    try:
+        pass_hash = await password_hasher.hash_password(req.password)
+    except PasswordPoolSaturatedError as e:
+        raise _password_pool_saturated() from e
 
     try:
         await db_service.create_user(user_id, req.username, pass_hash)
-        session_id = await redis_service.create_session(user_id, req.username)
+        # the username may be cached as not existing
+        await user_directory.invalidate(user_id, req.username)
+        session_id = await session_store.create_session(user_id, req.username)
         res.set_cookie(
             key="session_id",
             value=session_id,
@@ -76,6 +85,8 @@ async def login(req: SignupLoginData, res: Response) -> None:
     Raises:
        HTTPException: Exception thrown if the username and/or password is incorrect.
         (401 UNAUTHORIZED) 
+       HTTPException: Exception thrown if the password pool is saturated.
+        (503 SERVICE UNAVAILABLE)
     """
     pass_hash = await db_service.get_password(req.username)
 
@@ -83,16 +94,18 @@ async def login(req: SignupLoginData, res: Response) -> None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Username or password is incorrect.")
 
-    pass_bytes = req.password.encode('utf-8')
-    hash_bytes = pass_hash.encode('utf-8')
+    try:
+        password_matches = await password_hasher.check_password(req.password, pass_hash)
+    except PasswordPoolSaturatedError as e:
+        raise _password_pool_saturated() from e
 
-    if not bcrypt.checkpw(pass_bytes, hash_bytes):
+    if not password_matches:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Username or password is incorrect.")
 
-    user_id = await db_service.get_user_id(req.username)
+    user_id = await user_directory.get_user_id(req.username)
 
-    session_id = await redis_service.create_session(user_id, req.username)
+    session_id = await session_store.create_session(user_id, req.username)
     res.set_cookie(
         key="session_id",
         value=session_id,
@@ -105,11 +118,18 @@ async def login(req: SignupLoginData, res: Response) -> None:
 
 @router.post("/logout")
 async def logout(res: Response, session_id: str = Cookie(None)) -> None:
-    """ Logs user out by deleting redis entry for session.
+    """ Logs user out by deleting the session, or revoking its token.
 
     Args:
         res (Response): FastAPI response
         session_id (str, optional): The session id of the user. Defaults to Cookie(None).
     """
-    await redis_service.delete_session(session_id)
+    await session_store.delete_session(session_id)
     res.delete_cookie(key="session_id")
+
+
+def _password_pool_saturated() -> HTTPException:
+    """ Builds the fast 503 returned while the password pool is saturated. """
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Server busy, please try again.",
+                         headers={"Retry-After": PASSWORD_POOL_RETRY_AFTER_SECONDS})
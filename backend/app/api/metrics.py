@@ -0,0 +1,36 @@
+""" Exposes in-process service metrics for monitoring. """
+from fastapi import APIRouter
+
+from app.services.connection_registry import connection_registry
+from app.services.membership_cache import membership_cache
+from app.services.message_archive import message_archive
+from app.services.mysqldb import db_service
+from app.services.participant_cache import participant_cache
+from app.services.password_hasher import password_hasher
+from app.services.pubsub_hub import pubsub_hub
+from app.services.session_store import session_store
+from app.services.user_directory import user_directory
+from app.services.write_combiner import write_combiner
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics() -> dict:
+    """ Returns counters and gauges of this worker's services.
+
+    Returns:
+        dict: Metrics grouped by service.
+    """
+    return {
+        "user_directory": user_directory.stats(),
+        "memberships": membership_cache.stats(),
+        "participants": participant_cache.stats(),
+        "password_pool": password_hasher.stats(),
+        "write_combiner": write_combiner.stats(),
+        "message_archive": message_archive.stats(),
+        "websockets": connection_registry.stats(),
+        "pubsub": pubsub_hub.stats(),
+        "sessions": session_store.stats(),
+        "database": db_service.stats(),
+    }
@@ -1,7 +1,9 @@
 """ This is called by the frontend to check for a valid session. """
 from fastapi import APIRouter, Cookie, Depends, HTTPException, Response, status
 
-from app.services.myredis import SessionData, redis_service
+from app.services.myredis import SessionData
+from app.services.mysqldb import db_service
+from app.services.session_store import session_store
 
 router = APIRouter()
 
@@ -19,18 +21,19 @@ async def auth_session(res: Response, session_id: str | None = Cookie(None)) ->
          - "SESSION_EXPIRED" if the session was found but has expired (cookie will be cleared)
 
      Returns:
-         SessionData: The validated session data stored in Redis.
+         SessionData: The validated session data, from Redis or the signed token.
      """
     if session_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="COOKIE_NOT_PRESENT")
 
-    session_data = await redis_service.get_session(session_id)
+    session_data = await session_store.get_session(session_id)
     if session_data is None:
         res.delete_cookie(key="session_id")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="SESSION_EXPIRED")
 
+    db_service.bind_session(session_data.user_id)
     return session_data
 
 
@@ -4,7 +4,7 @@ import mysql
 
 from app.api.session import auth_session
 from app.services.myredis import SessionData
-from app.services.mysqldb import db_service
+from app.services.user_directory import user_directory
 from app.templates.chats.responses import SelfUser, UserInfo, UserRole
 
 router = APIRouter()
@@ -37,7 +37,7 @@ async def get_new_user_template(
         HTTPException: 500 INTERNAL SERVER_ERROR if a database error occurs.
     """
     try:
-        user_id = await db_service.get_user_id(username)
+        user_id = await user_directory.get_user_id(username)
         if not user_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="User does not exist")
@@ -12,10 +12,21 @@ from app.api import (
     session_router,
     chats_router,
     user_router,
+    metrics_router,
 )
 
+from app.services.connection_registry import connection_registry
+from app.services.membership_cache import membership_cache
+from app.services.message_archive import message_archive
 from app.services.myredis import redis_service
 from app.services.mysqldb import db_service
+from app.services.participant_cache import participant_cache
+from app.services.password_hasher import password_hasher
+from app.services.pubsub_hub import pubsub_hub
+from app.services.session_store import session_store
+from app.services.user_directory import user_directory
+from app.services.write_combiner import write_combiner
+from app.utils.serializer import SerializedJSONResponse, serializer
 from app.utils.service_configs import config_manager
 
 origins = [
@@ -29,21 +40,57 @@ async def lifespan(_ls_app: FastAPI):
     # Startup code
     config_manager.initialize()
     db_config = config_manager.get_db_config()
+    db_pool_config = config_manager.get_db_pool_config()
+    db_replica_configs = config_manager.get_db_replica_configs()
     session_redis_config = config_manager.get_session_redis_config()
     streams_redis_config = config_manager.get_streams_redis_config()
+    pubsub_config = config_manager.get_pubsub_config()
+    user_cache_config = config_manager.get_user_cache_config()
+    membership_cache_config = config_manager.get_membership_cache_config()
+    participant_cache_config = config_manager.get_participant_cache_config()
+    password_pool_config = config_manager.get_password_pool_config()
+    write_combiner_config = config_manager.get_write_combiner_config()
+    retention_config = config_manager.get_retention_config()
+    websocket_config = config_manager.get_websocket_config()
+    serializer_config = config_manager.get_serializer_config()
+    stream_entry_config = config_manager.get_stream_entry_config()
+    session_config = config_manager.get_session_config()
 
-    await db_service.init_db_pool(db_config)
-    redis_service.init_redis(session_redis_config, streams_redis_config)
+    serializer.init_serializer(serializer_config)
+    redis_service.init_redis(session_redis_config, streams_redis_config, stream_entry_config)
+    pubsub_hub.init_hub(pubsub_config)
+    await db_service.init_db_pool(db_config, db_pool_config, db_replica_configs)
+    await session_store.init_store(session_config)
+    await user_directory.init_cache(user_cache_config)
+    await membership_cache.init_cache(membership_cache_config)
+    await participant_cache.init_cache(participant_cache_config)
+    password_hasher.init_pool(password_pool_config)
+    write_combiner.init_combiner(write_combiner_config)
+    message_archive.init_archive(retention_config)
+    connection_registry.init_registry(websocket_config)
 
     yield
     # Shutdown code (optional cleanup)
+    await connection_registry.close()
+    await message_archive.close()
+    await write_combiner.close()
+    await session_store.close()
+    await db_service.close()
+    await pubsub_hub.close()
+    password_hasher.close()
 
-app = FastAPI(title="ChatApp API", version="0.1.0", lifespan=lifespan)
+app = FastAPI(
+    title="ChatApp API",
+    version="0.1.0",
+    lifespan=lifespan,
+    default_response_class=SerializedJSONResponse,
+)
 
 app.include_router(login_router, tags=["login", "signup"])
 app.include_router(session_router, tags=["session", "auth"])
 app.include_router(chats_router, tags=["chat", "group"])
 app.include_router(user_router, tags=["user", "member"])
+app.include_router(metrics_router, tags=["metrics"])
 
 app.add_middleware(
     CORSMiddleware,
@@ -51,4 +98,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
@@ -0,0 +1,173 @@
+""" Tracks this worker's WebSocket connections, and their presence across workers """
+import asyncio
+import math
+import os
+import socket
+import uuid
+from typing import TYPE_CHECKING, Dict, Optional, Set
+
+from app.services.myredis import redis_service
+
+if TYPE_CHECKING:
+    from app.services.websocket_manager import WebSocketConnectionManager
+
+# ordered from most to least lenient, each policy also applies the ones before it
+OVERFLOW_POLICIES = ("drop_typing", "coalesce", "disconnect")
+# upper bounds of the queue depth histogram buckets, as fractions of queue_size
+QUEUE_DEPTH_BUCKETS = (0.25, 0.5, 0.75, 1.0)
+
+
+class ConnectionRegistry:
+    """ Singleton instance holding the live WebSocket connections of this worker.
+
+    When a connection's outbound queue is full, its overflow policy decides
+    what happens to the next frame:
+        drop_typing: drop the oldest queued typing event, else disconnect.
+        coalesce: as drop_typing, but before disconnecting, collapse the queued
+            messages of the busiest chat into one replay from the stream.
+        disconnect: close the connection with a resume hint straight away.
+
+    Every worker is a presence node. The connection count of each user on it is
+    written to Redis whenever it changes, and the node heartbeats every
+    heartbeat_seconds. A node that misses its heartbeats for presence_ttl
+    seconds, e.g. a killed worker, is dropped by the next node that heartbeats,
+    so users can be told apart from those offline everywhere. A failed presence
+    write, or presence lost in Redis, is repaired by syncing the whole node on
+    the next heartbeat.
+    """
+    _instance: Optional['ConnectionRegistry'] = None
+    queue_size: int = 256
+    overflow_policy: str = "coalesce"
+    node_id: str = ""
+    _connections: Set['WebSocketConnectionManager'] = set()
+    _overflows: Dict[str, int] = {}
+    _user_connections: Dict[str, int] = {}
+    _heartbeat_seconds: float = 10.0
+    _presence_ttl: float = 30.0
+    _needs_sync: bool = False
+    _heartbeat_task: Optional[asyncio.Task] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def init_registry(self, websocket_config: dict) -> None:
+        """ Configures outbound queues and starts the presence heartbeat. (call on startup ONLY)
+
+        Args:
+            websocket_config (dict): WebSocket configuration provided by service_configs.
+        """
+        if websocket_config["overflow_policy"] not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown WS_OVERFLOW_POLICY {websocket_config['overflow_policy']!r}, "
+                f"expected one of {', '.join(OVERFLOW_POLICIES)}"
+            )
+
+        self.queue_size = websocket_config["outbound_queue_size"]
+        self.overflow_policy = websocket_config["overflow_policy"]
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._connections = set()
+        self._overflows = {"dropped_typing": 0, "coalesced": 0, "disconnected": 0}
+        self._user_connections = {}
+        self._heartbeat_seconds = websocket_config["presence_heartbeat_seconds"]
+        self._presence_ttl = websocket_config["presence_ttl_seconds"]
+        self._needs_sync = False
+        self._heartbeat_task = asyncio.create_task(self._run_heartbeat())
+
+    async def close(self) -> None:
+        """ Stops the heartbeat and removes this node's presence. """
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+
+        try:
+            await redis_service.sync_presence(self.node_id, {}, 0)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Removing presence of node {self.node_id} failed: {e}")
+
+    async def register(self, connection: 'WebSocketConnectionManager') -> None:
+        """ Adds a connection to the registry and counts it in the user's presence. """
+        self._connections.add(connection)
+        user_id = connection.session_data.user_id
+        self._user_connections[user_id] = self._user_connections.get(user_id, 0) + 1
+        await self._write_presence(user_id)
+
+    async def unregister(self, connection: 'WebSocketConnectionManager') -> None:
+        """ Removes a connection from the registry and from the user's presence. """
+        if connection not in self._connections:
+            return
+        self._connections.discard(connection)
+        user_id = connection.session_data.user_id
+        remaining = self._user_connections.get(user_id, 0) - 1
+        if remaining > 0:
+            self._user_connections[user_id] = remaining
+        else:
+            self._user_connections.pop(user_id, None)
+        await self._write_presence(user_id)
+
+    def record_overflow(self, action: str) -> None:
+        """ Counts an overflow handled by dropped_typing, coalesced or disconnected. """
+        self._overflows[action] = self._overflows.get(action, 0) + 1
+
+    def stats(self) -> dict:
+        """ Returns queue depths across connections and overflow counters for metrics.
+
+        Depths are only reported in aggregate, as /metrics is not authenticated.
+        """
+        return {
+            "node_id": self.node_id,
+            "overflow_policy": self.overflow_policy,
+            "queue_size": self.queue_size,
+            "connections": len(self._connections),
+            "online_users": len(self._user_connections),
+            "overflows": dict(self._overflows),
+            "queue_depths": self._queue_depth_stats(),
+        }
+
+    def _queue_depth_stats(self) -> dict:
+        depths = sorted(len(connection.inbox) for connection in self._connections)
+        histogram = {"empty": 0}
+        histogram.update({f"<={int(bound * 100)}%": 0 for bound in QUEUE_DEPTH_BUCKETS})
+        for depth in depths:
+            if depth == 0:
+                histogram["empty"] += 1
+                continue
+            bound = next((bound for bound in QUEUE_DEPTH_BUCKETS
+                          if depth <= bound * self.queue_size), QUEUE_DEPTH_BUCKETS[-1])
+            histogram[f"<={int(bound * 100)}%"] += 1
+
+        return {
+            "max": depths[-1] if depths else 0,
+            "p95": depths[math.ceil(len(depths) * 0.95) - 1] if depths else 0,
+            "histogram": histogram,
+        }
+
+    async def _write_presence(self, user_id: str) -> None:
+        try:
+            while True:
+                connections = self._user_connections.get(user_id, 0)
+                await redis_service.set_presence(
+                    self.node_id, user_id, connections, self._presence_ttl)
+                # a concurrent write for the user may have landed after this one
+                if self._user_connections.get(user_id, 0) == connections:
+                    return
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Presence update for node {self.node_id} failed: {e}")
+            self._needs_sync = True
+
+    async def _run_heartbeat(self) -> None:
+        while True:
+            try:
+                lost = await redis_service.heartbeat_presence(self.node_id, self._presence_ttl)
+                if lost or self._needs_sync:
+                    self._needs_sync = False
+                    await redis_service.sync_presence(
+                        self.node_id, dict(self._user_connections), self._presence_ttl)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Presence heartbeat of node {self.node_id} failed: {e}")
+                self._needs_sync = True
+            await asyncio.sleep(self._heartbeat_seconds)
+
+
+connection_registry = ConnectionRegistry()
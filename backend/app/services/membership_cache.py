@@ -0,0 +1,103 @@
+""" Shared cache of the chats each user is a member of """
+from typing import FrozenSet, Optional, Set
+
+from app.services.myredis import MEMBERSHIP_CHANNEL, redis_service
+from app.services.mysqldb import db_service
+from app.services.pubsub_hub import pubsub_hub
+from app.utils.serializer import serializer
+from app.utils.ttl_cache import TTLCache
+
+
+class MembershipCache:
+    """ Singleton instance answering which chats a user is in without MySQL.
+
+    The chat ids of a user live in a Redis set, loaded from MySQL on a miss, and
+    are mirrored in-process for a short TTL. Membership writes delete the Redis
+    set and bump the user's version, so a load racing the write can't store the
+    memberships from before it, then publish on MEMBERSHIP_CHANNEL, which drops
+    the mirrored entries on every worker.
+    """
+    _instance: Optional['MembershipCache'] = None
+    _mirror: Optional[TTLCache] = None
+    _redis_ttl: int = 86400
+    _generation: int = 0
+    _loads: int = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    async def init_cache(self, membership_cache_config: dict) -> None:
+        """ Creates the mirror and listens for membership changes. (call on startup ONLY)
+
+        Args:
+            membership_cache_config (dict): Membership cache configuration provided
+                by service_configs.
+        """
+        self._mirror = TTLCache(membership_cache_config["max_size"],
+                                membership_cache_config["ttl"])
+        self._redis_ttl = membership_cache_config["redis_ttl"]
+        await pubsub_hub.subscribe(MEMBERSHIP_CHANNEL, self._handle_membership_change)
+        pubsub_hub.add_gap_listener(self._handle_gap)
+
+    async def get_chat_ids(self, user_id: str) -> FrozenSet[str]:
+        """ Gets the ids of every chat a user is in.
+
+        Args:
+            user_id (str): Hex id of the user.
+
+        Returns:
+            FrozenSet[str]: Hex ids of the chats, group chats and DMs.
+        """
+        chat_ids = self._mirror.get(user_id)
+        if chat_ids is not None:
+            return chat_ids
+
+        generation = self._generation
+        cached_ids, version = await redis_service.get_membership(user_id)
+        if cached_ids is None:
+            self._loads += 1
+            cached_ids = set(await db_service.get_user_chat_ids(bytes.fromhex(user_id)))
+            await redis_service.store_membership(user_id, cached_ids, version, self._redis_ttl)
+
+        chat_ids = frozenset(cached_ids)
+        # a change announced while loading may not be included, let the next lookup retry
+        if generation == self._generation:
+            self._mirror.set(user_id, chat_ids)
+        return chat_ids
+
+    async def is_member(self, user_id: str, chat_id: Optional[str]) -> bool:
+        """ Checks if a user is part of a chat.
+
+        Args:
+            user_id (str): Hex id of the user.
+            chat_id (Optional[str]): Hex id of the chat.
+        """
+        return chat_id in await self.get_chat_ids(user_id)
+
+    def forget(self, user_id: str) -> None:
+        """ Drops a user's mirrored chat ids on this worker. """
+        self._mirror.pop(user_id)
+
+    def stats(self) -> dict:
+        """ Returns mirror hit/miss counters and the number of loads from MySQL. """
+        return {
+            "mirror": self._mirror.stats(),
+            "database_loads": self._loads,
+        }
+
+    def _handle_membership_change(self, _channel: str, data: str) -> None:
+        event = serializer.loads(data)
+        self._generation += 1
+        for user_id in event.get("added", []) + event.get("removed", []):
+            self._mirror.pop(user_id)
+
+    def _handle_gap(self, channels: Set[str], _since: float) -> None:
+        if MEMBERSHIP_CHANNEL in channels:
+            # changes may have been missed, nothing mirrored can be trusted
+            self._generation += 1
+            self._mirror.clear()
+
+
+membership_cache = MembershipCache()
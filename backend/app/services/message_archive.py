@@ -0,0 +1,222 @@
+""" Moves old chat messages from Redis streams into MySQL and reads across both """
+import asyncio
+import time
+from typing import List, Optional
+
+from app.services.myredis import redis_service
+from app.services.mysqldb import db_service
+from app.templates.chats.responses import ChatMessage
+from app.utils.stream_ids import (MAX_STREAM_SEQ, next_stream_id, parse_stream_id,
+                                  previous_stream_id)
+
+# MINID ~ only leaves behind part of one stream node (stream-node-max-entries,
+# 100 by default), so the archived overlap at the head of a stream stays small
+MAX_UNTRIMMED_OVERLAP = 1000
+
+
+class MessageArchive:
+    """ Singleton instance running the stream archiver and serving chat history.
+
+    Each chat stream keeps its newest messages in Redis according to a retention
+    policy (a per-chat override, or the configured default). A background task
+    copies older messages into the MySQL messages table in batched inserts, then
+    trims them from the stream with MINID ~. Only one worker archives at a time.
+    """
+    _instance: Optional['MessageArchive'] = None
+    _max_len: Optional[int] = None
+    _max_age_seconds: Optional[int] = None
+    _interval_seconds: int = 300
+    _batch_size: int = 500
+    _task: Optional[asyncio.Task] = None
+    _archived_messages: int = 0
+    _failed_chats: int = 0
+    _runs: int = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def init_archive(self, retention_config: dict) -> None:
+        """ Starts the background archiver. (call on startup ONLY)
+
+        Args:
+            retention_config (dict): Retention configuration provided by service_configs.
+        """
+        self._max_len = retention_config["max_len"]
+        self._max_age_seconds = retention_config["max_age_seconds"]
+        self._interval_seconds = retention_config["interval_seconds"]
+        self._batch_size = retention_config["batch_size"]
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ Stops the background archiver. """
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def get_chat_history(
+        self,
+        chat_id: str,
+        start_id: Optional[str] = None,
+        end_id: Optional[str] = None,
+        count: int = 15,
+    ) -> List[ChatMessage]:
+        """ Gets history of chat, newest first, from the stream and then the archive.
+
+        Args:
+            chat_id (str): The id of the chat stream
+            start_id (Optional[str]): Starting message ID (inclusive). Defaults to earliest.
+            end_id (Optional[str]): Ending message ID (inclusive). Defaults to latest.
+            count (int): Amount of messages to retrieve. Defaults to 15.
+        """
+        messages = await redis_service.get_chat_history(chat_id, start_id, end_id, count)
+        if len(messages) >= count:
+            return messages
+
+        if await redis_service.get_archived_until(chat_id) is None:
+            return messages
+
+        # continue strictly below the oldest hot message, so overlap with
+        # archived-but-untrimmed stream entries is never returned twice
+        if messages:
+            archive_end = parse_stream_id(previous_stream_id(messages[-1].message_id))
+        elif end_id is not None:
+            archive_end = parse_stream_id(end_id, default_seq=MAX_STREAM_SEQ)
+        else:
+            archive_end = None
+
+        archive_start = parse_stream_id(start_id) if start_id is not None else None
+
+        messages.extend(await db_service.get_archived_messages(
+            bytes.fromhex(chat_id), archive_start, archive_end, count - len(messages)))
+        return messages
+
+    async def get_chat_history_after(
+        self,
+        chat_id: str,
+        after_id: str,
+        count: int = 15,
+    ) -> List[ChatMessage]:
+        """ Gets the messages sent after a given message, oldest first, from the archive
+        and then the stream.
+
+        Args:
+            chat_id (str): The id of the chat stream
+            after_id (str): Message id to start after (exclusive).
+            count (int): Amount of messages to retrieve. Defaults to 15.
+        """
+        messages = []
+
+        archived_until = await redis_service.get_archived_until(chat_id)
+        if archived_until is not None and \
+                parse_stream_id(after_id) < parse_stream_id(archived_until):
+            messages = await db_service.get_archived_messages(
+                bytes.fromhex(chat_id),
+                parse_stream_id(next_stream_id(after_id)),
+                parse_stream_id(archived_until),
+                count,
+                oldest_first=True
+            )
+            if len(messages) >= count:
+                return messages
+            # the archive is exhausted, skip stream entries it already covers
+            after_id = archived_until
+
+        messages.extend(await redis_service.get_messages_after(
+            chat_id, after_id, count - len(messages)))
+        return messages
+
+    async def archive_all(self) -> int:
+        """ Archives every chat stream that exceeds its retention policy.
+
+        A chat that fails to archive is logged and skipped, so it doesn't hold
+        back the chats after it; the next run tries it again.
+
+        Returns:
+            int: Amount of messages archived.
+        """
+        archived = 0
+        cursor = 0
+        while True:
+            cursor, chat_ids = await redis_service.scan_chat_streams(cursor, self._batch_size)
+
+            lengths = await redis_service.get_stream_lengths(chat_ids)
+            policies = await redis_service.get_retention_policies(chat_ids)
+            for chat_id, length, policy in zip(chat_ids, lengths, policies):
+                try:
+                    archived += await self.archive_chat(chat_id, length, policy)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    self._failed_chats += 1
+                    print(f"Archiving chat {chat_id} failed: {e}")
+
+            if cursor == 0:
+                return archived
+
+    async def archive_chat(self, chat_id: str, length: int, policy: Optional[dict]) -> int:
+        """ Archives and trims the messages of one chat that fall outside its policy.
+
+        Args:
+            chat_id (str): The id of the chat stream
+            length (int): Current length of the stream.
+            policy (Optional[dict]): The chat's retention override, None for the default.
+
+        Returns:
+            int: Amount of messages archived.
+        """
+        max_len = policy["max_len"] if policy is not None else self._max_len
+        max_age_seconds = policy["max_age_seconds"] if policy is not None \
+            else self._max_age_seconds
+
+        # approximate trimming can leave already archived messages at the head
+        archived_until = await redis_service.get_archived_until(chat_id)
+        if archived_until is not None:
+            length -= await redis_service.count_messages_until(
+                chat_id, archived_until, MAX_UNTRIMMED_OVERLAP)
+
+        excess = length - max_len if max_len is not None else 0
+        min_ms = (time.time() - max_age_seconds) * 1000 if max_age_seconds is not None else 0
+
+        archived = 0
+        while True:
+            oldest = await redis_service.get_oldest_messages(
+                chat_id, self._batch_size, archived_until)
+
+            # both limits select a prefix of the stream, archive the longer one
+            expired = sum(
+                1 for message in oldest if parse_stream_id(message.message_id)[0] < min_ms)
+            batch = oldest[:max(min(excess - archived, len(oldest)), expired)]
+            if not batch:
+                break
+
+            archived_until = batch[-1].message_id
+            await db_service.archive_messages(bytes.fromhex(chat_id), batch)
+            await redis_service.trim_chat_history(chat_id, archived_until)
+            archived += len(batch)
+
+            if len(batch) < self._batch_size:
+                break
+
+        self._archived_messages += archived
+        return archived
+
+    def stats(self) -> dict:
+        """ Returns archiver counters for metrics. """
+        return {
+            "runs": self._runs,
+            "archived_messages": self._archived_messages,
+            "failed_chats": self._failed_chats,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if await redis_service.acquire_archiver_lock(self._interval_seconds):
+                    self._runs += 1
+                    await self.archive_all()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Stream archiver run failed: {e}")
+            await asyncio.sleep(self._interval_seconds)
+
+
+message_archive = MessageArchive()
@@ -1,18 +1,303 @@
 """ Accesses redis for sessions / pubsub functionality """
-from contextlib import asynccontextmanager
 from datetime import datetime
-import json
 import time
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple, Union
 import uuid
 
 from pydantic import BaseModel
 from redis.asyncio import ConnectionPool, Redis
+from redis.asyncio.client import PubSub
+from redis.commands.core import AsyncScript
 import redis.asyncio as redis
 
 from app.templates.chats.responses import ChatMessage, ChatPreview
+from app.utils.serializer import serializer
+from app.utils.stream_ids import (
+    MAX_STREAM_MS, MAX_STREAM_SEQ, next_stream_id, parse_stream_id)
 
 SESSION_TTL_SECONDS = 86400  # 24 hours
+REVOKED_TOKENS_KEY = "session:revoked"
+
+# Stream entry formats, readers understand both:
+#   1: sender_id (hex), content, timestamp (ISO string)
+#   2: v, s (raw 16 byte sender id, empty for system messages), c (content). The
+#      timestamp is derived from the entry id, which already holds the milliseconds
+STREAM_ENTRY_VERSION = 2
+
+LAST_MESSAGE_KEY = "chat:last"
+# sorted set of chat ids scored by their last message (unix ms), which the activity
+# index of each user is brought up to date from when they load their chats
+CHAT_ACTIVITY_KEY = "chat:activity"
+# one event per batch of users added to a chat, for caches of chat memberships
+MEMBERSHIP_CHANNEL = "chat:membership"
+# set member marking a user's cached chat ids as loaded, so no chats isn't a miss
+MEMBERSHIP_LOADED = ""
+LAST_MESSAGE_PREVIEW_CHARS = 100
+
+# sorted set of worker nodes, scored by when their last heartbeat expires (ms)
+PRESENCE_NODES_KEY = "presence:nodes"
+
+RETENTION_POLICY_KEY = "chat:retention"
+ARCHIVED_UNTIL_KEY = "chat:archived"
+ARCHIVER_LOCK_KEY = "stream_archiver:lock"
+
+# Appends a message to a chat stream and, in the same atomic step, records it in the
+# chat:last hash, bumps the chat in chat:activity and publishes it to live
+# subscribers. One round trip, and the stream and Pub/Sub can't disagree about
+# whether a message was sent. The per-user activity indexes are left to
+# RECENT_CHATS_SCRIPT, so a send costs the same however many members a chat has.
+# Format 2 entries don't store a timestamp, so the one published and put in chat:last
+# is derived from the entry id in the same way _format_stream_entry does, shifted
+# to the local time of the sending worker.
+# KEYS: stream, chat:last hash, chat:activity sorted set
+# ARGV: chat_id, sender_id, sender_username, content, timestamp (format 1),
+#       preview content, entry version, raw sender id, local UTC offset in seconds
+SEND_MESSAGE_SCRIPT = """
+local function iso_timestamp(ms)
+    local seconds = math.floor(ms / 1000)
+    local days = math.floor(seconds / 86400)
+    local time = seconds - days * 86400
+    -- civil date of a day count since 1970-01-01, in the proleptic Gregorian calendar
+    local z = days + 719468
+    local era = math.floor(z / 146097)
+    local doe = z - era * 146097
+    local yoe = math.floor(
+        (doe - math.floor(doe / 1460) + math.floor(doe / 36524) - math.floor(doe / 146096)) / 365)
+    local doy = doe - (365 * yoe + math.floor(yoe / 4) - math.floor(yoe / 100))
+    local mp = math.floor((5 * doy + 2) / 153)
+    local month = mp < 10 and mp + 3 or mp - 9
+    local year = yoe + era * 400 + (month <= 2 and 1 or 0)
+    return string.format('%04d-%02d-%02dT%02d:%02d:%02d.%03d000', year, month,
+        doy - math.floor((153 * mp + 2) / 5) + 1, math.floor(time / 3600),
+        math.floor(time % 3600 / 60), time % 60, ms % 1000)
+end
+
+local message_id
+local timestamp = ARGV[5]
+if ARGV[7] == '2' then
+    message_id = redis.call('XADD', KEYS[1], '*', 'v', '2', 's', ARGV[8], 'c', ARGV[4])
+else
+    message_id = redis.call('XADD', KEYS[1], '*',
+        'sender_id', ARGV[2], 'content', ARGV[4], 'timestamp', ARGV[5])
+end
+local activity = tonumber(string.match(message_id, '^(%d+)'))
+if ARGV[7] == '2' then
+    timestamp = iso_timestamp(activity + tonumber(ARGV[9]) * 1000)
+end
+
+redis.call('HSET', KEYS[2], ARGV[1], cjson.encode({
+    id = message_id, sid = ARGV[2], u = ARGV[3], c = ARGV[6], ts = timestamp
+}))
+redis.call('ZADD', KEYS[3], activity, ARGV[1])
+
+-- the final client frame, built once here and forwarded untouched by every
+-- subscriber; message_id comes first so listeners can find it without parsing
+redis.call('PUBLISH', ARGV[1], '{"type":"message","data":{"chat_id":' .. cjson.encode(ARGV[1])
+    .. ',"message":{"message_id":"' .. message_id
+    .. '","sender_id":' .. cjson.encode(ARGV[2])
+    .. ',"sender_username":' .. cjson.encode(ARGV[3])
+    .. ',"content":' .. cjson.encode(ARGV[4])
+    .. ',"timestamp":' .. cjson.encode(timestamp) .. '}}}')
+
+return message_id
+"""
+
+
+# Gets a page of a user's chats, most recently active first. The first page raises
+# the score of every indexed chat to its score in chat:activity; later pages read
+# the index as it was then, so chats don't move between pages while paging. Chats
+# with the same score are ordered by descending id, and the cursor holds both.
+# KEYS: user activity index, chat:activity sorted set
+# ARGV: refresh ('1' or '0'), limit (0 for all), cursor score ('' for the first
+#       page), cursor chat id
+RECENT_CHATS_SCRIPT = """
+if ARGV[1] == '1' then
+    local chat_ids = redis.call('ZRANGE', KEYS[1], 0, -1)
+    for i = 1, #chat_ids, 1000 do
+        local chunk = {unpack(chat_ids, i, math.min(i + 999, #chat_ids))}
+        local scores = redis.call('ZMSCORE', KEYS[2], unpack(chunk))
+        local updates = {}
+        for j = 1, #chunk do
+            if scores[j] then
+                updates[#updates + 1] = scores[j]
+                updates[#updates + 1] = chunk[j]
+            end
+        end
+        if #updates > 0 then
+            redis.call('ZADD', KEYS[1], 'GT', unpack(updates))
+        end
+    end
+end
+
+local offset = 0
+if ARGV[3] ~= '' then
+    offset = redis.call('ZCOUNT', KEYS[1], '(' .. ARGV[3], '+inf')
+    for _, chat_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[3], ARGV[3])) do
+        if chat_id >= ARGV[4] then
+            offset = offset + 1
+        end
+    end
+end
+
+local stop = -1
+if ARGV[2] ~= '0' then
+    stop = offset + tonumber(ARGV[2]) - 1
+end
+return redis.call('ZREVRANGE', KEYS[1], offset, stop, 'WITHSCORES')
+"""
+
+
+# Slides the expiry of a session and records its last activity, unless the session
+# was deleted since, which would otherwise recreate it as a partial hash.
+# KEYS: session hash
+# ARGV: last activity timestamp, ttl seconds
+TOUCH_SESSION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], 'last_activity', ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+
+
+# Stores the chat ids of a user loaded from MySQL, unless a membership write bumped
+# the user's version since the load started, which the loaded ids may predate.
+# KEYS: membership set, membership version
+# ARGV: version at load time, ttl seconds, chat ids (starting with MEMBERSHIP_LOADED)
+STORE_MEMBERSHIP_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV, 1000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+# Presence is kept per node and mirrored per user: presence:node:<node> maps user
+# ids to their connection count on the node, presence:user:<user> maps node ids to
+# the same count. Every key a script touches is passed in KEYS, so callers read a
+# node's users first (HKEYS) and scripts that rewrite the node check that the list
+# is still complete, returning 0 for the caller to read it again if it isn't.
+# Expiry times use the server clock, so node clocks can drift.
+_PRESENCE_LUA = """
+local function now_ms()
+    local now = redis.call('TIME')
+    return tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+end
+
+-- whether the user ids ARGV[first], ARGV[first + step], ... cover every user in
+-- the node hash KEYS[2]
+local function lists_node_users(first, step)
+    local listed = {}
+    for i = first, #ARGV, step do
+        listed[ARGV[i]] = true
+    end
+    for _, user in ipairs(redis.call('HKEYS', KEYS[2])) do
+        if not listed[user] then
+            return false
+        end
+    end
+    return true
+end
+"""
+
+# Records the connection count of one user on a node, and keeps the node alive.
+# Only heartbeats add a node, so one whose presence was lost notices and syncs.
+# KEYS: presence nodes, node hash, user hash
+# ARGV: node id, user id, connection count, ttl ms
+SET_PRESENCE_SCRIPT = _PRESENCE_LUA + """
+if tonumber(ARGV[3]) > 0 then
+    redis.call('HSET', KEYS[2], ARGV[2], ARGV[3])
+    redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+else
+    redis.call('HDEL', KEYS[2], ARGV[2])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+end
+redis.call('ZADD', KEYS[1], 'XX', now_ms() + tonumber(ARGV[4]), ARGV[1])
+"""
+
+# Keeps a node alive. Returns whether the node wasn't known, i.e. its presence was
+# lost and has to be synced again, followed by the other nodes whose heartbeat
+# expired, for the caller to forget with FORGET_PRESENCE_NODE_SCRIPT.
+# KEYS: presence nodes
+# ARGV: node id, ttl ms
+HEARTBEAT_PRESENCE_SCRIPT = _PRESENCE_LUA + """
+local now = now_ms()
+local result = {redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])}
+for _, node in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)) do
+    table.insert(result, node)
+end
+return result
+"""
+
+# Forgets a node whose heartbeat expired, unless it heartbeated again meanwhile.
+# Returns 1 once forgotten (or alive again), 0 if the node has users not listed.
+# KEYS: presence nodes, node hash, user hash of every listed user
+# ARGV: node id, user ids
+FORGET_PRESENCE_NODE_SCRIPT = _PRESENCE_LUA + """
+local expires = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if expires and tonumber(expires) > now_ms() then
+    return 1
+end
+if not lists_node_users(2, 1) then
+    return 0
+end
+for i = 3, #KEYS do
+    redis.call('HDEL', KEYS[i], ARGV[1])
+end
+redis.call('DEL', KEYS[2])
+redis.call('ZREM', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Replaces the presence of a node with its current connection counts, or removes
+# the node when its ttl is 0. Returns 1 once replaced, 0 if the node has users not
+# listed.
+# KEYS: presence nodes, node hash, user hash of every listed user
+# ARGV: node id, ttl ms, user id and connection count pairs, with a count of 0
+#       for users that are to be removed
+SYNC_PRESENCE_SCRIPT = _PRESENCE_LUA + """
+if not lists_node_users(3, 2) then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+for i = 3, #ARGV, 2 do
+    local user_key = KEYS[(i + 3) / 2]
+    if ARGV[2] ~= '0' and tonumber(ARGV[i + 1]) > 0 then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call('HSET', user_key, ARGV[1], ARGV[i + 1])
+    else
+        redis.call('HDEL', user_key, ARGV[1])
+    end
+end
+if ARGV[2] == '0' then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+else
+    redis.call('ZADD', KEYS[1], now_ms() + tonumber(ARGV[2]), ARGV[1])
+end
+return 1
+"""
+
+# Returns the users connected to at least one node whose heartbeat hasn't expired.
+# KEYS: presence nodes, user hash of every user
+# ARGV: user ids
+ONLINE_USERS_SCRIPT = _PRESENCE_LUA + """
+local now = now_ms()
+local online = {}
+for i, user in ipairs(ARGV) do
+    for _, node in ipairs(redis.call('HKEYS', KEYS[i + 1])) do
+        local expires = redis.call('ZSCORE', KEYS[1], node)
+        if expires and tonumber(expires) > now then
+            table.insert(online, user)
+            break
+        end
+    end
+end
+return online
+"""
 
 
 class SessionData(BaseModel):
@@ -37,23 +322,63 @@ class RedisService:
     _streams_pool: Optional[ConnectionPool] = None
     _sessions_redis: Optional[Redis] = None
     _streams_redis: Optional[Redis] = None
+    _streams_raw_pool: Optional[ConnectionPool] = None
+    _streams_raw_redis: Optional[Redis] = None
+    _send_message_script: Optional[AsyncScript] = None
+    _touch_session_script: Optional[AsyncScript] = None
+    _store_membership_script: Optional[AsyncScript] = None
+    _set_presence_script: Optional[AsyncScript] = None
+    _heartbeat_presence_script: Optional[AsyncScript] = None
+    _sync_presence_script: Optional[AsyncScript] = None
+    _forget_presence_node_script: Optional[AsyncScript] = None
+    _online_users_script: Optional[AsyncScript] = None
+    _stream_entry_version: int = STREAM_ENTRY_VERSION
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def init_redis(self, session_redis_config: dict, streams_redis_config: dict) -> None:
+    def init_redis(self, session_redis_config: dict, streams_redis_config: dict,
+                   stream_entry_config: Optional[dict] = None) -> None:
         """ Initialises redis/valkey 
 
         Args:
             redis_config (dict): Redis configuration provided by service_configs.
+            stream_entry_config (Optional[dict]): Stream entry format provided by
+                service_configs. Defaults to STREAM_ENTRY_VERSION.
         """
         self._sessions_pool = ConnectionPool(**session_redis_config)
         self._streams_pool = ConnectionPool(**streams_redis_config)
+        # stream entries may hold binary fields, so they are read without decoding
+        self._streams_raw_pool = ConnectionPool(
+            **{**streams_redis_config, "decode_responses": False})
 
         self._sessions_redis = redis.Redis(connection_pool=self._sessions_pool)
         self._streams_redis = redis.Redis(connection_pool=self._streams_pool)
+        self._streams_raw_redis = redis.Redis(connection_pool=self._streams_raw_pool)
+
+        if stream_entry_config is not None:
+            self._stream_entry_version = stream_entry_config["version"]
+
+        self._send_message_script = self._streams_redis.register_script(
+            SEND_MESSAGE_SCRIPT)
+        self._recent_chats_script = self._streams_redis.register_script(
+            RECENT_CHATS_SCRIPT)
+        self._touch_session_script = self._sessions_redis.register_script(
+            TOUCH_SESSION_SCRIPT)
+        self._store_membership_script = self._streams_redis.register_script(
+            STORE_MEMBERSHIP_SCRIPT)
+        self._set_presence_script = self._streams_redis.register_script(
+            SET_PRESENCE_SCRIPT)
+        self._heartbeat_presence_script = self._streams_redis.register_script(
+            HEARTBEAT_PRESENCE_SCRIPT)
+        self._sync_presence_script = self._streams_redis.register_script(
+            SYNC_PRESENCE_SCRIPT)
+        self._forget_presence_node_script = self._streams_redis.register_script(
+            FORGET_PRESENCE_NODE_SCRIPT)
+        self._online_users_script = self._streams_redis.register_script(
+            ONLINE_USERS_SCRIPT)
 
     # =============== SESSION METHODS ===============
 
@@ -75,12 +400,10 @@ class RedisService:
             last_activity=time.time()
         )
 
-        await self._sessions_redis.hset(
-            f"session:{session_id}",
-            mapping=session_data.model_dump()
-        )
-
-        await self._sessions_redis.expire(f"session:{session_id}", SESSION_TTL_SECONDS)
+        async with self._sessions_redis.pipeline() as pipe:
+            pipe.hset(f"session:{session_id}", mapping=session_data.model_dump())
+            pipe.expire(f"session:{session_id}", SESSION_TTL_SECONDS)
+            await pipe.execute()
 
         return session_id
 
@@ -118,53 +441,66 @@ class RedisService:
 
         await self._sessions_redis.delete(session_key)
 
-    # =============== CHAT METHODS ===============
+    async def touch_sessions(self, activity: Dict[str, float]) -> None:
+        """ Records the last activity of several sessions and restarts their expiry,
+        in one round trip. Sessions deleted in the meantime are skipped.
 
-    @asynccontextmanager
-    async def subscribe_to_channel(self, channel_id: str):
-        """ Context manager for subscribing to Pub/Sub channels
+        Args:
+            activity (Dict[str, float]): Mapping of session id to last activity timestamp.
+        """
+        if not activity:
+            return
+
+        async with self._sessions_redis.pipeline(transaction=False) as pipe:
+            for session_id, last_activity in activity.items():
+                await self._touch_session_script(
+                    keys=[f"session:{session_id}"],
+                    args=[last_activity, SESSION_TTL_SECONDS],
+                    client=pipe
+                )
+            await pipe.execute()
+
+    async def revoke_session_token(self, token_id: str, expires_at: float) -> None:
+        """ Adds a signed session token to the revocation set until it expires.
 
         Args:
-            channel_id (str): The id of the channel being subscribed to.
+            token_id (str): The jti claim of the token.
+            expires_at (float): Unix timestamp the token expires at anyway.
+        """
+        async with self._sessions_redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(REVOKED_TOKENS_KEY, {token_id: expires_at})
+            pipe.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", time.time())
+            await pipe.execute()
+
+    async def get_revoked_session_tokens(self) -> Dict[str, float]:
+        """ Gets the revoked session tokens that haven't expired yet.
+
+        Returns:
+            Dict[str, float]: Mapping of token id to its expiry timestamp.
+        """
+        revoked = await self._sessions_redis.zrangebyscore(
+            REVOKED_TOKENS_KEY, time.time(), "+inf", withscores=True)
+        return dict(revoked)
+
+    # =============== CHAT METHODS ===============
+
+    def create_pubsub(self) -> PubSub:
+        """ Creates a Pub/Sub instance on the streams connection pool.
 
-        Yields:
-            PubSub: Redis pubsub instance. 
+        Returns:
+            PubSub: Redis pubsub instance. Caller is responsible for closing it.
         """
-        pubsub = self._streams_redis.pubsub()
-        try:
-            await pubsub.subscribe(channel_id)
-            yield pubsub
-        finally:
-            await pubsub.unsubscribe(channel_id)
-            await pubsub.close()
+        return self._streams_redis.pubsub()
 
     async def send_system_message(self, chat_id: str, message: str) -> str:
-        """ Logs a system message to the chat's stream then sends via Redis PubSub.
+        """ Logs a system message to the chat's stream and sends it via Redis PubSub.
         Args:
             chat_id (str): Hex id of the chat to send the message to.
 
         Returns:
             str: Id of the message just sent.
         """
-        message_dict = {
-            "sender_id": "SERVER",
-            "content": message,
-            "timestamp": datetime.now().isoformat()
-        }
-        message_id = await self._streams_redis.xadd(chat_id, message_dict)
-
-        pubsub_mssg = {
-            "type": "message",
-            "message_id": message_id,
-            "sender_id": "SERVER",
-            "sender_username": "SERVER",
-            "content": message,
-            "timestamp": message_dict["timestamp"]
-        }
-        message_json = json.dumps(pubsub_mssg)
-        await self._streams_redis.publish(chat_id, message_json)
-
-        return message_id
+        return await self._send_message(chat_id, "SERVER", "SERVER", message)
 
     async def send_chat_message(
             self,
@@ -173,12 +509,12 @@ class RedisService:
             sender_username: str,
             message: str
     ) -> str:
-        """ Log a message to the chat's stream.
+        """ Log a message to the chat's stream and send it via Redis PubSub.
 
-        Note - The username is only sent to the pubsub service, when the message
-        is logged to the stream the sender is only identified by id. This makes sure
-        the username is always correct if a user changes their name after messages
-        have already been sent.
+        Note - The username is only sent to the pubsub service and the chat:last
+        preview, when the message is logged to the stream the sender is only identified
+        by id. This makes sure the username is always correct if a user changes their
+        name after messages have already been sent.
 
         Args:
             chat_id (str): Id of the chat to send to.
@@ -189,25 +525,69 @@ class RedisService:
         Returns:
             str: Id of the message just sent.
         """
-        stream_mssg = {
-            "sender_id": sender_id,
-            "content": message,
-            "timestamp": datetime.now().isoformat()
-        }
-        message_id = await self._streams_redis.xadd(chat_id, stream_mssg)
+        return await self._send_message(chat_id, sender_id, sender_username, message)
 
-        pubsub_mssg = {
-            "type": "message",
-            "message_id": message_id,
-            "sender_id": sender_id,
-            "sender_username": sender_username,
-            "content": message,
-            "timestamp": stream_mssg["timestamp"]
-        }
-        message_json = json.dumps(pubsub_mssg)
-        await self._streams_redis.publish(chat_id, message_json)
+    async def send_chat_messages(
+            self,
+            messages: List[Tuple[str, str, str, str]]
+    ) -> List[Union[str, Exception]]:
+        """ Sends several chat messages in one pipelined round trip.
+
+        Each message still goes through the atomic send script, so this behaves
+        exactly like calling send_chat_message for each one in order.
+
+        Args:
+            messages (List[Tuple[str, str, str, str]]): (chat_id, sender_id,
+                sender_username, message) for each message to send.
+
+        Returns:
+            List[Union[str, Exception]]: Id of each message just sent, or the
+            error that message failed with, in the same order as messages.
+        """
+        if not messages:
+            return []
+
+        async with self._streams_redis.pipeline(transaction=False) as pipe:
+            for chat_id, sender_id, sender_username, message in messages:
+                await self._send_message_script(
+                    **self._send_message_params(chat_id, sender_id, sender_username, message),
+                    client=pipe
+                )
+            return await pipe.execute(raise_on_error=False)
+
+    async def _send_message(
+            self,
+            chat_id: str,
+            sender_id: str,
+            sender_username: str,
+            message: str
+    ) -> str:
+        """ Appends, indexes and publishes a message in a single atomic script call.
+
+        Returns:
+            str: Id of the message just sent.
+        """
+        return await self._send_message_script(
+            **self._send_message_params(chat_id, sender_id, sender_username, message)
+        )
 
-        return message_id
+    def _send_message_params(
+            self,
+            chat_id: str,
+            sender_id: str,
+            sender_username: str,
+            message: str
+    ) -> dict:
+        """ Builds the keys and args of a send script call. """
+        timestamp = datetime.now().isoformat()
+        raw_sender_id = bytes.fromhex(sender_id) if sender_id != "SERVER" else b""
+
+        return {
+            "keys": [chat_id, LAST_MESSAGE_KEY, CHAT_ACTIVITY_KEY],
+            "args": [chat_id, sender_id, sender_username, message, timestamp,
+                     message[:LAST_MESSAGE_PREVIEW_CHARS], self._stream_entry_version,
+                     raw_sender_id, time.localtime().tm_gmtoff],
+        }
 
     async def send_added_to_chat_notification(self, user_id: str, chat_preview: ChatPreview,
                                               added_by_id: str):
@@ -218,17 +598,38 @@ class RedisService:
             chat_preview (ChatPreview): Details of chat user was added to
             added_by_id (str): The other user that added user_id to chat
         """
+        await self.send_added_to_chat_notifications([user_id], chat_preview, added_by_id)
+
+    async def send_added_to_chat_notifications(self, user_ids: List[str],
+                                               chat_preview: ChatPreview, added_by_id: str):
+        """ Sends notifications to several users that they've been added to a chat.
+
+        The notification is serialized once for all of them and published in a
+        single round trip, only to users connected to some node.
+
+        Args:
+            user_ids (List[str]): Id hex strings of users to notify
+            chat_preview (ChatPreview): Details of chat users were added to, as
+                every one of them sees it
+            added_by_id (str): The user that added them to the chat
+        """
+        online = await self.get_online_users(user_ids)
+        if not online:
+            return  # nobody would receive it, each client loads its chats on connect
+
         pubsub_mssg = {
             "type": "added_to_chat",
+            "chat_id": chat_preview.chat_id,
             "added_by_id": added_by_id,
         }
-
         # Only include chat_preview if user isn't the one who created it
-        if user_id != added_by_id:
-            pubsub_mssg["chat_preview"] = chat_preview.model_dump()
+        creator_json = serializer.dumps(pubsub_mssg)
+        message_json = serializer.dumps({**pubsub_mssg, "chat_preview": chat_preview})
 
-        message_json = json.dumps(pubsub_mssg)
-        await self._streams_redis.publish(user_id, message_json)
+        async with self._streams_redis.pipeline(transaction=False) as pipe:
+            for user_id in online:
+                pipe.publish(user_id, creator_json if user_id == added_by_id else message_json)
+            await pipe.execute()
 
     async def send_removed_from_chat_notification(self, user_id: str, chat_id: str,
                                                   removed_by_id: str):
@@ -239,12 +640,15 @@ class RedisService:
             chat_id (str): Chat to remove from
             removed_by_id (str): The other user that removed user_id from chat
         """
+        if not await self.get_online_users([user_id]):
+            return
+
         pubsub_mssg = {
             "type": "removed_from_chat",
             "chat_id": chat_id,
             "removed_by_id": removed_by_id,
         }
-        message_json = json.dumps(pubsub_mssg)
+        message_json = serializer.dumps(pubsub_mssg)
         await self._streams_redis.publish(user_id, message_json)
 
     async def get_chat_history(
@@ -266,21 +670,26 @@ class RedisService:
         min_range = start_id if start_id is not None else "-"
         max_range = end_id if end_id is not None else "+"
 
-        messages = await self._streams_redis.xrevrange(chat_id, max_range, min_range, count)
+        messages = await self._streams_raw_redis.xrevrange(chat_id, max_range, min_range, count)
 
-        formatted_messages = []
-        for msg_id, fields in messages:
-            (user_id, content, timestamp) = fields.values()
+        return [_format_stream_entry(msg_id, fields) for msg_id, fields in messages]
 
-            formatted_messages.append(ChatMessage(
-                message_id=msg_id,
-                sender_id=user_id,
-                sender_username=None,
-                content=content,
-                timestamp=timestamp),
-            )
+    async def get_messages_after(self, chat_id: str, after_id: str,
+                                 count: int) -> List[ChatMessage]:
+        """ Gets the messages sent after a given message, oldest first.
 
-        return formatted_messages
+        Args:
+            chat_id (str): The id of the chat stream
+            after_id (str): Message id to start after (exclusive).
+            count (int): Amount of messages to retrieve.
+        """
+        if parse_stream_id(after_id) == (MAX_STREAM_MS, MAX_STREAM_SEQ):
+            return []  # nothing can come after the largest stream id
+
+        messages = await self._streams_raw_redis.xrange(
+            chat_id, next_stream_id(after_id), "+", count=count)
+
+        return [_format_stream_entry(msg_id, fields) for msg_id, fields in messages]
 
     async def get_last_message(self, chat_id: str) -> Optional[ChatMessage]:
         """ Fetches the very last message from the chat
@@ -291,21 +700,482 @@ class RedisService:
         Returns:
             ChatMessage: The last message of the chat
         """
-        message = await self._streams_redis.xrevrange(chat_id, count=1)
+        message = await self._streams_raw_redis.xrevrange(chat_id, count=1)
         if message == []:
             return None
         (msg_id, fields) = message[0]
-        (user_id, content, timestamp) = fields.values()
 
-        formatted_message = ChatMessage(
-            message_id=msg_id,
-            sender_id=user_id,
+        return _format_stream_entry(msg_id, fields)
+
+    async def get_last_messages(self, chat_ids: List[str]) -> List[Optional[ChatMessage]]:
+        """ Fetches the very last message of several chats in one round trip.
+
+        Args:
+            chat_ids (List[str]): The ids of the chats
+
+        Returns:
+            List[Optional[ChatMessage]]: The last message of each chat, in the same
+            order as chat_ids. None for chats without messages.
+        """
+        if not chat_ids:
+            return []
+
+        async with self._streams_raw_redis.pipeline(transaction=False) as pipe:
+            for chat_id in chat_ids:
+                pipe.xrevrange(chat_id, count=1)
+            results = await pipe.execute()
+
+        return [
+            _format_stream_entry(*message[0]) if message else None
+            for message in results
+        ]
+
+    # =============== CACHE INVALIDATION METHODS ===============
+
+    async def publish_invalidation(self, channel: str, event: dict) -> None:
+        """ Publishes a cache invalidation event to every worker.
+
+        Args:
+            channel (str): Invalidation channel of the cache.
+            event (dict): JSON serializable description of what changed.
+        """
+        await self._streams_redis.publish(channel, serializer.dumps(event))
+
+    # =============== MEMBERSHIP CACHE METHODS ===============
+
+    async def get_membership(self, user_id: str) -> Tuple[Optional[Set[str]], int]:
+        """ Gets the cached chat ids of a user.
+
+        Args:
+            user_id (str): Hex id of the user.
+
+        Returns:
+            Tuple[Optional[Set[str]], int]: The chat ids, None if they aren't cached,
+            and the user's membership version to pass to store_membership.
+        """
+        async with self._streams_redis.pipeline(transaction=True) as pipe:
+            pipe.smembers(f"membership:{user_id}")
+            pipe.get(f"membership:version:{user_id}")
+            chat_ids, version = await pipe.execute()
+
+        if MEMBERSHIP_LOADED not in chat_ids:
+            return None, int(version or 0)
+        chat_ids.discard(MEMBERSHIP_LOADED)
+        return chat_ids, int(version or 0)
+
+    async def store_membership(self, user_id: str, chat_ids: Set[str], version: int,
+                               ttl: int) -> bool:
+        """ Caches the chat ids of a user, loaded from the database.
+
+        Args:
+            user_id (str): Hex id of the user.
+            chat_ids (Set[str]): Hex ids of the user's chats.
+            version (int): Membership version get_membership returned before the load.
+            ttl (int): Seconds to cache the chat ids for.
+
+        Returns:
+            bool: False if memberships changed since, and nothing was stored.
+        """
+        return bool(await self._store_membership_script(
+            keys=[f"membership:{user_id}", f"membership:version:{user_id}"],
+            args=[version, ttl, MEMBERSHIP_LOADED, *chat_ids]
+        ))
+
+    # =============== PRESENCE METHODS ===============
+
+    async def set_presence(self, node_id: str, user_id: str, connections: int,
+                           ttl: float) -> None:
+        """ Records how many connections a user has on a node.
+
+        Args:
+            node_id (str): Id of the worker node.
+            user_id (str): Hex id of the user.
+            connections (int): The user's connection count on the node, 0 removes it.
+            ttl (float): Seconds the node stays alive without a heartbeat.
+        """
+        await self._set_presence_script(
+            keys=[PRESENCE_NODES_KEY, f"presence:node:{node_id}", f"presence:user:{user_id}"],
+            args=[node_id, user_id, connections, int(ttl * 1000)])
+
+    async def heartbeat_presence(self, node_id: str, ttl: float) -> bool:
+        """ Keeps a node alive, and forgets the connections of nodes that stopped.
+
+        Each expired node is forgotten by a script call of its own, after the heartbeat.
+
+        Args:
+            node_id (str): Id of the worker node.
+            ttl (float): Seconds the node stays alive without a heartbeat.
+
+        Returns:
+            bool: True if the node's presence was lost, e.g. by a Valkey restart, and
+            has to be restored with sync_presence.
+        """
+        lost, *expired_nodes = await self._heartbeat_presence_script(
+            keys=[PRESENCE_NODES_KEY], args=[node_id, int(ttl * 1000)])
+
+        for expired_node in expired_nodes:
+            if expired_node == node_id:
+                continue
+            # retried while the node's users change between reading and forgetting them
+            while True:
+                user_ids = await self._streams_redis.hkeys(f"presence:node:{expired_node}")
+                if await self._forget_presence_node_script(
+                        keys=[PRESENCE_NODES_KEY, f"presence:node:{expired_node}",
+                              *(f"presence:user:{user_id}" for user_id in user_ids)],
+                        args=[expired_node, *user_ids]):
+                    break
+        return bool(lost)
+
+    async def sync_presence(self, node_id: str, connections: Dict[str, int],
+                            ttl: float) -> None:
+        """ Replaces the presence of a node with its current connection counts.
+
+        Args:
+            node_id (str): Id of the worker node.
+            connections (Dict[str, int]): Connection count per hex user id.
+            ttl (float): Seconds the node stays alive without a heartbeat, 0 removes
+                the node.
+        """
+        # retried while the node's users change between reading and replacing them
+        while True:
+            counts = dict.fromkeys(
+                await self._streams_redis.hkeys(f"presence:node:{node_id}"), 0)
+            counts.update(connections)
+            if await self._sync_presence_script(
+                    keys=[PRESENCE_NODES_KEY, f"presence:node:{node_id}",
+                          *(f"presence:user:{user_id}" for user_id in counts)],
+                    args=[node_id, int(ttl * 1000),
+                          *(value for item in counts.items() for value in item)]):
+                return
+
+    async def get_online_users(self, user_ids: List[str]) -> Set[str]:
+        """ Filters users down to those connected to at least one live node.
+
+        Args:
+            user_ids (List[str]): Hex ids of the users.
+
+        Returns:
+            Set[str]: The ids of the users that are online.
+        """
+        if not user_ids:
+            return set()
+        return set(await self._online_users_script(
+            keys=[PRESENCE_NODES_KEY, *(f"presence:user:{user_id}" for user_id in user_ids)],
+            args=list(user_ids)))
+
+    # =============== CHAT INDEX METHODS ===============
+
+    async def add_chat_members(self, chat_id: str, user_ids: List[str],
+                               activity: float) -> None:
+        """ Registers users as members of a chat in the activity index, drops
+        their cached memberships and announces them with a single event on
+        MEMBERSHIP_CHANNEL.
+
+        Args:
+            chat_id (str): Hex id of the chat.
+            user_ids (List[str]): Hex ids of the users to add.
+            activity (float): Initial activity score (unix ms) for users that
+                don't have the chat indexed yet.
+        """
+        if not user_ids:
+            return
+
+        async with self._streams_redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zadd(f"user:chats:{user_id}", {chat_id: activity}, nx=True)
+                pipe.delete(f"membership:{user_id}")
+                pipe.incr(f"membership:version:{user_id}")
+            pipe.publish(MEMBERSHIP_CHANNEL, serializer.dumps({
+                "chat_id": chat_id,
+                "added": user_ids,
+            }))
+            await pipe.execute()
+
+    async def add_indexed_chats(self, user_id: str, activities: Dict[str, float]) -> None:
+        """ Adds several chats to a user's activity index.
+
+        Args:
+            user_id (str): Hex id of the user.
+            activities (Dict[str, float]): Mapping of chat id to its activity score
+                (unix ms). Chats already in the index keep their current score.
+        """
+        if not activities:
+            return
+
+        await self._streams_redis.zadd(f"user:chats:{user_id}", activities, nx=True)
+
+    async def get_indexed_chat_ids(self, user_id: str) -> List[str]:
+        """ Gets the ids of every chat in the user's activity index.
+
+        Args:
+            user_id (str): Hex id of the user.
+
+        Returns:
+            List[str]: Chat ids, in no particular order.
+        """
+        return await self._streams_redis.zrange(f"user:chats:{user_id}", 0, -1)
+
+    async def remove_indexed_chats(self, user_id: str, chat_ids: List[str]) -> None:
+        """ Removes chats from the user's activity index.
+
+        Args:
+            user_id (str): Hex id of the user.
+            chat_ids (List[str]): Ids of the chats to remove.
+        """
+        if not chat_ids:
+            return
+
+        await self._streams_redis.zrem(f"user:chats:{user_id}", *chat_ids)
+
+    async def get_recent_chats(
+        self,
+        user_id: str,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[float, str]] = None,
+    ) -> List[Tuple[str, float]]:
+        """ Gets the user's chats ordered by most recent activity, then descending id.
+
+        The first page (no after) brings the activity index up to date with
+        chat:activity first.
+
+        Args:
+            user_id (str): Hex id of the user.
+            limit (Optional[int]): Maximum amount of chats to return. Defaults to all.
+            after (Optional[Tuple[float, str]]): (activity score, chat_id) of the
+                last chat of the previous page. Defaults to the first page.
+
+        Returns:
+            List[Tuple[str, float]]: (chat_id, activity score) pairs, most recent first.
+        """
+        score, chat_id = (repr(after[0]), after[1]) if after is not None else ("", "")
+        entries = await self._recent_chats_script(
+            keys=[f"user:chats:{user_id}", CHAT_ACTIVITY_KEY],
+            args=["1" if after is None else "0", limit or 0, score, chat_id],
+        )
+
+        return [
+            (entries[i], float(entries[i + 1])) for i in range(0, len(entries), 2)
+        ]
+
+    async def get_indexed_last_messages(
+        self, chat_ids: List[str]
+    ) -> List[Optional[ChatMessage]]:
+        """ Gets the last message of several chats from the chat:last hash.
+
+        Unlike get_last_messages the sender username is already resolved, and
+        the content is truncated to LAST_MESSAGE_PREVIEW_CHARS.
+
+        Args:
+            chat_ids (List[str]): The ids of the chats
+
+        Returns:
+            List[Optional[ChatMessage]]: The last message of each chat, in the same
+            order as chat_ids. None for chats that aren't indexed.
+        """
+        if not chat_ids:
+            return []
+
+        entries = await self._streams_redis.hmget(LAST_MESSAGE_KEY, chat_ids)
+
+        return [
+            _format_last_message_entry(entry) if entry is not None else None
+            for entry in entries
+        ]
+
+    async def store_last_messages(self, messages: Dict[str, ChatMessage]) -> None:
+        """ Backfills chat:last entries for chats that don't have one.
+
+        Existing entries are left untouched, so a message sent during a backfill
+        is never overwritten by an older one.
+
+        Args:
+            messages (Dict[str, ChatMessage]): Mapping of chat id to its last message.
+        """
+        if not messages:
+            return
+
+        async with self._streams_redis.pipeline(transaction=False) as pipe:
+            for chat_id, message in messages.items():
+                pipe.hsetnx(LAST_MESSAGE_KEY, chat_id, serializer.dumps({
+                    "id": message.message_id,
+                    "sid": message.sender_id,
+                    "u": message.sender_username,
+                    "c": message.content[:LAST_MESSAGE_PREVIEW_CHARS],
+                    "ts": message.timestamp,
+                }))
+            await pipe.execute()
+
+    # =============== RETENTION METHODS ===============
+
+    async def set_retention_policy(self, chat_id: str, max_len: Optional[int],
+                                   max_age_seconds: Optional[int]) -> None:
+        """ Overrides how much history a chat keeps in its stream.
+
+        Args:
+            chat_id (str): Hex id of the chat.
+            max_len (Optional[int]): Maximum amount of messages kept in Redis. None for no limit.
+            max_age_seconds (Optional[int]): Maximum age of messages kept in Redis. None
+                for no limit.
+        """
+        await self._streams_redis.hset(RETENTION_POLICY_KEY, chat_id, serializer.dumps({
+            "max_len": max_len,
+            "max_age_seconds": max_age_seconds,
+        }))
+
+    async def get_retention_policies(self, chat_ids: List[str]) -> List[Optional[dict]]:
+        """ Gets the retention overrides of several chats.
+
+        Args:
+            chat_ids (List[str]): The ids of the chats
+
+        Returns:
+            List[Optional[dict]]: The policy of each chat (see set_retention_policy),
+            or None for chats using the default policy.
+        """
+        if not chat_ids:
+            return []
+
+        policies = await self._streams_redis.hmget(RETENTION_POLICY_KEY, chat_ids)
+        return [
+            serializer.loads(policy) if policy is not None else None for policy in policies
+        ]
+
+    async def scan_chat_streams(self, cursor: int, count: int) -> Tuple[int, List[str]]:
+        """ Iterates over the ids of every chat that has had a message.
+
+        Args:
+            cursor (int): Cursor returned by the previous call, 0 to start.
+            count (int): Hint for the amount of ids to return.
+
+        Returns:
+            Tuple[int, List[str]]: Next cursor (0 when done) and a page of chat ids.
+        """
+        return await self._streams_redis.hscan(
+            LAST_MESSAGE_KEY, cursor, count=count, no_values=True)
+
+    async def get_stream_lengths(self, chat_ids: List[str]) -> List[int]:
+        """ Gets the amount of messages held in Redis for several chats.
+
+        Args:
+            chat_ids (List[str]): The ids of the chats
+
+        Returns:
+            List[int]: Stream length of each chat, in the same order as chat_ids.
+        """
+        if not chat_ids:
+            return []
+
+        async with self._streams_redis.pipeline(transaction=False) as pipe:
+            for chat_id in chat_ids:
+                pipe.xlen(chat_id)
+            return await pipe.execute()
+
+    async def get_oldest_messages(self, chat_id: str, count: int,
+                                  after_id: Optional[str] = None) -> List[ChatMessage]:
+        """ Gets the oldest messages held in a chat's stream, oldest first.
+
+        Args:
+            chat_id (str): The id of the chat stream
+            count (int): Amount of messages to retrieve.
+            after_id (Optional[str]): Only return messages after this id (exclusive).
+                Defaults to the start of the stream.
+        """
+        min_range = f"({after_id}" if after_id is not None else "-"
+        messages = await self._streams_raw_redis.xrange(chat_id, min_range, "+", count=count)
+
+        return [_format_stream_entry(msg_id, fields) for msg_id, fields in messages]
+
+    async def count_messages_until(self, chat_id: str, until_id: str, limit: int) -> int:
+        """ Counts the messages in a chat's stream up to and including an id.
+
+        Args:
+            chat_id (str): The id of the chat stream
+            until_id (str): Newest message id to count.
+            limit (int): Stop counting after this many messages.
+        """
+        messages = await self._streams_raw_redis.xrange(chat_id, "-", until_id, count=limit)
+        return len(messages)
+
+    async def trim_chat_history(self, chat_id: str, archived_until: str) -> None:
+        """ Trims archived messages from a chat's stream.
+
+        Trimming is approximate (MINID ~), so Redis may keep some archived
+        messages around until it can drop a whole node. Readers must expect
+        the hot tail and the archive to overlap.
+
+        Args:
+            chat_id (str): The id of the chat stream
+            archived_until (str): Id of the newest archived message.
+        """
+        async with self._streams_redis.pipeline(transaction=False) as pipe:
+            pipe.hset(ARCHIVED_UNTIL_KEY, chat_id, archived_until)
+            pipe.xtrim(chat_id, minid=next_stream_id(archived_until), approximate=True)
+            await pipe.execute()
+
+    async def get_archived_until(self, chat_id: str) -> Optional[str]:
+        """ Gets the id of the newest message of a chat that has been archived.
+
+        Args:
+            chat_id (str): The id of the chat
+
+        Returns:
+            Optional[str]: The message id, or None if nothing has been archived.
+        """
+        return await self._streams_redis.hget(ARCHIVED_UNTIL_KEY, chat_id)
+
+    async def acquire_archiver_lock(self, ttl_seconds: int) -> bool:
+        """ Claims the archiver run for this worker, so only one worker archives at once.
+
+        The lock is never released and simply expires, which also limits archiving
+        to one run per ttl_seconds across all workers.
+
+        Args:
+            ttl_seconds (int): How long the lock is held.
+
+        Returns:
+            bool: True if this worker holds the lock.
+        """
+        return bool(await self._streams_redis.set(
+            ARCHIVER_LOCK_KEY, "1", nx=True, ex=ttl_seconds))
+
+
+def _format_last_message_entry(entry: str) -> ChatMessage:
+    """ Converts a chat:last hash value into a ChatMessage. """
+    fields = serializer.loads(entry)
+
+    return ChatMessage(
+        message_id=fields["id"],
+        sender_id=fields["sid"],
+        sender_username=fields["u"],
+        content=fields["c"],
+        timestamp=fields["ts"]
+    )
+
+
+def _format_stream_entry(msg_id: bytes, fields: Dict[bytes, bytes]) -> ChatMessage:
+    """ Converts an undecoded stream entry, in either format, into a ChatMessage
+    without a sender username.
+    """
+    message_id = msg_id.decode()
+
+    if b"v" in fields:
+        raw_sender_id = fields[b"s"]
+        ms, _ = parse_stream_id(message_id)
+        return ChatMessage(
+            message_id=message_id,
+            sender_id=raw_sender_id.hex() if raw_sender_id else "SERVER",
             sender_username=None,
-            content=content,
-            timestamp=timestamp
+            content=fields[b"c"].decode(),
+            timestamp=datetime.fromtimestamp(ms / 1000).isoformat(timespec="microseconds")
         )
 
-        return formatted_message
+    return ChatMessage(
+        message_id=message_id,
+        sender_id=fields[b"sender_id"].decode(),
+        sender_username=None,
+        content=fields[b"content"].decode(),
+        timestamp=fields[b"timestamp"].decode()
+    )
 
 
 redis_service = RedisService()
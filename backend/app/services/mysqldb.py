@@ -1,11 +1,32 @@
 """ Connects to mysql database """
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from datetime import datetime
-from typing import List, Optional
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from mysql.connector.aio import MySQLConnectionPool
+from mysql.connector.aio.pooling import PooledMySQLConnection
+from mysql.connector.errors import Error
 
+from app.services.myredis import redis_service
+from app.services.pubsub_hub import pubsub_hub
 from app.templates.chats.requests import NewChatData
-from app.templates.chats.responses import ChatPreview, UserInfo, UserRole
+from app.templates.chats.responses import ChatMessage, ChatPreview, UserInfo, UserRole
+from app.utils.connection_pool import QueuedConnectionPool
+from app.utils.serializer import serializer
+from app.utils.statement_cache import StatementCache
+from app.utils.stream_ids import MAX_STREAM_SEQ
+from app.utils.ttl_cache import TTLCache
+
+READ_PIN_CHANNEL = "db:read_pin"
+# pins only live for read_your_writes seconds, this is never reached in practice
+READ_PIN_CACHE_SIZE = 100000
+
+# user of the current request, bound by bind_session
+_session_user: ContextVar[Optional[str]] = ContextVar("db_session_user", default=None)
+# whether the current request or task already wrote
+_wrote: ContextVar[bool] = ContextVar("db_wrote", default=False)
 
 # INSERT queries
 CREATE_USER_QUERY = "INSERT INTO users (user_id, user_name, pass_hash) VALUES (%s, %s, %s)"
@@ -13,9 +34,14 @@ CREATE_CHAT_QUERY = """
 INSERT INTO chats (chat_id, chat_name, created_by, created_at, is_public)
 VALUES (%s, %s, %s, %s, %s)
 """
-ADD_USER_TO_CHAT_QUERY = """
+ADD_USERS_TO_CHAT_QUERY = """
 INSERT INTO users_in_chats (user_id, chat_id, role)
-VALUES (%s, %s, %s)
+VALUES {values}
+"""
+# IGNORE: approximate stream trimming means a message can be archived twice
+ARCHIVE_MESSAGES_QUERY = """
+INSERT IGNORE INTO messages (chat_id, id_ms, id_seq, sender_id, content, sent_at)
+VALUES {values}
 """
 
 # SELECT queries
@@ -26,7 +52,10 @@ SELECT EXISTS(
 """
 GET_USER_ID_QUERY = "SELECT user_id FROM users WHERE user_name = ?"
 GET_USERNAME_QUERY = "SELECT user_name FROM users WHERE user_id = ?"
+GET_USERNAMES_QUERY = "SELECT user_id, user_name FROM users WHERE user_id IN ({placeholders})"
 GET_PASS_HASH_QUERY = "SELECT pass_hash FROM users WHERE user_name = ?"
+# DMs are looked up through their ordered user pair, once per side the user is on,
+# so each branch reads one index instead of scanning every DM
 GET_USER_CHATS_QUERY = """
     SELECT 
         c.chat_id,
@@ -34,10 +63,22 @@ GET_USER_CHATS_QUERY = """
         c.created_at,
         NULL as other_user_id,
         uic.role
-    FROM chats c
-    INNER JOIN users_in_chats uic ON c.chat_id = uic.chat_id
-    INNER JOIN users u ON uic.user_id = u.user_id
-    WHERE u.user_name = ?
+    FROM users_in_chats uic
+    INNER JOIN chats c ON c.chat_id = uic.chat_id
+    WHERE uic.user_id = ?{group_filter}
+
+    UNION ALL
+
+    SELECT 
+        c.chat_id,
+        other_user.user_name as chat_name,
+        c.created_at,
+        other_user.user_id as other_user_id,
+        NULL as role
+    FROM dm_chats dm
+    INNER JOIN chats c ON c.chat_id = dm.chat_id
+    INNER JOIN users other_user ON other_user.user_id = dm.higher_user_id
+    WHERE dm.lower_user_id = ?{dm_filter}
 
     UNION ALL
 
@@ -47,16 +88,25 @@ GET_USER_CHATS_QUERY = """
         c.created_at,
         other_user.user_id as other_user_id,
         NULL as role
+    FROM dm_chats dm
+    INNER JOIN chats c ON c.chat_id = dm.chat_id
+    INNER JOIN users other_user ON other_user.user_id = dm.lower_user_id
+    WHERE dm.higher_user_id = ?{dm_filter}
+"""
+GET_ALL_USER_CHATS_QUERY = GET_USER_CHATS_QUERY.format(group_filter="", dm_filter="")
+GET_USER_CHAT_IDS_QUERY = """
+    SELECT chat_id FROM users_in_chats WHERE user_id = ?
+    UNION ALL
+    SELECT chat_id FROM dm_chats WHERE lower_user_id = ?
+    UNION ALL
+    SELECT chat_id FROM dm_chats WHERE higher_user_id = ?
+"""
+GET_DM_CHAT_ID_QUERY = "SELECT chat_id FROM dm_chats WHERE lower_user_id = ? AND higher_user_id = ?"
+GET_CHAT_MEMBERSHIP_QUERY = """
+    SELECT c.chat_name, c.created_at, uic.role
     FROM chats c
-    INNER JOIN dm_chats dm ON c.chat_id = dm.chat_id
-    INNER JOIN users requesting_user ON requesting_user.user_name = ?
-    INNER JOIN users other_user ON (
-        CASE 
-            WHEN dm.user1_id = requesting_user.user_id THEN dm.user2_id
-            ELSE dm.user1_id
-        END
-    ) = other_user.user_id
-    WHERE requesting_user.user_id IN (dm.user1_id, dm.user2_id)
+    INNER JOIN users_in_chats uic ON c.chat_id = uic.chat_id
+    WHERE c.chat_id = ? AND uic.user_id = ?
 """
 GET_IS_DM_QUERY = "SELECT 1 FROM dm_chats WHERE chat_id = ?"
 GET_DM_PARTICIPANTS_QUERY = """
@@ -65,7 +115,17 @@ GET_DM_PARTICIPANTS_QUERY = """
         u.user_name,
         NULL as role
     FROM dm_chats dm
-    JOIN users u ON u.user_id IN (dm.user1_id, dm.user2_id)
+    JOIN users u ON u.user_id = dm.lower_user_id
+    WHERE dm.chat_id = ?
+
+    UNION ALL
+
+    SELECT
+        u.user_id,
+        u.user_name,
+        NULL as role
+    FROM dm_chats dm
+    JOIN users u ON u.user_id = dm.higher_user_id
     WHERE dm.chat_id = ?
 """
 GET_GROUP_PARTICIPANTS_QUERY = """
@@ -77,41 +137,139 @@ GET_GROUP_PARTICIPANTS_QUERY = """
     JOIN users u ON uic.user_id = u.user_id
     WHERE uic.chat_id = ?
 """
+GET_ARCHIVED_MESSAGES_QUERY = """
+    SELECT id_ms, id_seq, sender_id, content, sent_at
+    FROM messages
+    WHERE chat_id = ?
+        AND (id_ms < ? OR (id_ms = ? AND id_seq <= ?))
+        AND (id_ms > ? OR (id_ms = ? AND id_seq >= ?))
+    ORDER BY id_ms {order}, id_seq {order}
+    LIMIT ?
+"""
+# formatted once, the statement cache reuses a statement only for the same query
+ARCHIVED_MESSAGES_QUERIES = {
+    oldest_first: GET_ARCHIVED_MESSAGES_QUERY.format(order="ASC" if oldest_first else "DESC")
+    for oldest_first in (False, True)
+}
 
 # EXISTS query
 CHECK_USER_IN_CHAT_QUERY = """
     SELECT EXISTS(
         SELECT 1 
-        FROM users_in_chats uic
-        JOIN users u ON uic.user_id = u.user_id
-        WHERE u.user_name = %s AND uic.chat_id = %s
+        FROM users_in_chats
+        WHERE user_id = %s AND chat_id = %s
     ) AS user_in_chat
 """
 
 
+@lru_cache(maxsize=None)
+def _add_users_to_chat_query(row_count: int) -> str:
+    # the same string for every chunk of a size, so its prepared statement is reused
+    return ADD_USERS_TO_CHAT_QUERY.format(values=", ".join(["(%s, %s, %s)"] * row_count))
+
+
+@lru_cache(maxsize=None)
+def _user_chats_query(chat_count: int) -> str:
+    # chats of a user limited to chat_count ids, one string per page size
+    placeholders = ", ".join("?" * chat_count)
+    return GET_USER_CHATS_QUERY.format(
+        group_filter=f" AND uic.chat_id IN ({placeholders})",
+        dm_filter=f" AND dm.chat_id IN ({placeholders})")
+
+
 class DatabaseService:
-    """ Singleton instance holding database pool. """
+    """ Singleton instance holding the database pools.
+
+    Writes and reads that fill caches go to the primary. Cache fills follow
+    invalidations, and a lagging replica would keep serving the state from
+    before the change for the whole cache lifetime. Other reads go to the
+    healthy replicas round-robin, and fall back to the primary when none is
+    healthy or a checkout fails. Replicas are checked every health_check_seconds
+    and rejoin once they answer again.
+
+    Reads that follow a write of the same request always use the primary. A
+    user bound with bind_session is pinned to the primary on every worker for
+    read_your_writes seconds after they wrote, so their next requests see it
+    too. Chat members are inserted up to insert_chunk_size rows per statement.
+    """
     _instance: Optional['DatabaseService'] = None
-    _pool: Optional[MySQLConnectionPool] = None
+    _primary: Optional[QueuedConnectionPool] = None
+    _replicas: List[QueuedConnectionPool] = []
+    _statements: Optional[StatementCache] = None
+    _pinned: Optional[TTLCache] = None
+    _health_check_seconds: float = 5.0
+    _health_task: Optional[asyncio.Task] = None
+    _insert_chunk_size: int = 500
+    _next_replica: int = 0
+    _replica_reads: int = 0
+    _primary_reads: int = 0
+    _pinned_reads: int = 0
+    _replica_fallbacks: int = 0
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    async def init_db_pool(self, db_config: dict) -> None:
-        """ Initialises pool. (call on startup ONLY) 
+    async def init_db_pool(self, db_config: dict, db_pool_config: dict,
+                           replica_configs: Optional[List[dict]] = None) -> None:
+        """ Initialises pools. (call on startup ONLY) 
 
         Args:
             db_config (dict): Database configuration provided by service_configs. 
+            db_pool_config (dict): Pool configuration provided by service_configs.
+            replica_configs (Optional[List[dict]]): Database configuration of each read
+                replica provided by service_configs, each gets a pool of the same size.
         """
-        self._pool = MySQLConnectionPool(
-            pool_name="db_pool",
-            pool_size=5,
-            pool_reset_session=True,
-            **db_config
-        )
-        await self._pool.initialize_pool()
+        pool_size = db_pool_config["pool_size"]
+        replica_configs = replica_configs or []
+        self._insert_chunk_size = db_pool_config["insert_chunk_size"]
+        self._health_check_seconds = db_pool_config["replica_health_check_seconds"]
+        self._pinned = TTLCache(READ_PIN_CACHE_SIZE, db_pool_config["read_your_writes_seconds"])
+        # reconnected connections come back under a new id, leave room for their old entries
+        self._statements = StatementCache(db_pool_config["statement_cache_size"],
+                                          pool_size * 2 * (1 + len(replica_configs)))
+
+        def make_pool(name: str, config: dict) -> QueuedConnectionPool:
+            return QueuedConnectionPool(
+                name, config, pool_size, db_pool_config["reset_session"],
+                db_pool_config["checkout_timeout"], self._statements)
+
+        self._primary = make_pool("db_pool", db_config)
+        await self._primary.initialize()
+
+        self._replicas = [
+            make_pool(f"db_replica_{index}", replica_config)
+            for index, replica_config in enumerate(replica_configs)
+        ]
+        for replica in self._replicas:
+            try:
+                await replica.initialize()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Database replica {replica.host} unavailable, reading from the "
+                      f"primary until it answers: {e}")
+
+        if self._replicas:
+            await pubsub_hub.subscribe(READ_PIN_CHANNEL, self._handle_read_pin)
+            self._health_task = asyncio.create_task(self._run_health_checks())
+
+    async def close(self) -> None:
+        """ Stops the replica health checks and closes the idle connections. """
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+
+        for pool in [self._primary, *self._replicas]:
+            if pool is not None:
+                await pool.close()
+
+    def bind_session(self, user_id: str) -> None:
+        """ Marks the current request as made by a user, so their writes pin their reads.
+
+        Args:
+            user_id (str): Hex id of the user of the session.
+        """
+        _session_user.set(user_id)
 
     async def create_user(self, user_id: bytes, username: str, pass_hash: str) -> None:
         """ Adds user to db. 
@@ -121,11 +279,10 @@ class DatabaseService:
             username (str): Username of user.
             pass_hash (str): Hashed password of user.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(CREATE_USER_QUERY, (user_id, username, pass_hash))
+        async with self._connection() as conn:
+            await self._statements.execute(conn, CREATE_USER_QUERY, (user_id, username, pass_hash))
             await conn.commit()
-            await cursor.close()
+        await self._pin_reads()
 
     async def create_chat(self, chat_creator_id: bytes, req: NewChatData) -> datetime:
         """ Adds chat to db. 
@@ -133,38 +290,43 @@ class DatabaseService:
         Args:
             req (NewChatData): Model for creating chat.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
+        async with self._connection() as conn:
             created_at = datetime.now()
 
             # create chat
-            await cursor.execute(CREATE_CHAT_QUERY, (req.chat_id, req.chat_name, chat_creator_id,
-                                                     created_at, req.is_public))
-            # add creator as owner
-            await cursor.execute(ADD_USER_TO_CHAT_QUERY,
-                                 (chat_creator_id, req.chat_id, 'owner'))
-            # add other users if provided
-            for other_user in req.other_users:
-                other_user_id = bytes.fromhex(other_user.user_id)
-                await cursor.execute(ADD_USER_TO_CHAT_QUERY,
-                                     (other_user_id, req.chat_id, other_user.role))
+            await self._statements.execute(conn, CREATE_CHAT_QUERY, (
+                req.chat_id, req.chat_name, chat_creator_id, created_at, req.is_public))
+            # add creator as owner, and other users if provided
+            members = [(chat_creator_id, UserRole.OWNER)] + [
+                (bytes.fromhex(other_user.user_id), other_user.role)
+                for other_user in req.other_users
+            ]
+            await self._insert_chat_members(conn, req.chat_id, members)
             await conn.commit()
-            await cursor.close()
+        await self._pin_reads()
         return created_at
 
-    async def add_user_to_chat(self, username: str, chat_id: bytes, role: UserRole):
+    async def add_user_to_chat(self, user_id: bytes, chat_id: bytes, role: UserRole):
         """ Adds user to chat in db. 
 
         Args:
-            user_id (str): Added user's id. 
+            user_id (bytes): Added user's id. 
             chat_id (bytes): Id of chat to add user to.
             role (Role): Role to assign to user.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(ADD_USER_TO_CHAT_QUERY, (username, chat_id, role))
+        await self.add_users_to_chat(chat_id, [(user_id, role)])
+
+    async def add_users_to_chat(self, chat_id: bytes, members: List[Tuple[bytes, UserRole]]):
+        """ Adds several users to a chat in db, in one transaction.
+
+        Args:
+            chat_id (bytes): Id of chat to add users to.
+            members (List[Tuple[bytes, UserRole]]): Id and role of every added user.
+        """
+        async with self._connection() as conn:
+            await self._insert_chat_members(conn, chat_id, members)
             await conn.commit()
-            await cursor.close()
+        await self._pin_reads()
 
     async def get_user_id(self, username: str) -> Optional[bytes]:
         """ Gets the user id for a given username.
@@ -174,11 +336,9 @@ class DatabaseService:
         Returns:
             Optional[bytes]: If user exists, the user id. Otherwise none.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(GET_USER_ID_QUERY, (username,))
+        async with self._connection() as conn:
+            cursor = await self._statements.execute(conn, GET_USER_ID_QUERY, (username,))
             result = await cursor.fetchone()
-            await cursor.close()
             return result[0] if result else None
 
     async def get_username(self, user_id: bytes) -> Optional[str]:
@@ -190,13 +350,31 @@ class DatabaseService:
         Returns:
             Optional[str]: Username if user exists, else None.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(GET_USERNAME_QUERY, (user_id,))
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(conn, GET_USERNAME_QUERY, (user_id,))
             result = await cursor.fetchone()
-            await cursor.close()
             return result[0] if result else None
 
+    async def get_usernames(self, user_ids: List[bytes]) -> Dict[bytes, str]:
+        """ Gets the usernames for several user ids with a single query.
+
+        Args:
+            user_ids (List[bytes]): User ids of users. Duplicates are ignored.
+
+        Returns:
+            Dict[bytes, str]: Mapping of user id to username. Ids of users that
+            don't exist are left out.
+        """
+        unique_ids = list(dict.fromkeys(user_ids))
+        if not unique_ids:
+            return {}
+
+        query = GET_USERNAMES_QUERY.format(placeholders=", ".join("?" * len(unique_ids)))
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(conn, query, tuple(unique_ids))
+            results = await cursor.fetchall()
+            return {bytes(row[0]): row[1] for row in results}
+
     async def get_password(self, username: str) -> Optional[str]:
         """ Gets the password hash for a user.
 
@@ -206,39 +384,86 @@ class DatabaseService:
         Returns:
             Optional[str]: If user exists, the password hash. Otherwise none.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(GET_PASS_HASH_QUERY, (username,))
+        async with self._connection() as conn:
+            cursor = await self._statements.execute(conn, GET_PASS_HASH_QUERY, (username,))
             result = await cursor.fetchone()
-            await cursor.close()
             return result[0] if result else None
 
-    async def get_all_user_chats(self, username: str) -> list[ChatPreview]:
+    async def get_all_user_chats(self, user_id: bytes) -> list[ChatPreview]:
         """ Gets previews for all group chats the user is in, including both group chats and DMs.
 
         Args:
-            username (str): Username of the user whose chats are retrieved.
+            user_id (bytes): Id of the user whose chats are retrieved.
 
         Returns:
             list[ChatPreview]: List containing chat information.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(GET_USER_CHATS_QUERY, (username,)*2)
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(
+                conn, GET_ALL_USER_CHATS_QUERY, (user_id,)*3)
             results = await cursor.fetchall()
-            await cursor.close()
+            return _format_user_chats(results)
 
-            return [
-                ChatPreview(
-                    chat_id=(chat_bytes_id := row[0]) and chat_bytes_id.hex(),
-                    chat_name=row[1],
-                    created_at=str(row[2]),
-                    dm_participant_id=(bytes_id := row[3]) and bytes_id.hex(),
-                    last_message=None,
-                    my_role=row[3]
-                )
-                for row in results
-            ] if results else []
+    async def get_user_chats(self, user_id: bytes, chat_ids: List[str]) -> list[ChatPreview]:
+        """ Gets previews for some of the chats a user is in, such as one page of them.
+
+        Args:
+            user_id (bytes): Id of the user whose chats are retrieved.
+            chat_ids (List[str]): Hex ids of the chats. Chats the user isn't in
+                are left out.
+
+        Returns:
+            list[ChatPreview]: Chat information, in no particular order.
+        """
+        if not chat_ids:
+            return []
+
+        chat_bytes_ids = tuple(bytes.fromhex(chat_id) for chat_id in chat_ids)
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(
+                conn, _user_chats_query(len(chat_ids)), (user_id, *chat_bytes_ids) * 3)
+            results = await cursor.fetchall()
+            return _format_user_chats(results)
+
+    async def get_user_chat_ids(self, user_id: bytes) -> List[str]:
+        """ Gets the ids of every chat a user is in, group chats and DMs.
+
+        Args:
+            user_id (bytes): Id of the user.
+
+        Returns:
+            List[str]: Hex ids of the chats.
+        """
+        async with self._connection() as conn:
+            cursor = await self._statements.execute(
+                conn, GET_USER_CHAT_IDS_QUERY, (user_id,) * 3)
+            results = await cursor.fetchall()
+            return [bytes(row[0]).hex() for row in results]
+
+    async def get_chat_membership(self, user_id: bytes, chat_id: bytes) -> Optional[ChatPreview]:
+        """ Gets a group chat as seen by one of its members.
+
+        Args:
+            user_id (bytes): Id of the user.
+            chat_id (bytes): Id of the chat.
+
+        Returns:
+            Optional[ChatPreview]: The chat with the user's role, without a last
+            message. None if the user isn't in the chat.
+        """
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(
+                conn, GET_CHAT_MEMBERSHIP_QUERY, (chat_id, user_id))
+            result = await cursor.fetchone()
+
+            return ChatPreview(
+                chat_id=chat_id.hex(),
+                chat_name=result[0],
+                created_at=str(result[1]),
+                dm_participant_id=None,
+                last_message=None,
+                my_role=result[2]
+            ) if result else None
 
     async def get_all_chat_participants(self, chat_id: bytes) -> List[UserInfo]:
         """ Gets all users currently in a chat.
@@ -246,18 +471,18 @@ class DatabaseService:
         Args:
             chat_id (bytes): The id of the chat.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(GET_IS_DM_QUERY, (chat_id,))
+        async with self._connection() as conn:
+            cursor = await self._statements.execute(conn, GET_IS_DM_QUERY, (chat_id,))
             is_dm = await cursor.fetchone()
 
             if is_dm:
-                await cursor.execute(GET_DM_PARTICIPANTS_QUERY, (chat_id,))
+                cursor = await self._statements.execute(
+                    conn, GET_DM_PARTICIPANTS_QUERY, (chat_id,) * 2)
             else:
-                await cursor.execute(GET_GROUP_PARTICIPANTS_QUERY, (chat_id,))
+                cursor = await self._statements.execute(
+                    conn, GET_GROUP_PARTICIPANTS_QUERY, (chat_id,))
 
             results = await cursor.fetchall()
-            await cursor.close()
 
             return [
                 UserInfo(
@@ -268,22 +493,196 @@ class DatabaseService:
                 for row in results
             ] if results else []
 
-    async def is_user_in_chat(self, username: str, chat_id: bytes) -> bool:
+    async def get_dm_chat_id(self, user_id: bytes, other_user_id: bytes) -> Optional[bytes]:
+        """ Gets the DM between two users.
+
+        Args:
+            user_id (bytes): Id of one user.
+            other_user_id (bytes): Id of the other user, in either order.
+
+        Returns:
+            Optional[bytes]: The id of their DM, None if they have none.
+        """
+        # the pair is stored ordered, bytes compare like the BINARY columns
+        lower_user_id, higher_user_id = sorted((user_id, other_user_id))
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(
+                conn, GET_DM_CHAT_ID_QUERY, (lower_user_id, higher_user_id))
+            result = await cursor.fetchone()
+            return bytes(result[0]) if result else None
+
+    async def is_user_in_chat(self, user_id: bytes, chat_id: bytes) -> bool:
         """ Checks if a user is part of a chat.
 
         Args:
-            username (str): Username to check.
+            user_id (bytes): Id of the user to check.
             chat_id (bytes): Chat id to check.
 
         Returns:
             bool: True if user is in chat, False otherwise.
         """
-        async with await self._pool.get_connection() as conn:
-            cursor = await conn.cursor(prepared=True)
-            await cursor.execute(CHECK_USER_IN_CHAT_QUERY, (username, chat_id))
+        async with self._connection(read_only=True) as conn:
+            cursor = await self._statements.execute(
+                conn, CHECK_USER_IN_CHAT_QUERY, (user_id, chat_id))
             result = await cursor.fetchone()
-            await cursor.close()
             return bool(result[0]) if result else False
 
 
+    async def archive_messages(self, chat_id: bytes, messages: List[ChatMessage]) -> None:
+        """ Copies messages trimmed from a chat's stream into the messages table.
+
+        Args:
+            chat_id (bytes): The id of the chat.
+            messages (List[ChatMessage]): Messages to archive, as read from the stream.
+        """
+        if not messages:
+            return
+
+        rows = []
+        for message in messages:
+            id_ms, _, id_seq = message.message_id.partition("-")
+            sender_id = None if message.sender_id == "SERVER" else bytes.fromhex(message.sender_id)
+            rows.extend((chat_id, int(id_ms), int(id_seq), sender_id, message.content,
+                         datetime.fromisoformat(message.timestamp)))
+
+        query = ARCHIVE_MESSAGES_QUERY.format(
+            values=", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(messages)))
+        async with self._connection() as conn:
+            await self._statements.execute(conn, query, tuple(rows))
+            await conn.commit()
+
+    async def get_archived_messages(
+        self,
+        chat_id: bytes,
+        start_id: Optional[Tuple[int, int]] = None,
+        end_id: Optional[Tuple[int, int]] = None,
+        count: int = 15,
+        oldest_first: bool = False,
+    ) -> List[ChatMessage]:
+        """ Gets archived messages of a chat, newest first unless oldest_first is set.
+
+        Args:
+            chat_id (bytes): The id of the chat.
+            start_id (Optional[Tuple[int, int]]): Oldest (ms, seq) id to include. Defaults
+                to earliest.
+            end_id (Optional[Tuple[int, int]]): Newest (ms, seq) id to include. Defaults
+                to latest.
+            count (int): Amount of messages to retrieve. Defaults to 15.
+            oldest_first (bool): Return the oldest matching messages, oldest first.
+        """
+        start_ms, start_seq = start_id if start_id is not None else (0, 0)
+        end_ms, end_seq = end_id if end_id is not None else (MAX_STREAM_SEQ, MAX_STREAM_SEQ)
+
+        async with self._connection() as conn:
+            query = ARCHIVED_MESSAGES_QUERIES[oldest_first]
+            cursor = await self._statements.execute(conn, query, (
+                chat_id, end_ms, end_ms, end_seq, start_ms, start_ms, start_seq, count))
+            results = await cursor.fetchall()
+
+            return [
+                ChatMessage(
+                    message_id=f"{row[0]}-{row[1]}",
+                    sender_id=row[2].hex() if row[2] is not None else "SERVER",
+                    sender_username=None,
+                    content=row[3],
+                    timestamp=row[4].isoformat()
+                )
+                for row in results
+            ] if results else []
+
+    async def _insert_chat_members(self, conn: PooledMySQLConnection, chat_id: bytes,
+                                   members: List[Tuple[bytes, UserRole]]) -> None:
+        for start in range(0, len(members), self._insert_chunk_size):
+            chunk = members[start:start + self._insert_chunk_size]
+            await self._statements.execute(conn, _add_users_to_chat_query(len(chunk)), tuple(
+                value for user_id, role in chunk for value in (user_id, chat_id, role)))
+
+    def stats(self) -> dict:
+        """ Returns pool usage, read routing and statement cache counts for metrics. """
+        return {
+            "primary": self._primary.stats(),
+            "replicas": [replica.stats() for replica in self._replicas],
+            "replica_reads": self._replica_reads,
+            "primary_reads": self._primary_reads,
+            "pinned_reads": self._pinned_reads,
+            "replica_fallbacks": self._replica_fallbacks,
+            "pinned_users": len(self._pinned),
+            "statements": self._statements.stats(),
+        }
+
+    @asynccontextmanager
+    async def _connection(self, read_only: bool = False) -> AsyncIterator[PooledMySQLConnection]:
+        pool = self._read_pool() if read_only else self._primary
+        try:
+            conn = await pool.acquire()
+        except Error as e:
+            if pool is self._primary:
+                raise
+            print(f"Database replica {pool.host} checkout failed, reading from the primary: {e}")
+            self._replica_fallbacks += 1
+            pool = self._primary
+            conn = await pool.acquire()
+
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    def _read_pool(self) -> QueuedConnectionPool:
+        if not self._replicas:
+            return self._primary
+
+        user_id = _session_user.get()
+        if _wrote.get() or (user_id is not None and self._pinned.get(user_id)):
+            self._pinned_reads += 1
+            return self._primary
+
+        for _ in range(len(self._replicas)):
+            replica = self._replicas[self._next_replica % len(self._replicas)]
+            self._next_replica += 1
+            if replica.healthy:
+                self._replica_reads += 1
+                return replica
+
+        self._primary_reads += 1
+        return self._primary
+
+    async def _pin_reads(self) -> None:
+        # called after a commit, the rest of the request and the user's next ones read it back
+        _wrote.set(True)
+        user_id = _session_user.get()
+        if user_id is None or not self._replicas:
+            return
+
+        self._pinned.set(user_id, True)
+        await redis_service.publish_invalidation(READ_PIN_CHANNEL, {"user": user_id})
+
+    def _handle_read_pin(self, _channel: str, data: str) -> None:
+        self._pinned.set(serializer.loads(data)["user"], True)
+
+    async def _run_health_checks(self) -> None:
+        while True:
+            await asyncio.sleep(self._health_check_seconds)
+            for replica in self._replicas:
+                was_healthy = replica.healthy
+                if await replica.check_health() != was_healthy:
+                    print(f"Database replica {replica.host} is "
+                          f"{'healthy again' if replica.healthy else 'unreachable'}")
+
+
 db_service = DatabaseService()
+
+
+def _format_user_chats(rows: list) -> list[ChatPreview]:
+    """ Turns rows of GET_USER_CHATS_QUERY into chat previews without a last message. """
+    return [
+        ChatPreview(
+            chat_id=(chat_bytes_id := row[0]) and chat_bytes_id.hex(),
+            chat_name=row[1],
+            created_at=str(row[2]),
+            dm_participant_id=(bytes_id := row[3]) and bytes_id.hex(),
+            last_message=None,
+            my_role=row[4]
+        )
+        for row in rows
+    ] if rows else []
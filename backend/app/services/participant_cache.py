@@ -0,0 +1,84 @@
+""" Process-local cache of chat participant rosters """
+import hashlib
+from typing import List, NamedTuple, Optional, Set
+
+from app.services.myredis import MEMBERSHIP_CHANNEL
+from app.services.mysqldb import db_service
+from app.services.pubsub_hub import pubsub_hub
+from app.templates.chats.responses import UserInfo
+from app.utils.serializer import serializer
+from app.utils.ttl_cache import TTLCache
+
+
+class Roster(NamedTuple):
+    """ Participants of a chat, with their encoded JSON body and its ETag. """
+    participants: List[UserInfo]
+    body: bytes
+    etag: str
+
+
+class ParticipantCache:
+    """ Singleton instance caching chat participants in front of DatabaseService.
+
+    A roster is encoded once when loaded, and its ETag is a digest of that body,
+    so it is the same on every worker. Rosters are dropped on every worker when
+    a membership change of their chat is published on MEMBERSHIP_CHANNEL.
+    """
+    _instance: Optional['ParticipantCache'] = None
+    _rosters: Optional[TTLCache] = None
+    _generation: int = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    async def init_cache(self, participant_cache_config: dict) -> None:
+        """ Creates the cache and listens for membership changes. (call on startup ONLY)
+
+        Args:
+            participant_cache_config (dict): Participant cache configuration provided
+                by service_configs.
+        """
+        self._rosters = TTLCache(**participant_cache_config)
+        await pubsub_hub.subscribe(MEMBERSHIP_CHANNEL, self._handle_membership_change)
+        pubsub_hub.add_gap_listener(self._handle_gap)
+
+    async def get_roster(self, chat_id: str) -> Roster:
+        """ Gets every user in a chat with their role.
+
+        Args:
+            chat_id (str): Hex id of the chat.
+
+        Returns:
+            Roster: The participants, their JSON encoding and its ETag.
+        """
+        roster = self._rosters.get(chat_id)
+        if roster is not None:
+            return roster
+
+        generation = self._generation
+        participants = await db_service.get_all_chat_participants(bytes.fromhex(chat_id))
+        body = serializer.dumpb(participants)
+        roster = Roster(participants, body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+        # a change announced while loading may not be included, let the next lookup retry
+        if generation == self._generation:
+            self._rosters.set(chat_id, roster)
+        return roster
+
+    def stats(self) -> dict:
+        """ Returns size and hit/miss counters for metrics. """
+        return self._rosters.stats()
+
+    def _handle_membership_change(self, _channel: str, data: str) -> None:
+        self._generation += 1
+        self._rosters.pop(serializer.loads(data)["chat_id"])
+
+    def _handle_gap(self, channels: Set[str], _since: float) -> None:
+        if MEMBERSHIP_CHANNEL in channels:
+            self._generation += 1
+            self._rosters.clear()
+
+
+participant_cache = ParticipantCache()
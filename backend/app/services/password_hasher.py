@@ -0,0 +1,102 @@
+""" Runs bcrypt hashing/verification on a bounded worker pool off the event loop """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+
+class PasswordPoolSaturatedError(Exception):
+    """ Raised when too many password operations are already pending. """
+
+
+class PasswordHasher:
+    """ Singleton instance holding the password worker pool.
+
+    bcrypt releases the GIL while hashing, so a thread pool keeps the event loop
+    (and every WebSocket on the worker) responsive during login storms. Work beyond
+    max_pending is rejected straight away rather than queued behind ~250ms hashes.
+    """
+    _instance: Optional['PasswordHasher'] = None
+    _executor: Optional[ThreadPoolExecutor] = None
+    _workers: int = 0
+    _max_pending: int = 0
+    _pending: int = 0
+    _rejected: int = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def init_pool(self, password_pool_config: dict) -> None:
+        """ Starts the worker pool. (call on startup ONLY)
+
+        Args:
+            password_pool_config (dict): Password pool configuration provided by service_configs.
+        """
+        self._workers = password_pool_config["workers"]
+        self._max_pending = password_pool_config["max_pending"]
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers,
+            thread_name_prefix="password"
+        )
+
+    def close(self) -> None:
+        """ Stops the worker pool, dropping queued work. """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def hash_password(self, password: str) -> str:
+        """ Hashes a password with a fresh salt.
+
+        Args:
+            password (str): Plain text password.
+
+        Returns:
+            str: The bcrypt hash.
+
+        Raises:
+            PasswordPoolSaturatedError: If the pool is saturated.
+        """
+        pass_hash = await self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
+        return pass_hash.decode()
+
+    async def check_password(self, password: str, pass_hash: str) -> bool:
+        """ Checks a password against a stored hash.
+
+        Args:
+            password (str): Plain text password.
+            pass_hash (str): The stored bcrypt hash.
+
+        Returns:
+            bool: True if the password matches.
+
+        Raises:
+            PasswordPoolSaturatedError: If the pool is saturated.
+        """
+        return await self._run(bcrypt.checkpw, password.encode('utf-8'), pass_hash.encode('utf-8'))
+
+    def stats(self) -> dict:
+        """ Returns pool size, queue depth and rejection count for metrics. """
+        return {
+            "workers": self._workers,
+            "max_pending": self._max_pending,
+            "in_flight": min(self._pending, self._workers),
+            "queue_depth": max(0, self._pending - self._workers),
+            "rejected": self._rejected,
+        }
+
+    async def _run(self, func, *args):
+        if self._pending >= self._max_pending:
+            self._rejected += 1
+            raise PasswordPoolSaturatedError()
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+
+password_hasher = PasswordHasher()
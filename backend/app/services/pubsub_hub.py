@@ -0,0 +1,241 @@
+""" Shares a small set of Redis Pub/Sub connections between every subscriber in the process """
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Set
+import zlib
+
+from redis.asyncio.client import PubSub
+
+from app.services.myredis import redis_service
+
+# Called with (channel, data) for every message on a subscribed channel. Must not block.
+MessageCallback = Callable[[str, str], None]
+# Called with (channels, since) after a shard reconnected: messages published on
+# those channels after the unix time since may have been lost. Must not block.
+GapCallback = Callable[[Set[str], float], None]
+
+RECONNECT_MIN_DELAY_SECONDS = 0.5
+RECONNECT_MAX_DELAY_SECONDS = 30.0
+
+
+class PubSubHub:
+    """ Singleton instance fanning Pub/Sub messages out to local subscribers.
+
+    Channels are reference counted across all local subscribers, so a chat with
+    500 members connected to this worker costs one Redis subscription instead of 500.
+    Channels are spread over a fixed number of shards, each with its own PubSub
+    connection and reader task.
+
+    When a shard's connection fails, its reader reconnects with exponential backoff
+    on a fresh connection and subscribes every channel of the shard again. Pub/Sub
+    doesn't keep what was published meanwhile, so gap listeners are then told which
+    channels may have missed messages since when. Subscription changes made while
+    a shard reconnects only update the local subscribers, which the reconnect
+    subscribes from.
+    """
+    _instance: Optional['PubSubHub'] = None
+    _shards: Optional[List[PubSub]] = None
+    _shard_locks: Optional[List[asyncio.Lock]] = None
+    _shard_ready: Optional[List[asyncio.Event]] = None
+    _reconnecting: Optional[List[bool]] = None
+    _readers: Optional[List[asyncio.Task]] = None
+    _subscribers: Optional[Dict[str, Set[MessageCallback]]] = None
+    _gap_listeners: Optional[Set[GapCallback]] = None
+    _last_read: Optional[List[float]] = None
+    _reconnects: int = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def init_hub(self, pubsub_config: dict) -> None:
+        """ Opens the shard connections and starts their reader tasks. (call on startup ONLY)
+
+        Args:
+            pubsub_config (dict): Pub/Sub configuration provided by service_configs.
+        """
+        shard_count = pubsub_config["shards"]
+
+        self._subscribers = {}
+        self._gap_listeners = set()
+        self._last_read = [time.time()] * shard_count
+        self._reconnects = 0
+        self._shards = [redis_service.create_pubsub() for _ in range(shard_count)]
+        self._shard_locks = [asyncio.Lock() for _ in range(shard_count)]
+        self._shard_ready = [asyncio.Event() for _ in range(shard_count)]
+        self._reconnecting = [False] * shard_count
+        self._readers = [
+            asyncio.create_task(self._read_shard(index)) for index in range(shard_count)
+        ]
+
+    async def close(self) -> None:
+        """ Stops all reader tasks and closes the shard connections. """
+        for reader in self._readers or ():
+            reader.cancel()
+        await asyncio.gather(*(self._readers or ()), return_exceptions=True)
+
+        for pubsub in self._shards or ():
+            await _close_quietly(pubsub)
+
+        self._readers = []
+        self._shards = []
+        self._subscribers = {}
+
+    async def subscribe(self, channel: str, callback: MessageCallback) -> None:
+        """ Registers a callback for a channel, subscribing in Redis if it is the first.
+
+        Args:
+            channel (str): The channel to listen on.
+            callback (MessageCallback): Called with (channel, data) for each message.
+
+        Raises:
+            RuntimeError: If the hub isn't running.
+        """
+        if not self._shards:
+            raise RuntimeError("Pub/Sub hub is not running, init_hub was not called")
+        self._subscribers.setdefault(channel, set()).add(callback)
+        await self._sync_channel(channel)
+
+    async def unsubscribe(self, channel: str, callback: MessageCallback) -> None:
+        """ Removes a callback from a channel, unsubscribing in Redis if it was the last.
+
+        Args:
+            channel (str): The channel to stop listening on.
+            callback (MessageCallback): The callback previously passed to subscribe.
+        """
+        callbacks = self._subscribers.get(channel)
+        if callbacks is None:
+            return
+
+        callbacks.discard(callback)
+        if not callbacks:
+            del self._subscribers[channel]
+        await self._sync_channel(channel)
+
+    def add_gap_listener(self, callback: GapCallback) -> None:
+        """ Registers a callback told about channels that may have lost messages. """
+        self._gap_listeners.add(callback)
+
+    def remove_gap_listener(self, callback: GapCallback) -> None:
+        """ Removes a callback previously passed to add_gap_listener. """
+        self._gap_listeners.discard(callback)
+
+    def stats(self) -> dict:
+        """ Returns channel and reconnect counts for metrics. """
+        return {
+            "shards": len(self._shards or ()),
+            "channels": len(self._subscribers or ()),
+            "reconnects": self._reconnects,
+        }
+
+    def subscriber_count(self, channel: str) -> int:
+        """ Returns the number of local subscribers to a channel. """
+        return len((self._subscribers or {}).get(channel, ()))
+
+    def _shard_index(self, channel: str) -> int:
+        return zlib.crc32(channel.encode()) % len(self._shards)
+
+    async def _sync_channel(self, channel: str) -> None:
+        """ Brings the Redis subscription for a channel in line with its local subscribers.
+
+        Runs under the shard lock so interleaved subscribe/unsubscribe calls for the
+        same channel always settle on the latest reference count, on the shard's
+        current connection. A failing connection is left to the shard's reader to
+        replace, which subscribes whatever channels are wanted by then.
+        """
+        index = self._shard_index(channel)
+
+        async with self._shard_locks[index]:
+            if self._reconnecting[index]:
+                return
+
+            pubsub = self._shards[index]
+            wanted = channel in self._subscribers
+            subscribed = channel in pubsub.channels and \
+                channel not in pubsub.pending_unsubscribe_channels
+
+            try:
+                if wanted and not subscribed:
+                    await pubsub.subscribe(channel)
+                elif subscribed and not wanted:
+                    await pubsub.unsubscribe(channel)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Pub/Sub shard {index} failed to update {channel}: {e}")
+            # also wakes the reader of a shard whose first subscribe failed, to reconnect it
+            if wanted:
+                self._shard_ready[index].set()
+
+    async def _read_shard(self, index: int) -> None:
+        """ Reads messages from one shard and hands them to the channel's callbacks. """
+        while True:
+            # get_message fails until the first subscribe has opened the connection
+            await self._shard_ready[index].wait()
+
+            try:
+                message = await self._shards[index].get_message(
+                    ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Pub/Sub shard {index} failed, reconnecting: {e}")
+                await self._reconnect_shard(index)
+                continue
+
+            self._last_read[index] = time.time()
+            if message is None or message["type"] != "message":
+                continue
+
+            channel = message["channel"]
+            for callback in tuple(self._subscribers.get(channel, ())):
+                try:
+                    callback(channel, message["data"])
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    print(f"Pub/Sub callback for {channel} failed: {e}")
+
+    async def _reconnect_shard(self, index: int) -> None:
+        """ Replaces a failed shard connection, retrying with backoff until the
+        shard's channels are subscribed again, then reports the gap. """
+        since = self._last_read[index]
+        self._reconnecting[index] = True
+        delay = RECONNECT_MIN_DELAY_SECONDS
+        while True:
+            await asyncio.sleep(delay)
+            async with self._shard_locks[index]:
+                channels = {channel for channel in self._subscribers
+                            if self._shard_index(channel) == index}
+                pubsub = redis_service.create_pubsub()
+                try:
+                    if channels:
+                        await pubsub.subscribe(*channels)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    print(f"Pub/Sub shard {index} reconnect failed, retrying in "
+                          f"{min(delay * 2, RECONNECT_MAX_DELAY_SECONDS)}s: {e}")
+                    await _close_quietly(pubsub)
+                    delay = min(delay * 2, RECONNECT_MAX_DELAY_SECONDS)
+                    continue
+
+                failed, self._shards[index] = self._shards[index], pubsub
+                self._reconnecting[index] = False
+                if not channels:
+                    self._shard_ready[index].clear()
+            break
+
+        self._reconnects += 1
+        self._last_read[index] = time.time()
+        await _close_quietly(failed)
+        print(f"Pub/Sub shard {index} reconnected, {len(channels)} channels resubscribed")
+
+        for callback in tuple(self._gap_listeners):
+            try:
+                callback(channels, since)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Pub/Sub gap listener failed: {e}")
+
+
+async def _close_quietly(pubsub: PubSub) -> None:
+    try:
+        await pubsub.aclose()
+    except Exception:  # pylint: disable=broad-exception-caught
+        pass  # the connection is already broken
+
+
+pubsub_hub = PubSubHub()
@@ -0,0 +1,282 @@
+""" Issues and checks session cookies, kept in Redis or as signed tokens """
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import time
+import uuid
+from typing import Dict, List, Optional, Set
+
+from app.services.myredis import SESSION_TTL_SECONDS, SessionData, redis_service
+from app.services.pubsub_hub import pubsub_hub
+from app.utils.serializer import serializer
+from app.utils.ttl_cache import TTLCache
+
+SESSION_MODES = ("redis", "token")
+REVOCATION_CHANNEL = "session:revoked"
+INVALIDATION_CHANNEL = "session:invalidate"
+
+
+class SessionStore:
+    """ Singleton instance creating, resolving and deleting user sessions.
+
+    In "redis" mode (the default) the cookie holds a random session id and the
+    session itself lives in the sessions Valkey. Sessions are cached in-process
+    for a short TTL, and dropped on every worker through INVALIDATION_CHANNEL
+    when deleted. Each use moves last_activity forward and restarts the session
+    expiry, collected in memory and written in batches every flush_seconds.
+
+    In "token" mode the cookie is an HMAC-SHA256 signed token carrying the user
+    id, username and expiry, verified locally without a network hop. Logging
+    out adds the token id to a revocation set in Redis. Every worker mirrors
+    that set in memory, applies additions published on REVOCATION_CHANNEL and
+    reloads it every refresh_seconds in case a Pub/Sub message was missed.
+    """
+    _instance: Optional['SessionStore'] = None
+    _mode: str = "redis"
+    _secrets: List[bytes] = []
+    _refresh_seconds: float = 60.0
+    _revoked: Dict[str, float] = {}
+    _refresh_task: Optional[asyncio.Task] = None
+    _cache: Optional[TTLCache] = None
+    _flush_seconds: float = 30.0
+    _pending_activity: Dict[str, float] = {}
+    _flush_task: Optional[asyncio.Task] = None
+    _gap_refresh_task: Optional[asyncio.Task] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    async def init_store(self, session_config: dict) -> None:
+        """ Configures the session mode. (call on startup ONLY)
+
+        Args:
+            session_config (dict): Session configuration provided by service_configs.
+        """
+        if session_config["mode"] not in SESSION_MODES:
+            raise ValueError(
+                f"Unknown SESSION_MODE {session_config['mode']!r}, "
+                f"expected one of {', '.join(SESSION_MODES)}"
+            )
+
+        self._mode = session_config["mode"]
+        self._secrets = session_config["token_secrets"]
+        self._refresh_seconds = session_config["revocation_refresh_seconds"]
+        self._revoked = {}
+        self._flush_seconds = session_config["activity_flush_seconds"]
+        self._pending_activity = {}
+
+        pubsub_hub.add_gap_listener(self._handle_gap)
+        if self._mode == "redis":
+            self._cache = TTLCache(session_config["cache_size"], session_config["cache_ttl"])
+            await pubsub_hub.subscribe(INVALIDATION_CHANNEL, self._handle_invalidation)
+            self._flush_task = asyncio.create_task(self._run_activity_flush())
+        else:
+            await pubsub_hub.subscribe(REVOCATION_CHANNEL, self._handle_revocation)
+            await self.refresh_revocations()
+            self._refresh_task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """ Stops the background tasks and writes out pending session activity. """
+        for task in (self._refresh_task, self._flush_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+        if self._pending_activity:
+            await self.flush_activity()
+
+    async def create_session(self, user_id: bytes, username: str) -> str:
+        """ Creates a session and returns the value of its cookie.
+
+        Args:
+            user_id (bytes): The id of the user.
+            username (str): The username of the user.
+
+        Returns:
+            str: The session id, or the signed token in token mode.
+        """
+        if self._mode == "redis":
+            return await redis_service.create_session(user_id, username)
+
+        now = time.time()
+        return self._sign({
+            "uid": user_id.hex(),
+            "un": username,
+            "iat": now,
+            "exp": now + SESSION_TTL_SECONDS,
+            "jti": uuid.uuid4().hex,
+        })
+
+    async def get_session(self, session_id: Optional[str]) -> Optional[SessionData]:
+        """ Gets the session a cookie belongs to.
+
+        Args:
+            session_id (Optional[str]): The session id, or the signed token in token mode.
+
+        Returns:
+            Optional[SessionData]: The session, or None if it does not exist, has
+            expired or was revoked.
+        """
+        if session_id is None:
+            return None
+
+        if self._mode == "redis":
+            return await self._get_redis_session(session_id)
+
+        claims = self._verify(session_id)
+        if claims is None or claims["jti"] in self._revoked:
+            return None
+
+        return SessionData(
+            user_id=claims["uid"],
+            username=claims["un"],
+            created_at=claims["iat"],
+            last_activity=claims["iat"]
+        )
+
+    async def delete_session(self, session_id: Optional[str]) -> None:
+        """ Deletes a session, or revokes its token on every worker in token mode.
+
+        Args:
+            session_id (Optional[str]): The session id, or the signed token in token mode.
+        """
+        if session_id is None:
+            return
+
+        if self._mode == "redis":
+            cache_key = _cache_key(session_id)
+            self._cache.pop(cache_key)
+            self._pending_activity.pop(session_id, None)
+            await redis_service.delete_session(session_id)
+            await redis_service.publish_invalidation(INVALIDATION_CHANNEL, {
+                "session": cache_key,
+            })
+            return
+
+        claims = self._verify(session_id)
+        if claims is None:
+            return  # forged or already expired, nothing to revoke
+
+        self._revoked[claims["jti"]] = claims["exp"]
+        await redis_service.revoke_session_token(claims["jti"], claims["exp"])
+        await redis_service.publish_invalidation(REVOCATION_CHANNEL, {
+            "jti": claims["jti"],
+            "exp": claims["exp"],
+        })
+
+    async def flush_activity(self) -> None:
+        """ Writes the collected session activity to Redis. """
+        pending, self._pending_activity = self._pending_activity, {}
+        await redis_service.touch_sessions(pending)
+
+    async def refresh_revocations(self) -> None:
+        """ Reloads the revoked token ids that haven't expired yet from Redis. """
+        self._revoked = await redis_service.get_revoked_session_tokens()
+
+    def stats(self) -> dict:
+        """ Returns the session mode with its cache or revocation set sizes for metrics. """
+        if self._mode == "redis":
+            return {
+                "mode": self._mode,
+                "cache": self._cache.stats(),
+                "pending_activity": len(self._pending_activity),
+            }
+        return {
+            "mode": self._mode,
+            "revoked_tokens": len(self._revoked),
+        }
+
+    async def _get_redis_session(self, session_id: str) -> Optional[SessionData]:
+        cache_key = _cache_key(session_id)
+        session_data = self._cache.get(cache_key)
+        if session_data is None:
+            session_data = await redis_service.get_session(session_id)
+            if session_data is None:
+                return None  # not cached, unknown ids would only crowd out real sessions
+            self._cache.set(cache_key, session_data)
+
+        now = time.time()
+        session_data.last_activity = now
+        self._pending_activity[session_id] = now
+        return session_data
+
+    def _sign(self, claims: dict) -> str:
+        payload = _b64encode(serializer.dumpb(claims))
+        return f"{payload}.{_b64encode(_signature(self._secrets[0], payload))}"
+
+    def _verify(self, token: str) -> Optional[dict]:
+        payload, _, signature = token.partition(".")
+        try:
+            signature_bytes = _b64decode(signature)
+        except (binascii.Error, ValueError):
+            return None
+
+        # any configured secret verifies, so secrets can be rotated
+        if not any(hmac.compare_digest(_signature(secret, payload), signature_bytes)
+                   for secret in self._secrets):
+            return None
+
+        claims = serializer.loads(_b64decode(payload))
+        if claims["exp"] <= time.time():
+            return None
+        return claims
+
+    def _handle_invalidation(self, _channel: str, data: str) -> None:
+        self._cache.pop(serializer.loads(data)["session"])
+
+    def _handle_revocation(self, _channel: str, data: str) -> None:
+        event = serializer.loads(data)
+        self._revoked[event["jti"]] = event["exp"]
+
+    def _handle_gap(self, channels: Set[str], _since: float) -> None:
+        if INVALIDATION_CHANNEL in channels:
+            self._cache.clear()
+        elif REVOCATION_CHANNEL in channels:
+            # revocations published meanwhile are only in the Redis set
+            self._gap_refresh_task = asyncio.create_task(self._refresh_after_gap())
+
+    async def _refresh_after_gap(self) -> None:
+        try:
+            await self.refresh_revocations()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Session revocation refresh failed: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._refresh_seconds)
+            try:
+                await self.refresh_revocations()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Session revocation refresh failed: {e}")
+
+    async def _run_activity_flush(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_seconds)
+            try:
+                await self.flush_activity()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Session activity flush failed: {e}")
+
+
+def _cache_key(session_id: str) -> str:
+    # session ids are credentials, only their digest is published to other workers
+    return hashlib.sha256(session_id.encode()).hexdigest()
+
+
+def _signature(secret: bytes, payload: str) -> bytes:
+    return hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+session_store = SessionStore()
@@ -0,0 +1,169 @@
+""" Process-local cache of user id <-> username lookups """
+from typing import Dict, List, Optional, Set
+
+from app.services.myredis import redis_service
+from app.services.mysqldb import db_service
+from app.services.pubsub_hub import pubsub_hub
+from app.templates.chats.responses import ChatMessage
+from app.utils.serializer import serializer
+from app.utils.ttl_cache import TTLCache
+
+INVALIDATION_CHANNEL = "user_directory:invalidate"
+
+_MISSING = object()
+
+
+class UserDirectory:
+    """ Singleton instance caching user lookups in front of DatabaseService.
+
+    Both directions are cached, including negative results. Entries are dropped
+    on every worker when an invalidation is published on INVALIDATION_CHANNEL.
+    """
+    _instance: Optional['UserDirectory'] = None
+    _usernames: Optional[TTLCache] = None
+    _user_ids: Optional[TTLCache] = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    async def init_cache(self, user_cache_config: dict) -> None:
+        """ Creates the caches and listens for invalidations. (call on startup ONLY)
+
+        Args:
+            user_cache_config (dict): User cache configuration provided by service_configs.
+        """
+        self._usernames = TTLCache(**user_cache_config)
+        self._user_ids = TTLCache(**user_cache_config)
+        await pubsub_hub.subscribe(INVALIDATION_CHANNEL, self._handle_invalidation)
+        pubsub_hub.add_gap_listener(self._handle_gap)
+
+    async def get_username(self, user_id: bytes) -> Optional[str]:
+        """ Gets the username for a given user id.
+
+        Args:
+            user_id (bytes): User id of user.
+
+        Returns:
+            Optional[str]: Username if user exists, else None.
+        """
+        username = self._usernames.get(user_id, _MISSING)
+        if username is _MISSING:
+            username = await db_service.get_username(user_id)
+            self._remember(user_id, username)
+        return username
+
+    async def get_usernames(self, user_ids: List[bytes]) -> Dict[bytes, str]:
+        """ Gets the usernames for several user ids, querying only the uncached ones.
+
+        Args:
+            user_ids (List[bytes]): User ids of users. Duplicates are ignored.
+
+        Returns:
+            Dict[bytes, str]: Mapping of user id to username. Ids of users that
+            don't exist are left out.
+        """
+        usernames = {}
+        uncached_ids = []
+        for user_id in dict.fromkeys(user_ids):
+            username = self._usernames.get(user_id, _MISSING)
+            if username is _MISSING:
+                uncached_ids.append(user_id)
+            elif username is not None:
+                usernames[user_id] = username
+
+        if uncached_ids:
+            found = await db_service.get_usernames(uncached_ids)
+            for user_id in uncached_ids:
+                self._remember(user_id, found.get(user_id))
+            usernames.update(found)
+
+        return usernames
+
+    async def fill_sender_usernames(self, messages: List[ChatMessage]) -> None:
+        """ Sets sender_username on each message from its sender id, in place.
+
+        Args:
+            messages (List[ChatMessage]): Messages to resolve the senders of.
+        """
+        sender_ids = {
+            bytes.fromhex(message.sender_id) for message in messages
+            if message.sender_id != "SERVER"
+        }
+        usernames = await self.get_usernames(list(sender_ids))
+
+        for message in messages:
+            if message.sender_id == "SERVER":
+                message.sender_username = "SERVER"
+            else:
+                message.sender_username = usernames.get(bytes.fromhex(message.sender_id))
+
+    async def get_user_id(self, username: str) -> Optional[bytes]:
+        """ Gets the user id for a given username.
+
+        Args:
+            username (str): Username of user.
+
+        Returns:
+            Optional[bytes]: If user exists, the user id. Otherwise none.
+        """
+        user_id = self._user_ids.get(username, _MISSING)
+        if user_id is _MISSING:
+            user_id = await db_service.get_user_id(username)
+            if user_id is None:
+                self._user_ids.set(username, None)
+            else:
+                user_id = bytes(user_id)
+                self._remember(user_id, username)
+        return user_id
+
+    async def invalidate(self, user_id: Optional[bytes] = None,
+                         username: Optional[str] = None) -> None:
+        """ Drops a user's entries on every worker, e.g. after signup or a rename.
+
+        Args:
+            user_id (Optional[bytes]): Id of the user that changed.
+            username (Optional[str]): Username that changed, including new usernames
+                that may be cached as not existing.
+        """
+        self._forget(user_id, username)
+        await redis_service.publish_invalidation(INVALIDATION_CHANNEL, {
+            "user_id": user_id.hex() if user_id is not None else None,
+            "username": username,
+        })
+
+    def stats(self) -> dict:
+        """ Returns hit/miss counters for both lookup directions. """
+        return {
+            "usernames": self._usernames.stats(),
+            "user_ids": self._user_ids.stats(),
+        }
+
+    def _remember(self, user_id: bytes, username: Optional[str]) -> None:
+        self._usernames.set(user_id, username)
+        if username is not None:
+            self._user_ids.set(username, user_id)
+
+    def _forget(self, user_id: Optional[bytes], username: Optional[str]) -> None:
+        if user_id is not None:
+            cached_username = self._usernames.pop(user_id)
+            if cached_username is not None:
+                self._user_ids.pop(cached_username)
+        if username is not None:
+            cached_user_id = self._user_ids.pop(username)
+            if cached_user_id is not None:
+                self._usernames.pop(cached_user_id)
+
+    def _handle_invalidation(self, _channel: str, data: str) -> None:
+        event = serializer.loads(data)
+        user_id = event["user_id"]
+        self._forget(bytes.fromhex(user_id) if user_id else None, event["username"])
+
+    def _handle_gap(self, channels: Set[str], _since: float) -> None:
+        if INVALIDATION_CHANNEL in channels:
+            self._usernames.clear()
+            self._user_ids.clear()
+
+
+user_directory = UserDirectory()
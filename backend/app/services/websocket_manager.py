@@ -1,190 +1,446 @@
 """ Handles websocket connections """
 import asyncio
 import json
-from typing import Optional
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
 from fastapi import HTTPException, WebSocket, status
-from app.services.myredis import SessionData, redis_service
-from app.services.mysqldb import db_service
-from app.templates.chats.responses import (ChatMessage, WSChatMessageData, WSUserAddedData,
-                                           WSUserRemovedData, WebsocketMessage)
+from pydantic import ValidationError
+from app.services.connection_registry import connection_registry
+from app.services.membership_cache import membership_cache
+from app.services.message_archive import message_archive
+from app.services.myredis import SessionData
+from app.services.pubsub_hub import pubsub_hub
+from app.services.session_store import session_store
+from app.services.user_directory import user_directory
+from app.services.write_combiner import write_combiner
+from app.templates.chats.requests import WSSendMessageData
+from app.templates.chats.responses import (ChatMessage, WSCaughtUpData, WSChatMessageData,
+                                           WSResumeData, WSUserAddedData, WSUserRemovedData,
+                                           WebsocketMessage)
+from app.utils.frame_codecs import FrameCodec, JsonFrameCodec
+from app.utils.outbound_queue import OutboundQueue
+from app.utils.serializer import serializer
+from app.utils.stream_ids import is_stream_id, parse_stream_id, previous_stream_id
+
+# larger gaps are left to the client to refetch over REST
+MAX_REPLAY_MESSAGES = 500
+# how long an overflowing client gets to take the resume hint before the close
+RESUME_HINT_TIMEOUT_SECONDS = 1.0
+# chat message frames are published pre-encoded with the message id first
+_FRAME_MESSAGE_ID_MARKER = '"message_id":"'
+
+
+class CatchUpRequest(NamedTuple):
+    """ Inbox entry asking the writer task to replay a chat from last_seen. On the
+    user channel it asks to re-read the user's chats instead. """
+    last_seen: str
 
 
 class WebSocketConnectionManager:
     """ Class to handle WebSocket connections and manage chat subscriptions.
 
+    Subscriptions are registered with the process-wide pubsub_hub, which pushes
+    incoming messages onto this connection's inbox. A single writer task drains
+    the inbox and forwards messages to the client. Chat messages arrive as
+    finished client frames and are sent on as-is, without being decoded.
+    Clients that negotiated the msgpack subprotocol get them transcoded by
+    their codec instead, once per frame for all such clients. The inbox is bounded, a full
+    inbox is handled by the overflow policy of the connection_registry, so a
+    slow client never blocks the hub or grows its buffer without limit.
+
+    Pub/Sub drops anything published while a client is disconnected, so clients
+    can subscribe with the id of the last message they saw. The writer replays
+    the missed messages from the chat stream while live messages for that chat
+    are held back, then releases the held messages it did not already replay.
+    The same replay runs for the chats of a hub shard that had to reconnect, and
+    the user's chats are re-read in case added/removed notifications were lost.
+
     Attributes:
         websocket (WebSocket): The WebSocket connection to manage
         session_data (SessionData): Session data for the authenticated user
-        active_subscriptions (Dict[str, asyncio.Task]): Mapping of subscription IDs
-            (chat IDs or the userID) to their corresponding background tasks
-        user_chat_ids (Set[str]): Set of chat IDs that the user is authorized to access
+        codec (FrameCodec): Wire format of this connection's frames
+        active_subscriptions (Set[str]): Channel ids (chat IDs or the user ID)
+            this connection is subscribed to
+        inbox (OutboundQueue): Pending (channel, data) messages from the hub
+        last_delivered (Dict[str, Tuple[int, int]]): Newest message id delivered
+            per chat, as parsed stream ids
+        catching_up (Dict[str, List[str]]): Live messages held back per chat
+            until its replay has been sent
     """
 
-    def __init__(self, websocket: WebSocket, session_data: SessionData):
+    def __init__(self, websocket: WebSocket, session_data: SessionData,
+                 codec: Optional[FrameCodec] = None):
         self.websocket = websocket
         self.session_data = session_data
-        self.active_subscriptions = {}
-        self.user_chat_ids = set()
+        self.codec = codec if codec is not None else JsonFrameCodec()
+        self.active_subscriptions = set()
+        self.inbox = OutboundQueue(connection_registry.queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.disconnect_task: Optional[asyncio.Task] = None
+        self.last_delivered: Dict[str, Tuple[int, int]] = {}
+        self.catching_up: Dict[str, List[str]] = {}
 
     async def handle_connection(self):
         """ Main connection handling loop. """
+        await connection_registry.register(self)
+        pubsub_hub.add_gap_listener(self.handle_subscription_gap)
+        self.writer_task = asyncio.create_task(self.forward_messages())
         await self.initialize_subscriptions()
 
         while True:
-            data = await self.websocket.receive_text()
+            if self.codec.binary:
+                data = await self.websocket.receive_bytes()
+            else:
+                data = await self.websocket.receive_text()
             await self.handle_client_message(data)
 
-    async def listen_for_notifications(self):
-        """ Listens for Redis Pub/Sub messages via user id and forwards them to the
-        WebSocket client.
+    def enqueue(self, channel: str, data: str):
+        """ Hub callback, queues a Pub/Sub message for the writer task. """
+        if self.disconnect_task is not None:
+            return  # already being closed
+
+        if self.inbox.full() and not self.make_room(data):
+            connection_registry.record_overflow("disconnected")
+            self.disconnect_task = asyncio.create_task(self.disconnect(
+                status.WS_1013_TRY_AGAIN_LATER, "Outbound queue overflow"))
+            return
+
+        self.inbox.put((channel, data))
+
+    def make_room(self, data: str) -> bool:
+        """ Applies the overflow policy to a full inbox before queueing data.
+
+        Returns:
+            bool: True if data may be queued, False if the client must be disconnected.
         """
-        async with redis_service.subscribe_to_channel(self.session_data.user_id) as pubsub:
-            # Handles backend -> frontend traffic
-            async for message in pubsub.listen():
-                if message["type"] == "message":
-                    message_data = message["data"]
-                    raw_message = json.loads(message_data)
-
-                    msg_type = raw_message["type"]
-
-                    if msg_type == "added_to_chat":
-                        chat_id = raw_message["chat_id"]
-                        added_by_id = raw_message["added_by_id"]
-
-                        # add subscription
-                        _ = self.subscribe_to_chat(chat_id)
-
-                        ws_payload = WSUserAddedData(
-                            chat_id=chat_id,
-                            added_by=added_by_id,
-                        )
-
-                        full_message = WebsocketMessage(
-                            type="added_to_chat",
-                            data=ws_payload,
-                        )
-                        # notify user
-                        await self.websocket.send_json(full_message.model_dump())
-                    elif msg_type == "removed_from_chat":
-                        chat_id = raw_message["chat_id"]
-                        removed_by_id = raw_message["removed_by_id"]
-
-                        # remove subscription
-                        _ = self.unsubscribe_from_chat(chat_id)
-
-                        ws_payload = WSUserRemovedData(
-                            chat_id=chat_id,
-                            removed_by=removed_by_id
-                        )
-
-                        full_message = WebsocketMessage(
-                            type="removed_from_chat",
-                            data=ws_payload,
-                        )
-                        # notify user
-                        await self.websocket.send_json(full_message.model_dump(by_alias=True))
-
-    async def listen_for_messages(self, chat_id: str):
-        """ Listens for Redis Pub/Sub messages via chat id and forwards them to the
-        WebSocket client.
+        policy = connection_registry.overflow_policy
+        if policy == "disconnect":
+            return False
 
-        Args:
-            chat_id (str): The id of the redis channel to connect to.
-            websocket (WebSocket): WebSocket connection to send messages to the client.
+        if self.inbox.remove_first(lambda item: _is_typing_event(item[1])) is not None:
+            connection_registry.record_overflow("dropped_typing")
+            return True
+
+        if policy == "coalesce" and self.coalesce_backlog():
+            connection_registry.record_overflow("coalesced")
+            return True
+
+        return False
+
+    def coalesce_backlog(self) -> bool:
+        """ Replaces the queued messages of the chat with the largest backlog by a
+        single replay request, which reads them back from the stream once the
+        writer gets to it.
+
+        Returns:
+            bool: True if this freed up room in the inbox.
+        """
+        backlog = Counter(
+            channel for channel, data in self.inbox
+            if channel != self.session_data.user_id and isinstance(data, str)
+        )
+        if not backlog:
+            return False
+
+        chat_id, queued = backlog.most_common(1)[0]
+        if queued < 2:
+            return False
+
+        removed = self.inbox.remove_all(lambda item: item[0] == chat_id)
+        replay_from = [data.last_seen for _, data in removed if isinstance(data, CatchUpRequest)]
+        message_ids = [
+            message_id for message_id in
+            (_frame_message_id(data) for _, data in removed if isinstance(data, str))
+            if message_id is not None
+        ]
+        if chat_id in self.last_delivered:
+            replay_from.append(_format_stream_id(self.last_delivered[chat_id]))
+        elif message_ids:
+            replay_from.append(previous_stream_id(message_ids[0]))
+
+        if replay_from:
+            last_seen = min(replay_from, key=parse_stream_id)
+            self.enqueue(chat_id, CatchUpRequest(last_seen))
+        return True
+
+    async def disconnect(self, code: int, reason: str):
+        """ Closes the connection after its inbox overflowed or its writer failed.
+
+        The client is sent the newest message id delivered per chat first, so it
+        can reconnect and subscribe with last_seen to pick up where it left off.
+        """
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            await asyncio.gather(self.writer_task, return_exceptions=True)
+
+        resume_message = WebsocketMessage(
+            type="resume",
+            data=WSResumeData(last_seen={
+                chat_id: _format_stream_id(position)
+                for chat_id, position in self.last_delivered.items()
+            })
+        )
+        try:
+            await asyncio.wait_for(
+                self.send_frame(resume_message),
+                RESUME_HINT_TIMEOUT_SECONDS
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Could not send resume hint to client: {e}")
+
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Could not close client connection: {e}")
+
+    async def forward_messages(self):
+        """ Drains the inbox and forwards each message to the WebSocket client.
+
+        A message that fails to be forwarded closes the connection, so the client
+        reconnects and resumes instead of waiting on a writer that is gone.
 
         Note:
             Runs continuously until the WebSocket connection is closed.
-            Only processes messages of type "message" from Redis.
         """
-        async with redis_service.subscribe_to_channel(chat_id) as pubsub:
-            # Handles backend -> frontend traffic
-            async for message in pubsub.listen():
-                if message["type"] == "message":
-                    message_data = message["data"]
-                    raw_message = json.loads(message_data)
-
-                    msg_type = raw_message["type"]
-
-                    if msg_type == "message":
-                        message_id = raw_message["message_id"]
-                        sender_id = raw_message["sender_id"]
-                        sender_username = raw_message["sender_username"]
-                        content = raw_message["content"]
-                        timestamp = raw_message["timestamp"]
-
-                        message_obj = ChatMessage(
-                            message_id=message_id,
-                            sender_id=sender_id,
-                            sender_username=sender_username,
-                            content=content,
-                            timestamp=timestamp
-                        )
-
-                        ws_payload = WSChatMessageData(
-                            chat_id=chat_id,
-                            message=message_obj
-                        )
-
-                        full_message = WebsocketMessage(
-                            type="message",
-                            data=ws_payload
-                        )
-                        await self.websocket.send_json(full_message.model_dump(by_alias=True))
-                    elif msg_type == "is_typing":
-                        pass
+        while True:
+            channel, data = await self.inbox.get()
+            try:
+                await self.forward_inbox_entry(channel, data)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"Could not forward message of channel {channel}, closing connection: {e}")
+                if self.disconnect_task is None:
+                    self.disconnect_task = asyncio.create_task(self.disconnect(
+                        status.WS_1011_INTERNAL_ERROR, "Message delivery failed"))
+                return
+
+    async def forward_inbox_entry(self, channel: str, data: Union[str, CatchUpRequest]):
+        """ Forwards one (channel, data) entry of the inbox. """
+        if channel == self.session_data.user_id:
+            if isinstance(data, CatchUpRequest):
+                await self.resync_subscriptions()
+            else:
+                await self.handle_notification(data)
+        elif isinstance(data, CatchUpRequest):
+            await self.replay_missed_messages(channel, data.last_seen)
+        elif channel in self.catching_up:
+            self.catching_up[channel].append(data)
+        else:
+            await self.forward_chat_message(channel, data)
+
+    def handle_subscription_gap(self, channels: Set[str], since: float):
+        """ Hub gap listener, queues a replay of every subscribed channel that may
+        have lost messages, from the newest delivered message or else from since.
+        """
+        since_id = previous_stream_id(f"{int(since * 1000)}-0")
+        for channel in channels & self.active_subscriptions:
+            last_delivered = self.last_delivered.get(channel)
+            self.enqueue(channel, CatchUpRequest(
+                _format_stream_id(last_delivered) if last_delivered is not None else since_id))
+
+    async def resync_subscriptions(self):
+        """ Re-reads the user's chats after notifications may have been lost,
+        subscribing to chats added and dropping chats removed meanwhile. """
+        user_id = self.session_data.user_id
+        membership_cache.forget(user_id)
+        chat_ids = await membership_cache.get_chat_ids(user_id)
+
+        for chat_id in self.active_subscriptions - chat_ids - {user_id}:
+            await self.unsubscribe_from_chat(chat_id)
+        for chat_id in chat_ids - self.active_subscriptions:
+            await self.subscribe_to_chat(chat_id)
+
+    async def handle_notification(self, message_data: str):
+        """ Handles a Redis Pub/Sub message sent on the user id channel.
+
+        Args:
+            message_data (str): Raw JSON payload from Redis.
+        """
+        raw_message = serializer.loads(message_data)
+
+        msg_type = raw_message["type"]
+
+        if msg_type == "added_to_chat":
+            chat_id = raw_message["chat_id"]
+            added_by_id = raw_message["added_by_id"]
+
+            # add subscription, the membership may have been mirrored without the chat
+            membership_cache.forget(self.session_data.user_id)
+            await self.subscribe_to_chat(chat_id)
+
+            ws_payload = WSUserAddedData(
+                chat_preview=raw_message.get("chat_preview"),
+                added_by=added_by_id,
+            )
+
+            full_message = WebsocketMessage(
+                type="added_to_chat",
+                data=ws_payload,
+            )
+            # notify user
+            await self.send_frame(full_message)
+        elif msg_type == "removed_from_chat":
+            chat_id = raw_message["chat_id"]
+            removed_by_id = raw_message["removed_by_id"]
+
+            # remove subscription
+            membership_cache.forget(self.session_data.user_id)
+            await self.unsubscribe_from_chat(chat_id)
+
+            ws_payload = WSUserRemovedData(
+                chat_id=chat_id,
+                removed_by=removed_by_id
+            )
+
+            full_message = WebsocketMessage(
+                type="removed_from_chat",
+                data=ws_payload,
+            )
+            # notify user
+            await self.send_frame(full_message)
+
+    async def forward_chat_message(self, chat_id: str, frame: str):
+        """ Forwards a frame published on a chat channel to the client, untouched.
+
+        Args:
+            chat_id (str): The id of the chat the frame was published on.
+            frame (str): Client frame, already encoded by the publisher.
+        """
+        message_id = _frame_message_id(frame)
+        if message_id is None:
+            await self.send_encoded(self.codec.encode_raw(frame))
+            return
+
+        if self.is_delivered(chat_id, message_id):
+            return  # already sent by a replay
+
+        await self.send_encoded(self.codec.encode_raw(frame))
+        self.record_delivered(chat_id, message_id)
+
+    async def send_chat_message(self, chat_id: str, message: ChatMessage):
+        """ Sends a single chat message to the client and records it as delivered. """
+        ws_payload = WSChatMessageData(
+            chat_id=chat_id,
+            message=message
+        )
+
+        full_message = WebsocketMessage(
+            type="message",
+            data=ws_payload
+        )
+        await self.send_frame(full_message)
+        self.record_delivered(chat_id, message.message_id)
+
+    async def send_frame(self, message: WebsocketMessage):
+        """ Encodes a frame with the connection's codec and sends it to the client. """
+        await self.send_encoded(self.codec.encode(message))
+
+    async def send_encoded(self, data: Union[str, bytes]):
+        """ Sends an encoded frame as a text or binary WebSocket message. """
+        if isinstance(data, bytes):
+            await self.websocket.send_bytes(data)
+        else:
+            await self.websocket.send_text(data)
+
+    def record_delivered(self, chat_id: str, message_id: str):
+        """ Moves the newest delivered id of a chat forward to message_id. """
+        if not self.is_delivered(chat_id, message_id):
+            self.last_delivered[chat_id] = parse_stream_id(message_id)
+
+    def is_delivered(self, chat_id: str, message_id: str) -> bool:
+        """ Returns True if this message, or a newer one, was already delivered. """
+        last_delivered = self.last_delivered.get(chat_id)
+        return last_delivered is not None and parse_stream_id(message_id) <= last_delivered
+
+    async def replay_missed_messages(self, chat_id: str, last_seen: str):
+        """ Sends the messages of a chat newer than last_seen and a caught_up event,
+        then releases the live messages held back meanwhile.
+
+        Args:
+            chat_id (str): The id of the chat to replay.
+            last_seen (str): Id of the newest message the client already has.
+        """
+        try:
+            if chat_id not in self.active_subscriptions:
+                return  # unsubscribed while the request was queued
+
+            missed = await message_archive.get_chat_history_after(
+                chat_id, last_seen, MAX_REPLAY_MESSAGES + 1)
+            complete = len(missed) <= MAX_REPLAY_MESSAGES
+            missed = missed[:MAX_REPLAY_MESSAGES]
+
+            await user_directory.fill_sender_usernames(missed)
+            for message in missed:
+                await self.send_chat_message(chat_id, message)
+
+            full_message = WebsocketMessage(
+                type="caught_up",
+                data=WSCaughtUpData(
+                    chat_id=chat_id,
+                    last_message_id=missed[-1].message_id if missed else None,
+                    complete=complete
+                )
+            )
+            await self.send_frame(full_message)
+        finally:
+            held = self.catching_up.pop(chat_id, [])
+            if chat_id in self.active_subscriptions:
+                for message_data in held:
+                    await self.forward_chat_message(chat_id, message_data)
 
     async def initialize_subscriptions(self):
         """ Set up initial Redis subscriptions for user chats and notifications."""
-        previews = await db_service.get_all_user_chats(self.session_data.username)
-        self.user_chat_ids = {preview.chat_id for preview in previews}
+        chat_ids = await membership_cache.get_chat_ids(self.session_data.user_id)
 
         # Subscribe to user-level notifications (add/remove from chats)
         await self.subscribe_to_user_notifications()
 
         # Subscribe to all user"s chats
-        for preview in previews:
-            await self.subscribe_to_chat(preview.chat_id)
+        for chat_id in chat_ids:
+            await self.subscribe_to_chat(chat_id)
 
     async def subscribe_to_user_notifications(self):
         """ Subscribe to Redis channel for user-specific notifications."""
-        task = asyncio.create_task(
-            self.listen_for_notifications()
-        )
-        self.active_subscriptions[self.session_data.user_id] = task
+        user_id = self.session_data.user_id
+        self.active_subscriptions.add(user_id)
+        await pubsub_hub.subscribe(user_id, self.enqueue)
 
     async def subscribe_to_chat(self, chat_id: str):
         """ Subscribe to a specific chat's Redis channel. """
         if chat_id in self.active_subscriptions:
             return  # Already subscribed
 
-        task = asyncio.create_task(
-            self.listen_for_messages(chat_id)
-        )
-        self.active_subscriptions[chat_id] = task
+        self.active_subscriptions.add(chat_id)
+        await pubsub_hub.subscribe(chat_id, self.enqueue)
 
     async def unsubscribe_from_chat(self, chat_id: str):
         """ Unsubscribe from a chat's Redis channel. """
         if chat_id not in self.active_subscriptions:
             return
 
-        self.active_subscriptions[chat_id].cancel()
-        del self.active_subscriptions[chat_id]
+        self.active_subscriptions.discard(chat_id)
+        self.last_delivered.pop(chat_id, None)
+        await pubsub_hub.unsubscribe(chat_id, self.enqueue)
 
-    async def handle_client_message(self, raw_data: str):
+    async def handle_client_message(self, raw_data: Union[str, bytes]):
         """ Process incoming messages from the client. """
         try:
-            parsed_data = json.loads(raw_data)
-            request_type = parsed_data.get("type")
-            chat_id = parsed_data.get("chat_id")
+            parsed_data = self.codec.decode(raw_data)
+        except ValueError:
+            print(f"Invalid frame received: {raw_data!r}")
+            return
 
-            handler = self.get_message_handler(request_type)
-            if handler:
-                await handler(chat_id, parsed_data)
-            else:
-                print(f"Unknown request type: {request_type}")
+        if not isinstance(parsed_data, dict):
+            print(f"Invalid frame received: {raw_data!r}")
+            return
 
-        except json.JSONDecodeError:
-            print(f"Invalid JSON received: {raw_data}")
+        request_type = parsed_data.get("type")
+        chat_id = parsed_data.get("chat_id")
+
+        handler = self.get_message_handler(request_type)
+        if handler:
+            await handler(chat_id, parsed_data)
+        else:
+            print(f"Unknown request type: {request_type}")
 
     def get_message_handler(self, request_type: str):
         """ Get the appropriate handler for the request type. """
@@ -197,35 +453,51 @@ class WebSocketConnectionManager:
 
     async def handle_message_request(self, chat_id: str, data: dict):
         """ Handle incoming chat messages from client. """
-        if chat_id not in self.user_chat_ids:
+        if not await membership_cache.is_member(self.session_data.user_id, chat_id):
             print(
                 f"User attempted to send message to unauthorized chat: {chat_id}")
             return
 
-        content = data.get("content")
-        if content:
-            await redis_service.send_chat_message(
-                chat_id,
-                self.session_data.user_id,
-                self.session_data.username,
-                content
-            )
-
-    async def handle_subscribe_request(self, chat_id: str, _):
-        """ Handle subscription requests to new chats. """
-        if chat_id in self.active_subscriptions:
-            print(f"Already subscribed to chat {chat_id}")
+        try:
+            message = WSSendMessageData.model_validate(data)
+        except ValidationError as e:
+            print(f"Invalid message request: {e}")
             return
 
-        can_subscribe = await db_service.is_user_in_chat(
-            self.session_data.username, chat_id.encode()
+        await write_combiner.send_chat_message(
+            message.chat_id,
+            self.session_data.user_id,
+            self.session_data.username,
+            message.content
         )
-        if can_subscribe:
-            await self.subscribe_to_chat(chat_id)
-            self.user_chat_ids.add(chat_id)
+
+    async def handle_subscribe_request(self, chat_id: str, data: dict):
+        """ Handle subscription requests to new chats.
+
+        If the request carries last_seen (the id of the newest message the client
+        has), messages missed since then are replayed before live delivery resumes.
+        """
+        last_seen = data.get("last_seen")
+        if last_seen is not None and not is_stream_id(last_seen):
+            print(f"Invalid last_seen id: {last_seen}")
+            return
+
+        if chat_id in self.active_subscriptions:
+            if last_seen is None:
+                print(f"Already subscribed to chat {chat_id}")
+                return
         else:
-            print(
-                f"User attempted to subscribe to unauthorized chat: {chat_id}")
+            if not await membership_cache.is_member(self.session_data.user_id, chat_id):
+                print(
+                    f"User attempted to subscribe to unauthorized chat: {chat_id}")
+                return
+
+            await self.subscribe_to_chat(chat_id)
+
+        if last_seen is not None:
+            # hold back live messages from now on, the replay may already cover them
+            self.catching_up.setdefault(chat_id, [])
+            self.enqueue(chat_id, CatchUpRequest(last_seen))
 
     async def handle_unsubscribe_request(self, chat_id: str, _):
         """ Handle unsubscription requests from chats. """
@@ -233,20 +505,44 @@ class WebSocketConnectionManager:
 
     async def cleanup(self):
         """Clean up all subscriptions and tasks."""
-        for task in self.active_subscriptions.values():
-            task.cancel()
+        await connection_registry.unregister(self)
+        pubsub_hub.remove_gap_listener(self.handle_subscription_gap)
+        if self.writer_task is not None:
+            self.writer_task.cancel()
+            await asyncio.gather(self.writer_task, return_exceptions=True)
+        if self.disconnect_task is not None:
+            await asyncio.gather(self.disconnect_task, return_exceptions=True)
 
-        if self.active_subscriptions:
-            await asyncio.gather(
-                *self.active_subscriptions.values(),
-                return_exceptions=True
-            )
+        for channel in self.active_subscriptions:
+            await pubsub_hub.unsubscribe(channel, self.enqueue)
+        self.active_subscriptions.clear()
+
+
+def _is_typing_event(data) -> bool:
+    if not isinstance(data, str):
+        return False
+    try:
+        return serializer.loads(data).get("type") == "is_typing"
+    except json.JSONDecodeError:
+        return False
+
+
+def _frame_message_id(frame: str) -> Optional[str]:
+    start = frame.find(_FRAME_MESSAGE_ID_MARKER)
+    if start == -1:
+        return None
+    start += len(_FRAME_MESSAGE_ID_MARKER)
+    return frame[start:frame.index('"', start)]
+
+
+def _format_stream_id(position: Tuple[int, int]) -> str:
+    return f"{position[0]}-{position[1]}"
 
 
 async def authenticate_websocket(websocket: WebSocket) -> Optional[SessionData]:
     """Authenticate WebSocket connection using session cookie. """
     session_id = websocket.cookies.get("session_id")
-    session_data: SessionData = await redis_service.get_session(session_id)
+    session_data: SessionData = await session_store.get_session(session_id)
 
     if session_data is None:
         raise HTTPException(
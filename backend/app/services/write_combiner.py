@@ -0,0 +1,125 @@
+""" Combines chat message writes from many connections into pipelined Redis calls """
+import asyncio
+from typing import List, Optional, Set, Tuple
+
+from app.services.myredis import redis_service
+
+PendingMessage = Tuple[Tuple[str, str, str, str], asyncio.Future]
+
+
+class MessageWriteCombiner:
+    """ Singleton instance batching send_chat_message calls (opt-in).
+
+    Messages are held for at most max_delay seconds, or until max_batch are
+    pending, then flushed as a single Redis pipeline. Each caller awaits its own
+    future and gets back its own message id (or exception). When disabled, calls
+    go straight to redis_service.
+    """
+    _instance: Optional['MessageWriteCombiner'] = None
+    _enabled: bool = False
+    _max_delay: float = 0.0
+    _max_batch: int = 1
+    _pending: List[PendingMessage] = []
+    _flush_handle: Optional[asyncio.TimerHandle] = None
+    _flush_tasks: Set[asyncio.Task] = set()
+    _batches: int = 0
+    _messages: int = 0
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def init_combiner(self, write_combiner_config: dict) -> None:
+        """ Configures the combiner. (call on startup ONLY)
+
+        Args:
+            write_combiner_config (dict): Write combiner configuration provided by
+                service_configs.
+        """
+        self._enabled = write_combiner_config["enabled"]
+        self._max_delay = write_combiner_config["max_delay"]
+        self._max_batch = write_combiner_config["max_batch"]
+        self._pending = []
+        self._flush_tasks = set()
+
+    async def close(self) -> None:
+        """ Flushes anything still pending and waits for in-flight batches. """
+        self._flush()
+        await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    async def send_chat_message(
+            self,
+            chat_id: str,
+            sender_id: str,
+            sender_username: str,
+            message: str
+    ) -> str:
+        """ Sends a chat message, batched with other concurrent sends when enabled.
+
+        Args:
+            chat_id (str): Id of the chat to send to.
+            sender_id (str): Hex id of the sender.
+            sender_username (str): Username of the sender.
+            message (str): Message to send.
+
+        Returns:
+            str: Id of the message just sent.
+        """
+        if not self._enabled:
+            return await redis_service.send_chat_message(
+                chat_id, sender_id, sender_username, message)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((chat_id, sender_id, sender_username, message), future))
+
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._max_delay, self._flush)
+
+        return await future
+
+    def stats(self) -> dict:
+        """ Returns batch counters for metrics. """
+        return {
+            "enabled": self._enabled,
+            "pending": len(self._pending),
+            "batches": self._batches,
+            "messages": self._messages,
+            "avg_batch_size": self._messages / self._batches if self._batches else 0.0,
+        }
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._write_batch(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _write_batch(self, batch: List[PendingMessage]) -> None:
+        self._batches += 1
+        self._messages += len(batch)
+
+        try:
+            results = await redis_service.send_chat_messages([args for args, _ in batch])
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+write_combiner = MessageWriteCombiner()
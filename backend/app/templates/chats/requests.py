@@ -19,3 +19,23 @@ class NewChatData(BaseModel):
     chat_name: str
     other_users: List[UserInfo]
     is_public: bool
+
+
+class AddParticipantsData(BaseModel):
+    """ Data structure for users added to an existing chat.
+
+    Attributes:
+        users (List[UserInfo]): The user details and roles of the added users.
+    """
+    users: List[UserInfo] = Field(min_length=1)
+
+
+class WSSendMessageData(BaseModel):
+    """ Data structure for a chat message sent by a client over the WebSocket.
+
+    Attributes:
+        chat_id (str): Hex id of the chat to send to.
+        content (str): The text content of the message.
+    """
+    chat_id: str
+    content: str = Field(min_length=1)
@@ -1,6 +1,6 @@
 """ Templates for chats.py responses """
 from enum import Enum
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 
 class SelfUser(BaseModel):
@@ -71,16 +71,20 @@ class ChatPreview(BaseModel):
 
 
 class ChatDetails(BaseModel):
-    """ Complete chat information including all participants and message history.
+    """ Complete chat information including all participants and a page of message history.
 
     Attributes:
         chat_id (str): Unique identifier for the chat
-        participants (List[UserInfo]): List of all users in the chat with their roles and info
-        messages (List[ChatMessage]): Chronological list of messages in the chat (oldest first)
+        participants (Optional[List[UserInfo]]): List of all users in the chat with their
+            roles and info. Only included on the first page, None on later pages
+        messages (List[ChatMessage]): Page of messages in the chat (newest first)
+        next_cursor (Optional[str]): Cursor for the next page in the same direction, None
+            if there are no more messages
     """
     chat_id: str
-    participants: List[UserInfo]
+    participants: Optional[List[UserInfo]]
     messages: List[ChatMessage]
+    next_cursor: Optional[str] = None
 
 
 
@@ -115,7 +119,7 @@ class WSUserAddedData(BaseModel):
             if the notification is being sent to the chat creator/adder
         added_by (str): User ID of the person who added the user to the chat
     """
-    chat_preview: ChatPreview
+    chat_preview: Optional[ChatPreview]
     added_by: str
 
 
@@ -128,3 +132,28 @@ class WSUserRemovedData(BaseModel):
     """
     chat_id: str
     removed_by: str
+
+
+class WSCaughtUpData(BaseModel):
+    """Data payload sent once missed messages of a chat have been replayed.
+
+    Attributes:
+        chat_id (str): Unique identifier of the chat that was caught up
+        last_message_id (Optional[str]): Id of the newest message delivered, None
+            if nothing was delivered
+        complete (bool): False if the gap was too large to replay, the client
+            should refetch the chat history instead
+    """
+    chat_id: str
+    last_message_id: Optional[str]
+    complete: bool
+
+
+class WSResumeData(BaseModel):
+    """Data payload sent right before a slow connection is closed.
+
+    Attributes:
+        last_seen (Dict[str, str]): Id of the newest message delivered per chat, to
+            subscribe with after reconnecting
+    """
+    last_seen: Dict[str, str]
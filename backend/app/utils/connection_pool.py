@@ -0,0 +1,168 @@
+""" MySQL connection pool whose checkouts queue for a free connection """
+import asyncio
+import time
+from typing import Optional
+
+from mysql.connector.aio import MySQLConnectionPool
+from mysql.connector.aio.pooling import PooledMySQLConnection
+from mysql.connector.errors import PoolError
+
+from app.utils.statement_cache import StatementCache
+
+HEALTH_CHECK_QUERY = "SELECT 1"
+
+
+class CheckoutTimeoutError(PoolError):
+    """ Raised when every connection of a pool stayed busy for checkout_timeout. """
+
+
+class QueuedConnectionPool:
+    """ Connection pool of one MySQL server, with checkout queueing and health state.
+
+    The pool itself fails at once when it has no free connection, so checkouts
+    queue on a semaphore of pool_size slots for up to checkout_timeout seconds
+    instead. With reset_session the server frees the prepared statements of a
+    connection whenever it is returned, so they are dropped from the statement
+    cache; with it off the transaction a connection was left in is rolled back.
+    A pool that could not be opened is opened again by the next health check.
+
+    Attributes:
+        name (str): Pool name, also part of the statement cache keys.
+        host (str): Server host and port, for metrics.
+        healthy (bool): Whether the last checkout or health check reached the server.
+    """
+
+    def __init__(self, name: str, db_config: dict, pool_size: int, reset_session: bool,
+                 checkout_timeout: float, statements: StatementCache):
+        self.name = name
+        self.host = f"{db_config['host']}:{db_config.get('port', 3306)}"
+        self.healthy = True
+        self._db_config = db_config
+        self._pool_size = pool_size
+        self._reset_session = reset_session
+        self._checkout_timeout = checkout_timeout
+        self._statements = statements
+        self._checkout_slots = asyncio.Semaphore(pool_size)
+        self._pool: Optional[MySQLConnectionPool] = None
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._checkout_timeouts = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+
+    async def initialize(self) -> None:
+        """ Opens the connections of the pool.
+
+        Raises:
+            mysql.connector.Error: If the server could not be reached. The pool
+            is then closed again and marked unhealthy.
+        """
+        pool = MySQLConnectionPool(
+            pool_name=self.name,
+            pool_size=self._pool_size,
+            pool_reset_session=self._reset_session,
+            **self._db_config
+        )
+        try:
+            await pool.initialize_pool()
+        except Exception:
+            self.healthy = False
+            await pool.close_pool()
+            raise
+        self._pool = pool
+        self.healthy = True
+
+    async def close(self) -> None:
+        """ Closes the idle connections of the pool. """
+        if self._pool is not None:
+            await self._pool.close_pool()
+
+    async def acquire(self) -> PooledMySQLConnection:
+        """ Checks out a connection, waiting up to checkout_timeout for a free one.
+
+        Raises:
+            CheckoutTimeoutError: If no connection was free within checkout_timeout.
+            mysql.connector.Error: If the server could not be reached, which marks
+            the pool unhealthy.
+
+        Returns:
+            PooledMySQLConnection: The connection, hand it back with release.
+        """
+        started = time.perf_counter()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._checkout_slots.acquire(), self._checkout_timeout)
+        except asyncio.TimeoutError as e:
+            self._checkout_timeouts += 1
+            raise CheckoutTimeoutError(
+                f"No database connection free on {self.host} within "
+                f"{self._checkout_timeout}s") from e
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - started
+        self._checkouts += 1
+        self._wait_seconds += waited
+        self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+        try:
+            if self._pool is None:
+                raise PoolError(f"Database pool for {self.host} is not open")
+            conn = await self._pool.get_connection()
+        except Exception as e:
+            self._checkout_slots.release()
+            if not isinstance(e, PoolError):
+                self.healthy = False  # the connection could not be re-established
+            raise
+        self._in_use += 1
+        return conn
+
+    async def release(self, conn: PooledMySQLConnection) -> None:
+        """ Hands a connection acquired from this pool back. """
+        try:
+            if self._reset_session:
+                self._statements.forget(conn)
+            elif conn.in_transaction:
+                # reads open a transaction too, whose snapshot the next user would see
+                await conn.rollback()
+        finally:
+            try:
+                await conn.close()
+            finally:
+                self._in_use -= 1
+                self._checkout_slots.release()
+
+    async def check_health(self) -> bool:
+        """ Runs a trivial query to see whether the server is reachable, updating healthy. """
+        try:
+            if self._pool is None:
+                await self.initialize()
+            conn = await self.acquire()
+            try:
+                cursor = await self._statements.execute(conn, HEALTH_CHECK_QUERY)
+                await cursor.fetchall()
+            finally:
+                await self.release(conn)
+        except CheckoutTimeoutError:
+            pass  # every connection is busy, which says nothing about the server
+        except Exception:  # pylint: disable=broad-exception-caught
+            self.healthy = False
+        else:
+            self.healthy = True
+        return self.healthy
+
+    def stats(self) -> dict:
+        """ Returns pool usage and checkout wait times for metrics. """
+        return {
+            "host": self.host,
+            "healthy": self.healthy,
+            "pool_size": self._pool_size,
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "checkouts": self._checkouts,
+            "checkout_timeouts": self._checkout_timeouts,
+            "avg_wait_ms": round(self._wait_seconds / self._checkouts * 1000, 3)
+                if self._checkouts else 0.0,
+            "max_wait_ms": round(self._max_wait_seconds * 1000, 3),
+        }
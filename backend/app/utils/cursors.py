@@ -0,0 +1,70 @@
+""" Opaque pagination cursors handed to clients. """
+import base64
+import binascii
+import math
+import re
+from typing import Optional, Tuple
+
+from app.utils.stream_ids import is_stream_id, parse_stream_id
+
+_MESSAGE_ID_PATTERN = re.compile(r"^\d+-\d+$")
+_CHAT_ID_PATTERN = re.compile(r"^[0-9a-f]+$")
+
+
+def encode_cursor(message_id: str) -> str:
+    """ Wraps a message id in an opaque, URL safe cursor. """
+    return _encode(message_id)
+
+
+def decode_cursor(cursor: str) -> Optional[str]:
+    """ Unwraps a cursor made by encode_cursor.
+
+    Returns:
+        Optional[str]: The message id, or None if the cursor is malformed or
+        out of the range of stream ids.
+    """
+    message_id = _decode(cursor)
+    if not message_id or not _MESSAGE_ID_PATTERN.match(message_id) \
+            or not is_stream_id(message_id):
+        return None
+    ms, seq = parse_stream_id(message_id)
+    return f"{ms}-{seq}"
+
+
+def encode_chat_cursor(score: float, chat_id: str) -> str:
+    """ Wraps the activity score and id of the last chat of a page in an opaque cursor. """
+    return _encode(f"{score!r}:{chat_id}")
+
+
+def decode_chat_cursor(cursor: str) -> Optional[Tuple[float, str]]:
+    """ Unwraps a cursor made by encode_chat_cursor.
+
+    Returns:
+        Optional[Tuple[float, str]]: The (score, chat_id) pair, or None if the
+        cursor is malformed.
+    """
+    value = _decode(cursor)
+    if value is None or ":" not in value:
+        return None
+
+    score, chat_id = value.split(":", 1)
+    try:
+        parsed_score = float(score)
+    except ValueError:
+        return None
+
+    if not math.isfinite(parsed_score) or not _CHAT_ID_PATTERN.match(chat_id):
+        return None
+    return parsed_score, chat_id
+
+
+def _encode(value: str) -> str:
+    return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+def _decode(cursor: str) -> Optional[str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
@@ -0,0 +1,123 @@
+""" Wire formats of /ws/chats frames, picked per connection by subprotocol """
+from functools import lru_cache
+from typing import Any, Optional, Union
+
+import msgpack
+from pydantic import BaseModel
+
+from app.utils.serializer import serializer
+
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+# fields holding hex encoded 16 byte ids, sent as raw bytes over msgpack
+HEX_ID_FIELDS = frozenset({
+    "chat_id", "user_id", "sender_id", "dm_participant_id", "added_by", "removed_by",
+})
+# fields holding a mapping keyed by chat id
+CHAT_ID_KEYED_FIELDS = frozenset({"last_seen"})
+HEX_ID_LENGTH = 32
+
+# chat message frames are shared by every subscriber, so one transcode serves all
+# msgpack connections that receive the same frame
+TRANSCODE_CACHE_SIZE = 1024
+
+
+class JsonFrameCodec:
+    """ The default protocol, JSON text frames. """
+    binary = False
+
+    def encode(self, frame: Any) -> str:
+        """ Encodes a frame (a WebsocketMessage or plain data). """
+        return serializer.dumps(frame)
+
+    def encode_raw(self, frame: str) -> str:
+        """ Converts a pre-encoded JSON frame, which JSON clients take as-is. """
+        return frame
+
+    def decode(self, data: str) -> Any:
+        """ Decodes a client frame.
+
+        Raises:
+            ValueError: If data isn't valid JSON.
+        """
+        return serializer.loads(data)
+
+
+class MsgpackFrameCodec:
+    """ The msgpack subprotocol, binary frames with the WebsocketMessage schema.
+
+    Hex ids are sent and received as their raw 16 bytes, message ids and
+    everything else keep their JSON types.
+    """
+    binary = True
+
+    def encode(self, frame: Any) -> bytes:
+        """ Encodes a frame (a WebsocketMessage or plain data). """
+        if isinstance(frame, BaseModel):
+            frame = frame.model_dump(mode="json", by_alias=True)
+        return msgpack.packb(_ids_to_bytes(frame))
+
+    def encode_raw(self, frame: str) -> bytes:
+        """ Converts a pre-encoded JSON frame. """
+        return _transcode(frame)
+
+    def decode(self, data: bytes) -> Any:
+        """ Decodes a client frame.
+
+        Raises:
+            ValueError: If data isn't a single valid msgpack object.
+        """
+        return _ids_to_hex(msgpack.unpackb(data))
+
+
+FrameCodec = Union[JsonFrameCodec, MsgpackFrameCodec]
+
+
+def get_frame_codec(subprotocol: Optional[str] = None) -> FrameCodec:
+    """ Returns the codec of a negotiated subprotocol, JSON if there is none. """
+    if subprotocol == MSGPACK_SUBPROTOCOL:
+        return MsgpackFrameCodec()
+    return JsonFrameCodec()
+
+
+@lru_cache(maxsize=TRANSCODE_CACHE_SIZE)
+def _transcode(frame: str) -> bytes:
+    return msgpack.packb(_ids_to_bytes(serializer.loads(frame)))
+
+
+def _ids_to_bytes(value: Any, key: Optional[str] = None) -> Any:
+    if isinstance(value, dict):
+        if key in CHAT_ID_KEYED_FIELDS:
+            return {_hex_to_bytes(k): _ids_to_bytes(v) for k, v in value.items()}
+        return {k: _ids_to_bytes(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_ids_to_bytes(item) for item in value]
+    if key in HEX_ID_FIELDS and isinstance(value, str):
+        return _hex_to_bytes(value)
+    return value
+
+
+def _ids_to_hex(value: Any, key: Optional[str] = None) -> Any:
+    if isinstance(value, dict):
+        if key in CHAT_ID_KEYED_FIELDS:
+            return {_bytes_to_hex(k): _ids_to_hex(v) for k, v in value.items()}
+        return {k: _ids_to_hex(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_ids_to_hex(item) for item in value]
+    if key in HEX_ID_FIELDS:
+        return _bytes_to_hex(value)
+    return value
+
+
+def _hex_to_bytes(value: str) -> Union[str, bytes]:
+    # ids like sender_id "SERVER" aren't hex and stay strings
+    if len(value) != HEX_ID_LENGTH:
+        return value
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        return value
+
+
+def _bytes_to_hex(value: Any) -> Any:
+    return value.hex() if isinstance(value, bytes) else value
@@ -0,0 +1,57 @@
+""" Bounded FIFO of frames waiting to be written to one WebSocket client. """
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, List, Optional
+
+
+class OutboundQueue:
+    """ FIFO drained by a single writer task.
+
+    The bound is not enforced by put, the producer checks full() first so it
+    can decide what to evict (see WebSocketConnectionManager.enqueue).
+
+    Args:
+        max_size (int): Amount of items at which the queue counts as full.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: Deque[Any] = deque()
+        self._not_empty = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def full(self) -> bool:
+        """ Returns True if the queue holds max_size items or more. """
+        return len(self._items) >= self.max_size
+
+    def put(self, item: Any) -> None:
+        """ Appends an item, regardless of the bound. """
+        self._items.append(item)
+        self._not_empty.set()
+
+    async def get(self) -> Any:
+        """ Removes and returns the oldest item, waiting for one if empty. """
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._items.popleft()
+
+    def remove_first(self, predicate: Callable[[Any], bool]) -> Optional[Any]:
+        """ Removes and returns the oldest item matching predicate, if any. """
+        for index, item in enumerate(self._items):
+            if predicate(item):
+                del self._items[index]
+                return item
+        return None
+
+    def remove_all(self, predicate: Callable[[Any], bool]) -> List[Any]:
+        """ Removes and returns every item matching predicate, oldest first. """
+        removed = [item for item in self._items if predicate(item)]
+        if removed:
+            self._items = deque(item for item in self._items if not predicate(item))
+        return removed
@@ -0,0 +1,87 @@
+""" JSON encoding for REST responses, Pub/Sub payloads and WebSocket frames """
+import json
+from typing import Any, Optional, Union
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+SERIALIZER_BACKENDS = ("orjson", "json")
+
+
+def _default(obj: Any) -> Any:
+    """ Encodes objects neither backend handles natively. """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", by_alias=True)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class Serializer:
+    """ Singleton instance encoding and decoding JSON.
+
+    Uses orjson by default and falls back to the stdlib json module when orjson
+    isn't installed or JSON_SERIALIZER=json. Both backends produce compact
+    output, and encode Pydantic models without a model_dump first.
+    """
+    _instance: Optional['Serializer'] = None
+    backend: str = "orjson" if orjson is not None else "json"
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+
+    def init_serializer(self, serializer_config: dict) -> None:
+        """ Picks the JSON backend. (call on startup ONLY)
+
+        Args:
+            serializer_config (dict): Serializer configuration provided by service_configs.
+        """
+        backend = serializer_config["backend"]
+        if backend not in SERIALIZER_BACKENDS:
+            raise ValueError(
+                f"Unknown JSON_SERIALIZER {backend!r}, "
+                f"expected one of {', '.join(SERIALIZER_BACKENDS)}"
+            )
+
+        if backend == "orjson" and orjson is None:
+            print("orjson is not installed, falling back to the json module")
+            backend = "json"
+        self.backend = backend
+
+    def dumps(self, obj: Any) -> str:
+        """ Encodes obj as a JSON string. """
+        if self.backend == "orjson":
+            return orjson.dumps(obj, default=_default).decode()
+        return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False)
+
+    def dumpb(self, obj: Any) -> bytes:
+        """ Encodes obj as UTF-8 JSON bytes. """
+        if self.backend == "orjson":
+            return orjson.dumps(obj, default=_default)
+        return json.dumps(
+            obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        """ Decodes a JSON string or bytes.
+
+        Raises:
+            json.JSONDecodeError: If data isn't valid JSON (orjson raises a subclass).
+        """
+        if self.backend == "orjson":
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+serializer = Serializer()
+
+
+class SerializedJSONResponse(JSONResponse):
+    """ Default response class, renders content through the serializer. """
+
+    def render(self, content: Any) -> bytes:
+        return serializer.dumpb(content)
@@ -1,6 +1,6 @@
 """ Fetches service configurations from the .env file. """
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,8 +10,21 @@ class ConfigManager:
     """ Singleton configuration manager """
     _instance: Optional['ConfigManager'] = None
     _db_config: Optional[Dict[str, Any]] = None
+    _db_pool_config: Optional[Dict[str, Any]] = None
+    _db_replica_configs: Optional[List[Dict[str, Any]]] = None
     _sessions_redis_config: Optional[Dict[str, Any]] = None
     _streams_redis_config: Optional[Dict[str, Any]] = None
+    _pubsub_config: Optional[Dict[str, Any]] = None
+    _user_cache_config: Optional[Dict[str, Any]] = None
+    _password_pool_config: Optional[Dict[str, Any]] = None
+    _write_combiner_config: Optional[Dict[str, Any]] = None
+    _retention_config: Optional[Dict[str, Any]] = None
+    _websocket_config: Optional[Dict[str, Any]] = None
+    _serializer_config: Optional[Dict[str, Any]] = None
+    _stream_entry_config: Optional[Dict[str, Any]] = None
+    _session_config: Optional[Dict[str, Any]] = None
+    _membership_cache_config: Optional[Dict[str, Any]] = None
+    _participant_cache_config: Optional[Dict[str, Any]] = None
     _initialized: bool = False
 
     # List of required environment variables
@@ -46,6 +59,29 @@ class ConfigManager:
             'ssl_disabled': os.getenv('DB_SSL_DISABLED', "False").lower() == "true"
         }
 
+        # Load read replicas (comma separated host[:port], same credentials as the primary)
+        self._db_replica_configs = []
+        for replica_host in os.getenv('DB_REPLICA_HOSTS', "").split(","):
+            host, _, port = replica_host.strip().partition(":")
+            if host:
+                self._db_replica_configs.append(
+                    {**self._db_config, 'host': host, 'port': int(port or "3306")})
+
+        # Load database pool config, reset_session frees prepared statements on every
+        # return so they are only reused with it off. Chat members are inserted up to
+        # insert_chunk_size rows per statement. A user's reads stay on the primary for
+        # read_your_writes seconds after they wrote, longer than replication lags behind
+        self._db_pool_config = {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', "5")),
+            'reset_session': os.getenv('DB_POOL_RESET_SESSION', "False").lower() == "true",
+            'checkout_timeout': float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT_SECONDS', "5")),
+            'statement_cache_size': int(os.getenv('DB_STATEMENT_CACHE_SIZE', "64")),
+            'insert_chunk_size': max(1, int(os.getenv('DB_INSERT_CHUNK_SIZE', "500"))),
+            'replica_health_check_seconds': float(
+                os.getenv('DB_REPLICA_HEALTH_CHECK_SECONDS', "5")),
+            'read_your_writes_seconds': float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', "5")),
+        }
+
         # Validate and load Redis sessions config
         self._validate_env_vars(self.REQUIRED_REDIS_VARS, "Redis sessions")
         self._sessions_redis_config = {
@@ -62,6 +98,92 @@ class ConfigManager:
             'decode_responses': True,
         }
 
+        # Load Pub/Sub hub config
+        self._pubsub_config = {
+            'shards': max(1, int(os.getenv('PUBSUB_SHARDS', "1"))),
+        }
+
+        # Load user directory cache config
+        self._user_cache_config = {
+            'max_size': int(os.getenv('USER_CACHE_SIZE', "10000")),
+            'ttl': float(os.getenv('USER_CACHE_TTL_SECONDS', "300")),
+            'negative_ttl': float(os.getenv('USER_CACHE_NEGATIVE_TTL_SECONDS', "30")),
+        }
+
+        # Load chat membership cache config (ttl: in-process mirror, redis_ttl: shared set)
+        self._membership_cache_config = {
+            'max_size': int(os.getenv('MEMBERSHIP_CACHE_SIZE', "10000")),
+            'ttl': float(os.getenv('MEMBERSHIP_CACHE_TTL_SECONDS', "60")),
+            'redis_ttl': int(os.getenv('MEMBERSHIP_REDIS_TTL_SECONDS', "86400")),
+        }
+
+        # Load chat participant roster cache config
+        self._participant_cache_config = {
+            'max_size': int(os.getenv('PARTICIPANT_CACHE_SIZE', "1000")),
+            'ttl': float(os.getenv('PARTICIPANT_CACHE_TTL_SECONDS', "300")),
+        }
+
+        # Load password hashing pool config
+        self._password_pool_config = {
+            'workers': int(os.getenv('PASSWORD_POOL_WORKERS', str(min(4, os.cpu_count() or 1)))),
+            'max_pending': int(os.getenv('PASSWORD_POOL_MAX_PENDING', "64")),
+        }
+
+        # Load chat message write combiner config
+        self._write_combiner_config = {
+            'enabled': os.getenv('WRITE_COMBINER_ENABLED', "False").lower() == "true",
+            'max_delay': int(os.getenv('WRITE_COMBINER_MAX_DELAY_US', "300")) / 1_000_000,
+            'max_batch': int(os.getenv('WRITE_COMBINER_MAX_BATCH', "64")),
+        }
+
+        # Load stream retention / archiver config (0 disables a limit)
+        self._retention_config = {
+            'max_len': int(os.getenv('STREAM_RETENTION_MAX_LEN', "10000")) or None,
+            'max_age_seconds': int(os.getenv('STREAM_RETENTION_MAX_AGE_SECONDS', "0")) or None,
+            'interval_seconds': int(os.getenv('ARCHIVE_INTERVAL_SECONDS', "300")),
+            'batch_size': int(os.getenv('ARCHIVE_BATCH_SIZE', "500")),
+        }
+
+        # Load WebSocket outbound queue and presence config, a worker counts as gone
+        # once it missed its heartbeats for presence_ttl seconds
+        self._websocket_config = {
+            'outbound_queue_size': int(os.getenv('WS_OUTBOUND_QUEUE_SIZE', "256")),
+            'overflow_policy': os.getenv('WS_OVERFLOW_POLICY', "coalesce").lower(),
+            'presence_heartbeat_seconds': float(os.getenv('PRESENCE_HEARTBEAT_SECONDS', "10")),
+            'presence_ttl_seconds': float(os.getenv('PRESENCE_TTL_SECONDS', "30")),
+        }
+
+        # Load stream entry format config (1 keeps writing the legacy format)
+        self._stream_entry_config = {
+            'version': int(os.getenv('STREAM_ENTRY_VERSION', "2")),
+        }
+
+        # Load session config, token mode needs at least one signing secret
+        # (comma separated, the first one signs, any of them verifies)
+        self._session_config = {
+            'mode': os.getenv('SESSION_MODE', "redis").lower(),
+            'token_secrets': [
+                secret.strip().encode()
+                for secret in os.getenv('SESSION_TOKEN_SECRET', "").split(",")
+                if secret.strip()
+            ],
+            'revocation_refresh_seconds': float(
+                os.getenv('SESSION_REVOCATION_REFRESH_SECONDS', "60")),
+            'cache_size': int(os.getenv('SESSION_CACHE_SIZE', "10000")),
+            'cache_ttl': float(os.getenv('SESSION_CACHE_TTL_SECONDS', "30")),
+            'activity_flush_seconds': float(os.getenv('SESSION_ACTIVITY_FLUSH_SECONDS', "30")),
+        }
+        if self._session_config['mode'] == "token":
+            self._validate_env_vars(["SESSION_TOKEN_SECRET"], "Session token")
+            if not self._session_config['token_secrets']:
+                # e.g. "," passes the check above but holds no secret to sign with
+                raise EnvironmentError("SESSION_TOKEN_SECRET holds no non-empty secret")
+
+        # Load JSON serializer config
+        self._serializer_config = {
+            'backend': os.getenv('JSON_SERIALIZER', "orjson").lower(),
+        }
+
         self._initialized = True
 
     def _validate_env_vars(self, required_vars: list[str], service_name: str) -> None:
@@ -82,6 +204,18 @@ class ConfigManager:
             self.initialize()
         return self._db_config.copy()
 
+    def get_db_pool_config(self) -> Dict[str, Any]:
+        """ Get database pool configuration """
+        if not self._initialized:
+            self.initialize()
+        return self._db_pool_config.copy()
+
+    def get_db_replica_configs(self) -> List[Dict[str, Any]]:
+        """ Get database read replica configurations, empty without replicas """
+        if not self._initialized:
+            self.initialize()
+        return [replica_config.copy() for replica_config in self._db_replica_configs]
+
     def get_session_redis_config(self) -> Dict[str, Any]:
         """ Get Redis configuration """
         if not self._initialized:
@@ -94,5 +228,71 @@ class ConfigManager:
             self.initialize()
         return self._streams_redis_config.copy()
 
+    def get_pubsub_config(self) -> Dict[str, Any]:
+        """ Get Pub/Sub hub config """
+        if not self._initialized:
+            self.initialize()
+        return self._pubsub_config.copy()
+
+    def get_user_cache_config(self) -> Dict[str, Any]:
+        """ Get user directory cache config """
+        if not self._initialized:
+            self.initialize()
+        return self._user_cache_config.copy()
+
+    def get_membership_cache_config(self) -> Dict[str, Any]:
+        """ Get chat membership cache config """
+        if not self._initialized:
+            self.initialize()
+        return self._membership_cache_config.copy()
+
+    def get_participant_cache_config(self) -> Dict[str, Any]:
+        """ Get chat participant roster cache config """
+        if not self._initialized:
+            self.initialize()
+        return self._participant_cache_config.copy()
+
+    def get_password_pool_config(self) -> Dict[str, Any]:
+        """ Get password hashing pool config """
+        if not self._initialized:
+            self.initialize()
+        return self._password_pool_config.copy()
+
+    def get_write_combiner_config(self) -> Dict[str, Any]:
+        """ Get chat message write combiner config """
+        if not self._initialized:
+            self.initialize()
+        return self._write_combiner_config.copy()
+
+    def get_retention_config(self) -> Dict[str, Any]:
+        """ Get stream retention / archiver config """
+        if not self._initialized:
+            self.initialize()
+        return self._retention_config.copy()
+
+    def get_websocket_config(self) -> Dict[str, Any]:
+        """ Get WebSocket outbound queue config """
+        if not self._initialized:
+            self.initialize()
+        return self._websocket_config.copy()
+
+    def get_serializer_config(self) -> Dict[str, Any]:
+        """ Get JSON serializer config """
+        if not self._initialized:
+            self.initialize()
+        return self._serializer_config.copy()
+
+    def get_stream_entry_config(self) -> Dict[str, Any]:
+        """ Get stream entry format config """
+        if not self._initialized:
+            self.initialize()
+        return self._stream_entry_config.copy()
+
+    def get_session_config(self) -> Dict[str, Any]:
+        """ Get session mode config """
+        if not self._initialized:
+            self.initialize()
+        return self._session_config.copy()
+
 
 config_manager = ConfigManager()
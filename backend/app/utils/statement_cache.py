@@ -0,0 +1,78 @@
+""" Prepared statements kept open per pooled MySQL connection """
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+
+class StatementCache:
+    """ Keeps one prepared cursor per query and connection, so a statement is
+    prepared once per connection rather than on every call.
+
+    Connections are keyed by pool name and server connection id, which changes
+    on reconnect, so statements of a dropped connection are never reused. Beyond
+    max_size the least recently used statement of a connection is deallocated.
+    """
+
+    def __init__(self, max_size: int, max_connections: int):
+        self.max_size = max_size
+        self.max_connections = max_connections
+        self._connections: Dict[Tuple[str, int], OrderedDict] = {}
+        self._hits = 0
+        self._prepares = 0
+        self._evictions = 0
+
+    async def execute(self, conn: Any, query: str, params: tuple = ()) -> Any:
+        """ Executes query on conn through its cached prepared cursor.
+
+        Args:
+            conn: A pooled connection.
+            query (str): The query, the same string on every call for it to be reused.
+            params (tuple): The query parameters.
+
+        Returns:
+            The prepared cursor, holding the result. Don't close it.
+        """
+        statements = self._statements(conn)
+        entry = statements.get(query)
+        if entry is None:
+            entry = statements[query] = (query, await conn.cursor(prepared=True))
+            self._prepares += 1
+            if len(statements) > self.max_size:
+                _, (_, evicted) = statements.popitem(last=False)
+                self._evictions += 1
+                await evicted.close()
+        else:
+            statements.move_to_end(query)
+            self._hits += 1
+
+        # the cursor only skips preparing again for the query object it prepared
+        prepared_query, cursor = entry
+        try:
+            await cursor.execute(prepared_query, params)
+        except Exception:
+            statements.pop(query, None)
+            raise
+        return cursor
+
+    def forget(self, conn: Any) -> None:
+        """ Drops the statements of conn, after the server freed them (session reset). """
+        self._connections.pop((conn.pool_name, conn.connection_id), None)
+
+    def stats(self) -> dict:
+        """ Returns statement counts for metrics. """
+        return {
+            "connections": len(self._connections),
+            "statements": sum(len(statements) for statements in self._connections.values()),
+            "hits": self._hits,
+            "prepares": self._prepares,
+            "evictions": self._evictions,
+        }
+
+    def _statements(self, conn: Any) -> OrderedDict:
+        key = (conn.pool_name, conn.connection_id)
+        statements = self._connections.get(key)
+        if statements is None:
+            if len(self._connections) >= self.max_connections:
+                # a reconnected connection got a new id, its old statements are gone
+                del self._connections[next(iter(self._connections))]
+            statements = self._connections[key] = OrderedDict()
+        return statements
@@ -0,0 +1,37 @@
+""" Helpers for Redis stream ids ("<milliseconds>-<sequence>"), which double as message ids. """
+from typing import Tuple
+
+MAX_STREAM_MS = 2 ** 64 - 1
+MAX_STREAM_SEQ = 2 ** 64 - 1
+
+
+def parse_stream_id(stream_id: str, default_seq: int = 0) -> Tuple[int, int]:
+    """ Splits a stream id into its (milliseconds, sequence) parts.
+
+    Args:
+        stream_id (str): Stream id, either "ms-seq" or just "ms".
+        default_seq (int): Sequence used when stream_id has none.
+    """
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq) if seq else default_seq
+
+
+def is_stream_id(value) -> bool:
+    """ Checks that value parses as a stream id whose parts Redis accepts. """
+    try:
+        ms, seq = parse_stream_id(value)
+    except (AttributeError, ValueError):
+        return False
+    return 0 <= ms <= MAX_STREAM_MS and 0 <= seq <= MAX_STREAM_SEQ
+
+
+def next_stream_id(stream_id: str) -> str:
+    """ Returns the smallest stream id greater than stream_id. """
+    ms, seq = parse_stream_id(stream_id)
+    return f"{ms + 1}-0" if seq == MAX_STREAM_SEQ else f"{ms}-{seq + 1}"
+
+
+def previous_stream_id(stream_id: str) -> str:
+    """ Returns the largest stream id smaller than stream_id. """
+    ms, seq = parse_stream_id(stream_id)
+    return f"{ms - 1}-{MAX_STREAM_SEQ}" if seq == 0 else f"{ms}-{seq - 1}"
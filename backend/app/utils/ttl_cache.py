@@ -0,0 +1,84 @@
+""" Small in-process cache with LRU eviction and per-entry expiry. """
+from collections import OrderedDict
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """ Bounded LRU cache whose entries expire after a fixed time to live.
+
+    None is a valid value, which lets callers cache negative results. Those can be
+    given a shorter lifetime with negative_ttl so newly created entities show up quickly.
+
+    Attributes:
+        max_size (int): Maximum amount of entries before the least recently used is evicted.
+        ttl (float): Seconds an entry stays valid for.
+        negative_ttl (Optional[float]): Seconds a None entry stays valid for. Defaults to ttl.
+        hits (int): Amount of lookups that found a valid entry.
+        misses (int): Amount of lookups that found nothing or an expired entry.
+        evictions (int): Amount of entries dropped to stay within max_size.
+    """
+
+    def __init__(self, max_size: int, ttl: float, negative_ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ Gets the value for a key, or default if it is missing or expired. """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """ Stores a value, evicting the least recently used entries if full.
+
+        Args:
+            key (Hashable): Cache key.
+            value (Any): Value to store. None is stored with negative_ttl.
+            ttl (Optional[float]): Overrides the lifetime of this entry.
+        """
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """ Removes a key, returning its value (even if expired) or default. """
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else default
+
+    def clear(self) -> None:
+        """ Removes every entry. Counters are kept. """
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """ Returns size and hit/miss counters for metrics. """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,134 @@
+""" Micro-benchmark of JSON encoding for large chat payloads.
+
+Compares how responses and frames were encoded before the serializer layer
+(FastAPI's JSONResponse / stdlib json on model_dump output) against the
+serializer with each of its backends.
+
+Run from the backend directory:
+    python -m benchmarks.serialization_bench [--iterations N]
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.templates.chats.responses import (ChatDetails, ChatMessage, ChatPreview, UserInfo,
+                                           UserRole)
+from app.utils.serializer import SERIALIZER_BACKENDS, serializer
+
+
+def make_message(index: int) -> ChatMessage:
+    """ Builds a chat message with a realistic content length. """
+    sent_at = datetime(2025, 1, 1) + timedelta(seconds=index)
+    return ChatMessage(
+        message_id=f"{int(sent_at.timestamp() * 1000)}-{index % 3}",
+        sender_id=f"{index % 20:032x}",
+        sender_username=f"user_{index % 20}",
+        content=f"Message number {index}, with a little unicode: héllo wörld ✓ " * 2,
+        timestamp=sent_at.isoformat(),
+    )
+
+
+def make_chat_details(message_count: int, participant_count: int) -> ChatDetails:
+    """ Builds a first page of chat details. """
+    return ChatDetails(
+        chat_id="ab" * 16,
+        participants=[
+            UserInfo(user_id=f"{i:032x}", username=f"user_{i}", role=UserRole.MEMBER)
+            for i in range(participant_count)
+        ],
+        messages=[make_message(i) for i in range(message_count)],
+        next_cursor="MTczNTY4OTYwMDAwMC0w",
+    )
+
+
+def make_chat_previews(chat_count: int) -> list:
+    """ Builds the chat list of a user in many chats. """
+    return [
+        ChatPreview(
+            chat_id=f"{i:032x}",
+            chat_name=f"Chat {i}",
+            created_at=datetime(2024, 1, 1).isoformat(),
+            dm_participant_id=None,
+            last_message=make_message(i),
+            my_role=UserRole.MEMBER,
+        )
+        for i in range(chat_count)
+    ]
+
+
+def bench(label: str, func, iterations: int, baseline: Optional[float] = None) -> float:
+    """ Runs func and prints the best mean time per call, and the speedup over baseline. """
+    seconds = min(timeit.repeat(func, number=iterations, repeat=5)) / iterations
+    speedup = f"{baseline / seconds:>7.2f}x" if baseline is not None else ""
+    print(f"  {label:<40} {seconds * 1_000_000:>10.1f} us {speedup}")
+    return seconds
+
+
+def main():
+    """ Runs the benchmark. """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--participants", type=int, default=50)
+    parser.add_argument("--chats", type=int, default=200)
+    args = parser.parse_args()
+
+    details = make_chat_details(args.messages, args.participants)
+    previews = make_chat_previews(args.chats)
+
+    print(f"ChatDetails ({args.messages} messages, {args.participants} participants)")
+    # response_model endpoints: FastAPI dumps in json mode, JSONResponse renders
+    baseline = bench(
+        "JSONResponse(model_dump(mode='json'))",
+        lambda: JSONResponse(details.model_dump(mode="json")).body,
+        args.iterations,
+    )
+    for backend in SERIALIZER_BACKENDS:
+        serializer.backend = backend
+        bench(
+            f"serializer[{backend}]",
+            lambda: serializer.dumpb(details.model_dump(mode="json")),
+            args.iterations,
+            baseline,
+        )
+
+    print(f"List[ChatPreview] ({args.chats} chats)")
+    # endpoints without a response model go through jsonable_encoder first
+    baseline = bench(
+        "JSONResponse(jsonable_encoder(...))",
+        lambda: JSONResponse(jsonable_encoder(previews)).body,
+        args.iterations,
+    )
+    for backend in SERIALIZER_BACKENDS:
+        serializer.backend = backend
+        bench(
+            f"serializer[{backend}]",
+            lambda: serializer.dumpb(previews),
+            args.iterations,
+            baseline,
+        )
+
+    print("WebSocket frame (one ChatPreview notification)")
+    frame = {"type": "added_to_chat", "chat_preview": previews[0], "added_by": "ab" * 16}
+    baseline = bench(
+        "json.dumps(model_dump())",
+        lambda: json.dumps({**frame, "chat_preview": previews[0].model_dump()}),
+        args.iterations * 10,
+    )
+    for backend in SERIALIZER_BACKENDS:
+        serializer.backend = backend
+        bench(
+            f"serializer[{backend}]",
+            lambda: serializer.dumps(frame),
+            args.iterations * 10,
+            baseline,
+        )
+
+
+if __name__ == "__main__":
+    main()
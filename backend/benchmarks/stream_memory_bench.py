@@ -0,0 +1,96 @@
+""" Memory benchmark of the stream entry formats.
+
+Writes the same messages into one stream per entry format, with the fields the
+send script writes, then reports MEMORY USAGE per message. The entries are added
+with plain XADDs rather than the send script, so nothing is published and
+chat:last is left alone. Needs a Valkey server (by default the streams one from
+docker-compose.yml, or STREAMS_REDIS_HOST / STREAMS_REDIS_PORT). The streams are
+written to a logical database other than the one the backend uses (--db, 15 by
+default) and deleted again afterwards.
+
+Run from the backend directory:
+    python -m benchmarks.stream_memory_bench [--messages N] [--db N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime
+
+from redis.asyncio import Redis
+
+ENTRY_VERSIONS = (1, 2)
+BATCH_SIZE = 500
+# logical database of the backend's streams, which the benchmark must not write to
+BACKEND_DB = 0
+
+
+def make_messages(count: int, senders: int, seed: int = 0) -> list:
+    """ Builds (sender_id, content) pairs with chat-like content lengths. """
+    rng = random.Random(seed)
+    sender_ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(senders)]
+    words = ["hey", "ok", "see", "you", "tomorrow", "lol", "sure", "meeting", "at", "the",
+             "office", "thanks", "sounds", "good", "what", "about", "lunch", "?"]
+    return [
+        (rng.choice(sender_ids), " ".join(rng.choices(words, k=rng.randint(1, 12))))
+        for _ in range(count)
+    ]
+
+
+def entry_fields(version: int, sender_id: str, content: str) -> dict:
+    """ Builds the fields SEND_MESSAGE_SCRIPT stores for a message in a format. """
+    if version == 2:
+        return {"v": "2", "s": bytes.fromhex(sender_id), "c": content}
+    return {"sender_id": sender_id, "content": content,
+            "timestamp": datetime.now().isoformat()}
+
+
+async def measure(client: Redis, stream_key: str, version: int, messages: list) -> int:
+    """ Writes messages to a fresh stream and returns its MEMORY USAGE in bytes. """
+    await client.delete(stream_key)
+
+    for start in range(0, len(messages), BATCH_SIZE):
+        async with client.pipeline(transaction=False) as pipe:
+            for sender_id, content in messages[start:start + BATCH_SIZE]:
+                pipe.xadd(stream_key, entry_fields(version, sender_id, content))
+            await pipe.execute()
+
+    # SAMPLES 0 walks every node of the stream instead of estimating
+    return await client.memory_usage(stream_key, samples=0)
+
+
+async def main():
+    """ Runs the benchmark. """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--senders", type=int, default=20)
+    parser.add_argument("--host", default=os.getenv("STREAMS_REDIS_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("STREAMS_REDIS_PORT", "6380")))
+    parser.add_argument("--db", type=int, default=15,
+                        help="logical database to write to, not the backend's")
+    args = parser.parse_args()
+    if args.db == BACKEND_DB:
+        parser.error(f"--db {BACKEND_DB} holds the backend's chat streams, pick another")
+
+    client = Redis(host=args.host, port=args.port, db=args.db)
+
+    messages = make_messages(args.messages, args.senders)
+    print(f"{args.messages} messages from {args.senders} senders")
+
+    stream_keys = [f"bench:{uuid.uuid4().hex}" for _ in ENTRY_VERSIONS]
+    try:
+        baseline = None
+        for version, stream_key in zip(ENTRY_VERSIONS, stream_keys):
+            used = await measure(client, stream_key, version, messages)
+            per_message = used / args.messages
+            saved = f"{1 - per_message / baseline:>7.1%} smaller" if baseline else ""
+            print(f"  v{version}: {used:>10} bytes  {per_message:>7.1f} bytes/message {saved}")
+            baseline = baseline or per_message
+    finally:
+        await client.delete(*stream_keys)
+        await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,15 @@
+-- Indexes for the queries in app/services/mysqldb.py, checked with
+-- python -m migrations.explain_queries
+
+-- The primary key (user_id, chat_id) already serves lookups by user, and holds
+-- role too. Participants of a chat are read by chat_id: (chat_id, role) plus the
+-- user_id every secondary index carries covers them without touching the rows.
+ALTER TABLE `users_in_chats`
+  DROP INDEX `idx_users_in_chats_user`,
+  ADD INDEX `idx_users_in_chats_chat` (`chat_id`, `role`);
+
+-- DMs of a user are found through the ordered pair: the dm_chat unique key for
+-- the DMs where they are the lower id, this one where they are the higher id.
+-- Both carry chat_id, so neither lookup reads the rows.
+ALTER TABLE `dm_chats`
+  ADD INDEX `idx_dm_chats_higher` (`higher_user_id`, `lower_user_id`);
@@ -0,0 +1,12 @@
+-- Chat messages moved out of the Redis streams by the archiver. Databases created
+-- from the README after the archiver was added have the table already.
+CREATE TABLE IF NOT EXISTS `messages` (
+  `chat_id` BINARY(16) NOT NULL,
+  `id_ms` BIGINT UNSIGNED NOT NULL,
+  `id_seq` BIGINT UNSIGNED NOT NULL,
+  `sender_id` BINARY(16) NULL,
+  `content` TEXT NOT NULL,
+  `sent_at` DATETIME(6) NOT NULL,
+  PRIMARY KEY (`chat_id`, `id_ms`, `id_seq`),
+  FOREIGN KEY (`chat_id`) REFERENCES `chats` (`chat_id`) ON DELETE CASCADE
+);
@@ -0,0 +1,194 @@
+""" Checks the query plans of the DatabaseService queries against the migrated schema.
+
+Runs EXPLAIN on every read query and fails if one of them scans a whole table,
+or reads the rows of a table its index is meant to cover. Works with MySQL 8 and
+MariaDB. The optimizer may prefer a scan of tables with only a handful of rows,
+so the plans only mean something against representative data.
+
+With --scratch the checks need nothing but a server and a user allowed to create
+databases, which suits CI: a throwaway database is created next to the configured
+one, migrated, filled with generated users, chats, DMs and messages, checked and
+dropped again. Without it they run against the configured database as it is, e.g.
+a staging copy, after python -m migrations.migrate.
+
+Uses the database settings of the backend .env. Run from the backend directory:
+    python -m migrations.explain_queries [--scratch]
+"""
+import argparse
+import asyncio
+import sys
+import uuid
+from typing import FrozenSet, List, NamedTuple
+
+from mysql.connector.aio import connect
+
+from app.services import mysqldb
+from app.utils.service_configs import config_manager
+from app.utils.stream_ids import MAX_STREAM_SEQ
+from migrations.migrate import find_migrations, split_statements
+
+# sample ids, which --scratch gives to a generated user, their DM partner and a chat
+USER_ID = (1).to_bytes(16, "big")
+OTHER_USER_ID = (1001).to_bytes(16, "big")
+CHAT_ID = ((1 << 64) + 1).to_bytes(16, "big")
+
+SCRATCH_USERS = 2000
+SCRATCH_MEMBERS_PER_CHAT = 5
+# 0 to 9999, cross joined digits rather than a recursive CTE, whose depth is capped
+_NUMBERS = """
+    (SELECT a.d + 10 * b.d + 100 * c.d + 1000 * e.d AS n
+     FROM (SELECT 0 d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+           UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+           UNION ALL SELECT 8 UNION ALL SELECT 9) a,
+          (SELECT 0 d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+           UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+           UNION ALL SELECT 8 UNION ALL SELECT 9) b,
+          (SELECT 0 d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+           UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+           UNION ALL SELECT 8 UNION ALL SELECT 9) c,
+          (SELECT 0 d UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+           UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7
+           UNION ALL SELECT 8 UNION ALL SELECT 9) e) numbers
+"""
+# user n has id n, group chat n id 2^64 + n and the DM of users n and n + 1000 id 2^65 + n
+_USER_ID_SQL = "UNHEX(LPAD(HEX({n}), 32, '0'))"
+_GROUP_ID_SQL = "UNHEX(CONCAT('0000000000000001', LPAD(HEX({n}), 16, '0')))"
+_DM_ID_SQL = "UNHEX(CONCAT('0000000000000002', LPAD(HEX({n}), 16, '0')))"
+SCRATCH_DATA_STATEMENTS = [
+    f"""INSERT INTO users (user_id, user_name, pass_hash)
+        SELECT {_USER_ID_SQL.format(n="n")}, CONCAT('user', n), 'x'
+        FROM {_NUMBERS} WHERE n BETWEEN 1 AND {SCRATCH_USERS}""",
+    f"""INSERT INTO chats (chat_id, chat_name, created_by, is_public)
+        SELECT {_GROUP_ID_SQL.format(n="n")}, CONCAT('chat', n),
+               {_USER_ID_SQL.format(n="n")}, n % 10 = 0
+        FROM {_NUMBERS} WHERE n BETWEEN 1 AND {SCRATCH_USERS}""",
+    f"""INSERT INTO users_in_chats (user_id, chat_id, role)
+        SELECT {_USER_ID_SQL.format(n=f"(n + k * 37) % {SCRATCH_USERS} + 1")},
+               {_GROUP_ID_SQL.format(n="n")}, IF(k = 0, 'owner', 'member')
+        FROM {_NUMBERS},
+             (SELECT 0 k UNION ALL SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3
+              UNION ALL SELECT 4) members
+        WHERE n BETWEEN 1 AND {SCRATCH_USERS} AND k < {SCRATCH_MEMBERS_PER_CHAT}""",
+    f"""INSERT INTO chats (chat_id, chat_name, is_public)
+        SELECT {_DM_ID_SQL.format(n="n")}, '', FALSE
+        FROM {_NUMBERS} WHERE n BETWEEN 1 AND {SCRATCH_USERS // 2}""",
+    f"""INSERT INTO dm_chats (chat_id, user1_id, user2_id)
+        SELECT {_DM_ID_SQL.format(n="n")}, {_USER_ID_SQL.format(n=f"n + {SCRATCH_USERS // 2}")},
+               {_USER_ID_SQL.format(n="n")}
+        FROM {_NUMBERS} WHERE n BETWEEN 1 AND {SCRATCH_USERS // 2}""",
+    f"""INSERT INTO messages (chat_id, id_ms, id_seq, sender_id, content, sent_at)
+        SELECT {_GROUP_ID_SQL.format(n=f"n % {SCRATCH_USERS} + 1")}, 1700000000000 + n, 0,
+               {_USER_ID_SQL.format(n=f"n % {SCRATCH_USERS} + 1")}, 'hello', NOW(6)
+        FROM {_NUMBERS}""",
+    "ANALYZE TABLE users, chats, users_in_chats, dm_chats, messages",
+]
+
+
+class PlanCheck(NamedTuple):
+    """ A query with sample parameters, and the tables it must read from an index only. """
+    name: str
+    query: str
+    params: tuple
+    covered: FrozenSet[str] = frozenset()
+
+
+PLAN_CHECKS = [
+    PlanCheck("user chats", mysqldb.GET_ALL_USER_CHATS_QUERY, (USER_ID,) * 3,
+              frozenset({"dm"})),
+    PlanCheck("user chats page", mysqldb.GET_USER_CHATS_QUERY.format(
+        group_filter=" AND uic.chat_id IN (?)", dm_filter=" AND dm.chat_id IN (?)"),
+              (USER_ID, CHAT_ID) * 3, frozenset({"dm"})),
+    PlanCheck("user chat ids", mysqldb.GET_USER_CHAT_IDS_QUERY, (USER_ID,) * 3,
+              frozenset({"dm_chats"})),
+    PlanCheck("dm by user pair", mysqldb.GET_DM_CHAT_ID_QUERY, (USER_ID, OTHER_USER_ID),
+              frozenset({"dm_chats"})),
+    PlanCheck("chat membership", mysqldb.GET_CHAT_MEMBERSHIP_QUERY, (CHAT_ID, USER_ID)),
+    PlanCheck("user in chat", mysqldb.CHECK_USER_IN_CHAT_QUERY, (USER_ID, CHAT_ID)),
+    PlanCheck("is dm", mysqldb.GET_IS_DM_QUERY, (CHAT_ID,)),
+    PlanCheck("dm participants", mysqldb.GET_DM_PARTICIPANTS_QUERY, (CHAT_ID,) * 2),
+    PlanCheck("group participants", mysqldb.GET_GROUP_PARTICIPANTS_QUERY, (CHAT_ID,),
+              frozenset({"uic"})),
+    PlanCheck("user id by name", mysqldb.GET_USER_ID_QUERY, ("username",),
+              frozenset({"users"})),
+    PlanCheck("username by id", mysqldb.GET_USERNAME_QUERY, (USER_ID,)),
+    PlanCheck("password hash", mysqldb.GET_PASS_HASH_QUERY, ("username",)),
+    PlanCheck("archived messages", mysqldb.ARCHIVED_MESSAGES_QUERIES[False],
+              (CHAT_ID, MAX_STREAM_SEQ, MAX_STREAM_SEQ, MAX_STREAM_SEQ, 0, 0, 0, 15)),
+]
+
+
+def find_problems(check: PlanCheck, plan: List[dict]) -> List[str]:
+    """ Lists what is wrong with the plan of a check, empty if nothing. """
+    problems = []
+    for row in plan:
+        table = row.get("table")
+        if table is None or table.startswith("<"):
+            continue  # union results and derived tables are built in memory
+        if row.get("type") == "ALL":
+            problems.append(f"full scan of {table}")
+        elif table in check.covered and "Using index" not in (row.get("Extra") or ""):
+            problems.append(f"{table} read beyond its index (key {row.get('key')})")
+    return problems
+
+
+async def create_scratch_database(cnx, name: str) -> None:
+    """ Creates, migrates and fills the throwaway database of --scratch, and uses it. """
+    cursor = await cnx.cursor()
+    await cursor.execute(f"CREATE DATABASE `{name}`")
+    await cursor.execute(f"USE `{name}`")
+    for _, _, path in find_migrations():
+        for statement in split_statements(path.read_text()):
+            await cursor.execute(statement)
+    for statement in SCRATCH_DATA_STATEMENTS:
+        await cursor.execute(statement)
+        if cursor.with_rows:
+            await cursor.fetchall()
+    await cnx.commit()
+    await cursor.close()
+
+
+async def main():
+    """ Runs the plan checks, exiting with status 1 if any fails. """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scratch", action="store_true",
+                        help="check against a generated, throwaway database")
+    args = parser.parse_args()
+
+    db_config = {**config_manager.get_db_config(), "raise_on_warnings": False}
+    scratch_name = None
+    if args.scratch:
+        scratch_name = f"{db_config.pop('database')}_plan_check_{uuid.uuid4().hex[:8]}"
+    cnx = await connect(**db_config)
+    failed = 0
+    try:
+        if scratch_name is not None:
+            await create_scratch_database(cnx, scratch_name)
+        cursor = await cnx.cursor(prepared=True)
+        for check in PLAN_CHECKS:
+            await cursor.execute(f"EXPLAIN {check.query}", check.params)
+            columns = [column[0] for column in cursor.description]
+            plan = [dict(zip(columns, row)) for row in await cursor.fetchall()]
+
+            problems = find_problems(check, plan)
+            failed += bool(problems)
+            print(f"{'FAIL' if problems else 'ok':<5} {check.name}")
+            for row in plan:
+                print(f"        {row.get('table')}: type={row.get('type')} "
+                      f"key={row.get('key')} extra={row.get('Extra')}")
+            for problem in problems:
+                print(f"      ! {problem}")
+        await cursor.close()
+    finally:
+        if scratch_name is not None:
+            cursor = await cnx.cursor()
+            await cursor.execute(f"DROP DATABASE IF EXISTS `{scratch_name}`")
+            await cursor.close()
+        await cnx.close()
+
+    if failed:
+        print(f"{failed} of {len(PLAN_CHECKS)} queries have regressed plans")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
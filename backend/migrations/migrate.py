@@ -0,0 +1,98 @@
+""" Applies the numbered SQL migrations in this directory to the database.
+
+Each NNNN_name.sql file is applied once, in order, and recorded in the
+schema_migrations table. MySQL commits DDL statements implicitly, so a migration
+that fails halfway is not rolled back; fix the database and run it again.
+Databases created before migrations existed are marked as up to date with
+--baseline instead of being migrated.
+
+Uses the database settings of the backend .env. Run from the backend directory:
+    python -m migrations.migrate [--baseline VERSION] [--dry-run]
+"""
+import argparse
+import asyncio
+import re
+from pathlib import Path
+from typing import List, Set, Tuple
+
+from mysql.connector.aio import connect
+
+from app.utils.service_configs import config_manager
+
+MIGRATIONS_DIR = Path(__file__).parent
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+CREATE_MIGRATIONS_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` INT PRIMARY KEY,
+  `name` VARCHAR(255) NOT NULL,
+  `applied_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+GET_APPLIED_VERSIONS_QUERY = "SELECT version FROM schema_migrations"
+RECORD_MIGRATION_QUERY = "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)"
+
+
+def find_migrations() -> List[Tuple[int, str, Path]]:
+    """ Lists the (version, name, path) of every migration file, in order. """
+    migrations = []
+    for path in MIGRATIONS_DIR.iterdir():
+        match = MIGRATION_FILE_PATTERN.match(path.name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), path))
+    return sorted(migrations)
+
+
+def split_statements(sql: str) -> List[str]:
+    """ Splits a migration file into statements, dropping comment lines. """
+    lines = [line for line in sql.splitlines() if not line.lstrip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+async def get_applied_versions(cursor) -> Set[int]:
+    """ Gets the versions recorded in schema_migrations, creating it if needed. """
+    await cursor.execute(CREATE_MIGRATIONS_TABLE_QUERY)
+    await cursor.execute(GET_APPLIED_VERSIONS_QUERY)
+    return {row[0] for row in await cursor.fetchall()}
+
+
+async def main():
+    """ Applies pending migrations. """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", type=int, default=None,
+                        help="record migrations up to this version as applied, "
+                             "without running them")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print pending migrations without applying them")
+    args = parser.parse_args()
+
+    # "already exists" notes of IF NOT EXISTS statements aren't errors here
+    db_config = {**config_manager.get_db_config(), "raise_on_warnings": False}
+    cnx = await connect(**db_config)
+    try:
+        cursor = await cnx.cursor()
+        applied = await get_applied_versions(cursor)
+
+        for version, name, path in find_migrations():
+            if version in applied:
+                continue
+
+            baseline = args.baseline is not None and version <= args.baseline
+            action = "recording as applied (baseline)" if baseline else "applying"
+            print(f"  {version:04d} {name}: {action}{' (dry run)' if args.dry_run else ''}")
+            if args.dry_run:
+                continue
+
+            if not baseline:
+                for statement in split_statements(path.read_text()):
+                    await cursor.execute(statement)
+            await cursor.execute(RECORD_MIGRATION_QUERY, (version, name))
+            await cnx.commit()
+
+        await cursor.close()
+    finally:
+        await cnx.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
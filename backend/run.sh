@@ -1,4 +1,9 @@
 #!/bin/bash
+# Usage: ./run.sh [--prod [WORKERS]]
+#   default: one auto-reloading worker for development
+#   --prod:  WORKERS worker processes (defaults to the CPU count), without reload.
+#            Workers share nothing in-process, they coordinate through Valkey,
+#            which must already be running, it is not started or restarted.
 
 if [[ $EUID -ne 0 ]]; then
    echo "${RED}This script must be run as root or with sudo${NC}."
@@ -14,6 +19,16 @@ GREEN='\033[0;32m'
 YELLOW='\033[1;33m'
 NC='\033[0m' # No Color
 
+MODE="dev"
+WORKERS=1
+if [[ "$1" == "--prod" ]]; then
+  MODE="prod"
+  WORKERS="${2:-$(nproc)}"
+elif [[ -n "$1" ]]; then
+  echo -e "${RED}Unknown option $1, usage: ./run.sh [--prod [WORKERS]]${NC}"
+  exit 1
+fi
+
 # Function to check command success
 check_success() {
   if [ $? -eq 0 ]; then
@@ -44,55 +59,71 @@ else
   echo -e "${GREEN}Dependencies already up to date${NC}"
 fi
 
-# Check if docker-compose.yml exists
-if [ ! -f docker-compose.yml ]; then
-  echo -e "${RED}docker-compose.yml not found in current directory${NC}"
-  exit 1
-fi
-
-# Start Valkey services using docker-compose
-echo -e "${YELLOW}Starting Valkey services with Docker Compose...${NC}"
-
-# Check if services are already running
-if docker-compose ps --services --filter "status=running" | grep -q -E "(valkey-sessions|valkey-streams)"; then
-  echo -e "${YELLOW}Valkey services already running, restarting...${NC}"
-  docker-compose down
-  check_success "Stopped existing Valkey services"
-fi
-
-# Start the services
-docker-compose up -d
-check_success "Valkey services started"
-
-# Wait for Valkey services to be ready
-echo -e "${YELLOW}Waiting for Valkey services to become responsive...${NC}"
-
-# Check valkey-sessions
-for i in {1..10}; do
-  if docker-compose exec -T valkey-sessions redis-cli ping 2>/dev/null | grep -q "PONG"; then
-    echo -e "${GREEN}valkey-sessions is ready!${NC}"
-    break
-  fi
-  sleep 1
-  if [ $i -eq 10 ]; then
-    echo -e "${RED}valkey-sessions failed to start within 10 seconds${NC}"
+# Valkey runs from docker-compose.yml in development only. In prod mode the data
+# services are left alone, as restarting them would cut off every running worker
+if [[ "$MODE" == "prod" ]]; then
+  echo -e "${YELLOW}Prod mode, leaving Valkey services as they are${NC}"
+else
+  # Check if docker-compose.yml exists
+  if [ ! -f docker-compose.yml ]; then
+    echo -e "${RED}docker-compose.yml not found in current directory${NC}"
     exit 1
   fi
-done
 
-# Check valkey-streams
-for i in {1..10}; do
-  if docker-compose exec -T valkey-streams redis-cli ping 2>/dev/null | grep -q "PONG"; then
-    echo -e "${GREEN}valkey-streams is ready!${NC}"
-    break
-  fi
-  sleep 1
-  if [ $i -eq 10 ]; then
-    echo -e "${RED}valkey-streams failed to start within 10 seconds${NC}"
-    exit 1
+  # Start Valkey services using docker-compose
+  echo -e "${YELLOW}Starting Valkey services with Docker Compose...${NC}"
+
+  # Check if services are already running
+  if docker-compose ps --services --filter "status=running" | grep -q -E "(valkey-sessions|valkey-streams)"; then
+    echo -e "${YELLOW}Valkey services already running, restarting...${NC}"
+    docker-compose down
+    check_success "Stopped existing Valkey services"
   fi
-done
 
+  # Start the services
+  docker-compose up -d
+  check_success "Valkey services started"
+
+  # Wait for Valkey services to be ready
+  echo -e "${YELLOW}Waiting for Valkey services to become responsive...${NC}"
+
+  # Check valkey-sessions
+  for i in {1..10}; do
+    if docker-compose exec -T valkey-sessions redis-cli ping 2>/dev/null | grep -q "PONG"; then
+      echo -e "${GREEN}valkey-sessions is ready!${NC}"
+      break
+    fi
+    sleep 1
+    if [ $i -eq 10 ]; then
+      echo -e "${RED}valkey-sessions failed to start within 10 seconds${NC}"
+      exit 1
+    fi
+  done
+
+  # Check valkey-streams
+  for i in {1..10}; do
+    if docker-compose exec -T valkey-streams redis-cli ping 2>/dev/null | grep -q "PONG"; then
+      echo -e "${GREEN}valkey-streams is ready!${NC}"
+      break
+    fi
+    sleep 1
+    if [ $i -eq 10 ]; then
+      echo -e "${RED}valkey-streams failed to start within 10 seconds${NC}"
+      exit 1
+    fi
+  done
+fi
+
+if [[ "$MODE" == "prod" ]]; then
+  echo -e "${GREEN}Starting application with ${WORKERS} workers...${NC}"
+  exec uvicorn app.main:app \
+    --host "${HOST:-localhost}" \
+    --port "${PORT:-8000}" \
+    --ssl-keyfile certs/ChatApp-Server.key \
+    --ssl-certfile certs/ChatApp-Server.crt \
+    --workers "$WORKERS" \
+    --timeout-graceful-shutdown 10
+fi
 
 echo -e "${GREEN}Starting application...${NC}"
 uvicorn app.main:app \